@@ -0,0 +1,310 @@
+import io
+import os
+import json
+import time
+import socket
+import struct
+import tarfile
+import logging
+import selectors
+import itertools
+from typing import Dict, Any, Optional, Tuple, Iterator
+
+from invocation_logs import LogBuffer
+
+logger = logging.getLogger(__name__)
+
+RUNTIME_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runtime")
+AGENT_INSTALL_DIR = "/opt/runtime"
+
+# Command used to start the agent inside a container, per language
+AGENT_COMMANDS = {
+    "python": ["python", "-u", f"{AGENT_INSTALL_DIR}/agent.py"],
+    "javascript": ["node", f"{AGENT_INSTALL_DIR}/agent.js"],
+}
+
+AGENT_START_TIMEOUT = float(os.getenv("AGENT_START_TIMEOUT", "30"))
+# Extra time the host waits past a function's deadline for the agent to report the timeout itself
+AGENT_TIMEOUT_GRACE = float(os.getenv("AGENT_TIMEOUT_GRACE", "2"))
+# Largest frame accepted from an agent, so a misbehaving one cannot exhaust API memory
+AGENT_MAX_FRAME_SIZE = int(os.getenv("AGENT_MAX_FRAME_SIZE", str(256 * 1024 * 1024)))
+
+FRAME_HEADER = struct.Struct(">I")
+# Docker multiplexes stdout/stderr of a non-tty exec: 1 byte stream, 3 padding, 4 byte length
+STREAM_HEADER = struct.Struct(">BxxxI")
+STDOUT = 1
+STDERR = 2
+
+
+class AgentError(RuntimeError):
+    """The agent process died or broke the protocol; its container should be recycled."""
+
+
+class AgentTimeout(AgentError):
+    """The agent did not answer before the deadline; whatever it is running must be killed."""
+
+
+class FunctionError(Exception):
+    """The user function raised, or its code could not be loaded."""
+
+
+class FunctionTimeout(FunctionError):
+    """The agent interrupted the user function at its deadline and is still usable."""
+
+
+_agent_archive = None
+
+
+def agent_archive() -> bytes:
+    """Tar archive with the runtime agents, ready for ``put_archive``."""
+    global _agent_archive
+    if _agent_archive is None:
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as tar:
+            tar.add(
+                RUNTIME_DIR,
+                arcname=os.path.basename(AGENT_INSTALL_DIR),
+                filter=lambda info: None if "__pycache__" in info.name else info,
+            )
+        _agent_archive = buffer.getvalue()
+    return _agent_archive
+
+
+class DockerExecTransport:
+    """An agent's stdio over a ``docker exec`` socket, with stdout and stderr demultiplexed."""
+
+    def __init__(self, sock):
+        self._sock = sock
+
+    def send(self, data: bytes):
+        self._sock.sendall(data)
+
+    def read(self, timeout: Optional[float]) -> Tuple[int, bytes]:
+        """Next piece of output as ``(stream, data)``. Raises ``socket.timeout`` past ``timeout`` seconds."""
+        self._sock.settimeout(timeout)
+        stream, size = STREAM_HEADER.unpack(self._recv_exactly(STREAM_HEADER.size))
+        return stream, self._recv_exactly(size)
+
+    def close(self):
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+    def _recv_exactly(self, size: int) -> bytes:
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = self._sock.recv(remaining)
+            if not chunk:
+                raise AgentError("Agent exited unexpectedly")
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+
+class PipeTransport:
+    """An agent's stdio over the pipes of a local child process."""
+
+    def __init__(self, process):
+        self.process = process
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(process.stdout, selectors.EVENT_READ, STDOUT)
+        self._selector.register(process.stderr, selectors.EVENT_READ, STDERR)
+
+    def send(self, data: bytes):
+        self.process.stdin.write(data)
+        self.process.stdin.flush()
+
+    def read(self, timeout: Optional[float]) -> Tuple[int, bytes]:
+        """Next piece of output as ``(stream, data)``. Raises ``socket.timeout`` past ``timeout`` seconds.
+
+        When both pipes are readable, stderr is read first: the agent flushes it
+        before writing a frame, so output is not taken for the next request's.
+        """
+        while self._selector.get_map():
+            events = self._selector.select(timeout)
+            if not events:
+                raise socket.timeout()
+            for key, _ in sorted(events, key=lambda event: event[0].data != STDERR):
+                data = os.read(key.fd, 65536)
+                if data:
+                    return key.data, data
+                self._selector.unregister(key.fileobj)
+        raise AgentError("Agent exited unexpectedly")
+
+    def close(self):
+        self._selector.close()
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+
+class AgentConnection:
+    """Framed request/response channel to an agent running in a sandbox.
+
+    The runtime backend starts the agent and hands over a transport to its
+    stdio. Requests are written to its stdin and responses read from its
+    stdout; whatever it writes to stderr, which is where the function's
+    stdout and stderr both go, is collected into a size-capped log buffer per
+    request. A streaming invocation gets any number of ``chunk`` frames before
+    its final response.
+    """
+
+    def __init__(self, transport, language: str):
+        self.transport = transport
+        self.language = language
+        self.pid = None
+        self.runtime = None
+        self._stdout = bytearray()
+        self._log = LogBuffer()
+        self._ids = itertools.count(1)
+        self._closed = False
+
+    @property
+    def alive(self) -> bool:
+        return not self._closed
+
+    def start(self) -> "AgentConnection":
+        """Wait for the freshly started agent to report ready."""
+        self._log = LogBuffer()
+        ready = self._read_frame(None, time.monotonic() + AGENT_START_TIMEOUT)
+        if ready.get("type") != "ready":
+            self.close()
+            raise AgentError(f"Unexpected agent handshake: {ready}")
+        self.pid = ready.get("pid")
+        self.runtime = ready.get("runtime")
+        logger.info(f"Agent started (pid {self.pid}, {self.language} {self.runtime})")
+        return self
+
+    def load(self, code: str, timeout: Optional[float] = None, fork: bool = False,
+             memory_limit: Optional[int] = None, log: Optional[LogBuffer] = None) -> str:
+        """Load function code into the agent. Returns anything the code printed while loading.
+
+        With ``fork`` the agent runs every later invocation in a fresh fork of
+        itself, whose address space may grow by at most ``memory_limit`` bytes.
+        The output also goes to ``log``, if given.
+        """
+        message = {"type": "load", "code": code, "timeout": timeout}
+        if fork:
+            message.update(fork=True, memory_limit=memory_limit)
+        _, output = self.request(message, timeout, log)
+        return output
+
+    def invoke(self, input_data: Dict[str, Any], timeout: Optional[float] = None,
+               profile: bool = False, log: Optional[LogBuffer] = None) -> Tuple[Dict[str, Any], str]:
+        """Call the loaded function and return the agent's response and printed output.
+
+        The response carries the function's ``result`` and the ``usage`` the
+        agent measured for the call, plus its hottest frames as ``profile`` if
+        asked to profile it. The agent is asked to interrupt the function after
+        ``timeout`` seconds; if it has not answered shortly after that,
+        ``AgentTimeout`` is raised. Printed output is written to ``log`` as it
+        arrives, if given.
+        """
+        message = {"type": "invoke", "input": input_data, "timeout": timeout}
+        if profile:
+            message["profile"] = True
+        return self.request(message, timeout, log)
+
+    def invoke_stream(self, input_data: Dict[str, Any], timeout: Optional[float] = None,
+                      profile: bool = False, log: Optional[LogBuffer] = None) -> Iterator[Dict[str, Any]]:
+        """Call the loaded function, yielding each ``chunk`` frame as it arrives and then the final response.
+
+        Functions that return a generator stream one chunk per yielded item.
+        ``output`` holds what the function printed once the final response is in.
+        """
+        message = {"type": "invoke", "input": input_data, "timeout": timeout, "stream": True}
+        if profile:
+            message["profile"] = True
+        return self.stream(message, timeout, log)
+
+    def request(self, message: Dict[str, Any], timeout: Optional[float] = None,
+                log: Optional[LogBuffer] = None) -> Tuple[Dict[str, Any], str]:
+        for response in self.stream(message, timeout, log):
+            pass
+        return response, self.output
+
+    def stream(self, message: Dict[str, Any], timeout: Optional[float] = None,
+               log: Optional[LogBuffer] = None) -> Iterator[Dict[str, Any]]:
+        if not self.alive:
+            raise AgentError("Agent is not running")
+        message = dict(message, id=next(self._ids))
+        payload = json.dumps(message).encode("utf-8")
+        self._log = log if log is not None else LogBuffer()
+        try:
+            self.transport.send(FRAME_HEADER.pack(len(payload)) + payload)
+        except OSError as e:
+            self.close()
+            raise AgentError(f"Could not send request to agent: {str(e)}")
+
+        deadline = time.monotonic() + timeout + AGENT_TIMEOUT_GRACE if timeout is not None else None
+        while True:
+            response = self._read_frame(message["id"], deadline)
+            if response.get("type") == "chunk":
+                yield response
+                continue
+            if response.get("type") == "error":
+                if response.get("timeout"):
+                    raise FunctionTimeout(response.get("error", "Function timed out"))
+                raise FunctionError(response.get("error", "Function failed"))
+            yield response
+            return
+
+    @property
+    def output(self) -> str:
+        """What the agent wrote to stderr while handling the current request, truncated past the log limit."""
+        return self._log.text()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.transport.close()
+
+    # ------------------------------------------------------------------ stream decoding
+
+    def _read_frame(self, request_id, deadline: Optional[float]) -> Dict[str, Any]:
+        try:
+            while True:
+                frame = self._next_frame(deadline)
+                if request_id is None or frame.get("id") == request_id:
+                    return frame
+                logger.warning(f"Discarding stale agent frame: {frame.get('type')}")
+        except socket.timeout:
+            self.close()
+            raise AgentTimeout("Agent did not respond before the deadline")
+        except AgentError:
+            self.close()
+            raise
+        except OSError as e:
+            self.close()
+            raise AgentError(f"Agent connection failed: {str(e)}")
+
+    def _next_frame(self, deadline: Optional[float]) -> Dict[str, Any]:
+        while True:
+            if len(self._stdout) >= FRAME_HEADER.size:
+                (size,) = FRAME_HEADER.unpack_from(self._stdout)
+                if size > AGENT_MAX_FRAME_SIZE:
+                    self.close()
+                    raise AgentError(f"Agent frame of {size} bytes exceeds the {AGENT_MAX_FRAME_SIZE} byte limit")
+                end = FRAME_HEADER.size + size
+                if len(self._stdout) >= end:
+                    payload = bytes(self._stdout[FRAME_HEADER.size:end])
+                    del self._stdout[:end]
+                    try:
+                        return json.loads(payload.decode("utf-8"))
+                    except ValueError as e:
+                        self.close()
+                        raise AgentError(f"Malformed agent frame: {str(e)}")
+            timeout = None
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    raise socket.timeout()
+            stream, data = self.transport.read(timeout)
+            if stream == STDOUT:
+                self._stdout += data
+            else:
+                self._log.write(data)
@@ -0,0 +1,176 @@
+import os
+import json
+import queue
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Callable, Iterator, Tuple, AsyncIterator
+
+from concurrency import ExecutionLimiter, ExecutionRejected, FUNCTION_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+BATCH_PARALLELISM = int(os.getenv("BATCH_PARALLELISM", "4"))
+# Lanes beyond the per-function concurrency limit would only wait for admission
+BATCH_MAX_PARALLELISM = int(os.getenv("BATCH_MAX_PARALLELISM", str(FUNCTION_CONCURRENCY)))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+
+_END = object()
+
+
+class BatchInputs:
+    """Thread-safe iterator of ``(index, input_data)`` pairs, filled from the event loop and shared by lanes."""
+
+    def __init__(self, max_items: int = BATCH_MAX_ITEMS):
+        self.max_items = max_items
+        self.count = 0
+        self._queue: "queue.Queue" = queue.Queue()
+
+    def put(self, input_data: Any):
+        if self.count >= self.max_items:
+            raise ValueError(f"Batch exceeds the limit of {self.max_items} inputs")
+        self._queue.put((self.count, input_data))
+        self.count += 1
+
+    def close(self):
+        """No more inputs; lanes stop once they have taken what is queued."""
+        self._queue.put(_END)
+
+    def remaining(self) -> Iterator[Tuple[int, Any]]:
+        """Inputs no lane has taken, without waiting for more."""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not _END:
+                yield item
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> Tuple[int, Any]:
+        item = self._queue.get()
+        if item is _END:
+            # Leave the marker for the other lanes
+            self._queue.put(_END)
+            raise StopIteration
+        return item
+
+
+class Batch:
+    """One execute_batch request: a queue of inputs drained by ``parallelism`` lanes.
+
+    Every lane is admitted by the execution limiter like a single invocation and
+    then keeps its warm container for as many inputs as it can take, so the
+    function lookup, pool checkout and code load are paid once per lane rather
+    than once per input. Results can start flowing before all inputs are in.
+    """
+
+    def __init__(self, limiter: ExecutionLimiter, function_id: str,
+                 lane: Callable[[BatchInputs], Iterator[Tuple[int, Dict[str, Any]]]],
+                 parallelism: int = BATCH_PARALLELISM, ordered: bool = True, max_items: int = BATCH_MAX_ITEMS):
+        self.limiter = limiter
+        self.function_id = function_id
+        self.lane = lane
+        self.parallelism = parallelism
+        self.ordered = ordered
+        self.inputs = BatchInputs(max_items)
+        self._results: Optional[asyncio.Queue] = None
+        self._tasks = []
+        self._rejection: Optional[ExecutionRejected] = None
+        self._failure: Optional[Exception] = None
+
+    def start(self):
+        self._results = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._drive()) for _ in range(self.parallelism)]
+
+    async def _drive(self):
+        try:
+            async for item in self.limiter.stream(self.function_id, self.lane, self.inputs):
+                await self._results.put(item)
+        except ExecutionRejected as e:
+            # The other lanes take this lane's share
+            self._rejection = e
+        except Exception as e:
+            logger.error(f"Batch lane for function {self.function_id} failed: {str(e)}")
+            self._failure = e
+        finally:
+            await self._results.put(None)
+
+    async def results(self) -> AsyncIterator[Dict[str, Any]]:
+        """Outcomes as ``{"index": i, ...}``, in input order if ``ordered``, otherwise as they complete.
+
+        Raises ``ExecutionRejected`` if no lane was admitted at all.
+        """
+        pending: Dict[int, Dict[str, Any]] = {}
+        next_index = 0
+        emitted = 0
+        running = len(self._tasks)
+        try:
+            while running:
+                item = await self._results.get()
+                if item is None:
+                    running -= 1
+                    continue
+                index, outcome = item
+                outcome = {"index": index, **outcome}
+                if not self.ordered:
+                    emitted += 1
+                    yield outcome
+                    continue
+                pending[index] = outcome
+                while next_index in pending:
+                    emitted += 1
+                    yield pending.pop(next_index)
+                    next_index += 1
+
+            # Every lane has stopped. Gaps are only left by a lane that failed mid-input.
+            for index in sorted(pending):
+                emitted += 1
+                yield pending[index]
+            if emitted == 0 and self._rejection is not None:
+                raise self._rejection
+            reason = self._failure or self._rejection
+            for index, _ in self.inputs.remaining():
+                yield {"index": index, "error": f"Not executed: {str(reason) if reason else 'batch stopped'}"}
+        finally:
+            await self.close()
+
+    async def close(self):
+        """Stop the lanes after their current input; anything still queued is dropped."""
+        for _ in self.inputs.remaining():
+            pass
+        self.inputs.close()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def feed_json_array(body: bytes, inputs: BatchInputs):
+    items = json.loads(body)
+    if not isinstance(items, list):
+        raise ValueError("Batch body must be a JSON array of inputs")
+    for item in items:
+        inputs.put(item)
+
+
+async def feed_ndjson(chunks: AsyncIterator[bytes], inputs: BatchInputs):
+    """Queue one input per line of an NDJSON body as the lines arrive."""
+    partial = b""
+    line_number = 0
+    async for chunk in chunks:
+        lines = (partial + chunk).split(b"\n")
+        partial = lines.pop()
+        for line in lines:
+            line_number += 1
+            _put_line(inputs, line, line_number)
+    _put_line(inputs, partial, line_number + 1)
+
+
+def _put_line(inputs: BatchInputs, line: bytes, line_number: int):
+    if not line.strip():
+        return
+    try:
+        inputs.put(json.loads(line))
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid JSON on line {line_number}: {str(e)}")
@@ -0,0 +1,201 @@
+"""Stand-in for the Docker SDK client, so the execution path can be benchmarked without a daemon.
+
+Only what the platform calls is implemented. A "container" is a scratch
+directory: ``put_archive`` unpacks into it and ``exec_start`` runs the real
+agent from it as a local process, behind a socket that speaks Docker's
+multiplexed stream format. Everything from ``DockerBackend`` up is therefore
+the code that runs in production; only the daemon's own work is missing,
+which ``start_latency`` can stand in for.
+"""
+import io
+import itertools
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+from typing import Dict, Any, List, Optional
+
+import docker
+
+STREAM_HEADER = struct.Struct(">BxxxI")  # stream type (1 = stdout, 2 = stderr), payload size
+
+
+class FakeContainer:
+    def __init__(self, client: "FakeDockerClient", container_id: str, image: str, name: Optional[str],
+                 labels: Dict[str, str]):
+        self.client = client
+        self.id = container_id
+        self.name = name or container_id
+        self.image = image
+        self.labels = labels
+        self.root = tempfile.mkdtemp(prefix=f"fake-docker-{container_id}-")
+        self.processes: List[subprocess.Popen] = []
+        self.status = "running"
+        self.limits: Dict[str, Any] = {}
+
+    def put_archive(self, path: str, data: bytes) -> bool:
+        target = self.path(path)
+        os.makedirs(target, exist_ok=True)
+        with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+            archive.extractall(target)
+        return True
+
+    def update(self, **limits) -> Dict[str, Any]:
+        # Limits are recorded, not enforced
+        self.limits.update(limits)
+        return {"Warnings": None}
+
+    def path(self, path: str) -> str:
+        """Where an absolute path inside the container lives on this host."""
+        return os.path.join(self.root, path.lstrip("/"))
+
+    def remove(self, force: bool = False):
+        for process in self.processes:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        self.processes.clear()
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.status = "removed"
+        self.client.containers.forget(self)
+
+
+class FakeContainers:
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+        self._ids = itertools.count(1)
+        self._containers: Dict[str, FakeContainer] = {}
+        self._lock = threading.Lock()
+
+    def run(self, image: str, detach: bool = True, name: Optional[str] = None, labels: Optional[Dict[str, str]] = None,
+            **kwargs) -> FakeContainer:
+        if self.client.start_latency:
+            time.sleep(self.client.start_latency)
+        container = FakeContainer(self.client, f"fake{next(self._ids):06d}", image, name, dict(labels or {}))
+        container.limits = {key: kwargs[key] for key in ("mem_limit", "cpu_quota") if key in kwargs}
+        with self._lock:
+            self._containers[container.id] = container
+        return container
+
+    def get(self, container_id: str) -> FakeContainer:
+        with self._lock:
+            container = self._containers.get(container_id)
+        if container is None:
+            raise docker.errors.NotFound(f"No such container: {container_id}")
+        return container
+
+    def list(self, all: bool = False, filters: Optional[Dict[str, Any]] = None) -> List[FakeContainer]:
+        label = (filters or {}).get("label")
+        with self._lock:
+            containers = list(self._containers.values())
+        return [c for c in containers if label is None or label.split("=")[0] in c.labels]
+
+    def forget(self, container: FakeContainer):
+        with self._lock:
+            self._containers.pop(container.id, None)
+
+
+class FakeImages:
+    """Base images are always present; building dependency images is not supported."""
+
+    def get(self, name: str) -> str:
+        return name
+
+    def pull(self, name: str, **kwargs) -> str:
+        return name
+
+    def build(self, **kwargs):
+        raise docker.errors.BuildError("The fake Docker client cannot build images", [])
+
+
+class FakeAPIClient:
+    """The low-level ``exec`` calls the agent connection uses."""
+
+    def __init__(self, client: "FakeDockerClient"):
+        self.client = client
+        self._ids = itertools.count(1)
+        self._execs: Dict[str, Any] = {}
+
+    def exec_create(self, container_id: str, cmd: List[str], **kwargs) -> Dict[str, str]:
+        exec_id = f"exec{next(self._ids):06d}"
+        self._execs[exec_id] = (self.client.containers.get(container_id), list(cmd))
+        return {"Id": exec_id}
+
+    def exec_start(self, exec_id: str, socket: bool = False, tty: bool = False, **kwargs):
+        container, cmd = self._execs.pop(exec_id)
+        # Interpreters come from this host; the agent script from what was put into the container
+        cmd = [container.path(arg) if arg.startswith("/") else arg for arg in cmd]
+        if cmd[0] == "python":
+            cmd[0] = sys.executable
+        process = subprocess.Popen(cmd, cwd=container.root, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE, start_new_session=True)
+        container.processes.append(process)
+        return _multiplex(process)
+
+
+def _multiplex(process: subprocess.Popen):
+    """A socket carrying the process's stdin one way and its framed stdout/stderr the other."""
+    ours, theirs = socket.socketpair()
+    sending = threading.Lock()  # keeps stdout and stderr frames whole
+
+    def pump(stream, kind: int):
+        try:
+            while True:
+                data = stream.read1(65536)
+                if not data:
+                    break
+                with sending:
+                    theirs.sendall(STREAM_HEADER.pack(kind, len(data)) + data)
+        except OSError:
+            pass
+        finally:
+            if kind == 1:
+                # Like the daemon, hang up once the process's stdout is closed
+                try:
+                    theirs.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+
+    def feed():
+        try:
+            while True:
+                data = theirs.recv(65536)
+                if not data:
+                    break
+                process.stdin.write(data)
+                process.stdin.flush()
+        except OSError:
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            theirs.close()
+
+    for target, args in ((pump, (process.stdout, 1)), (pump, (process.stderr, 2)), (feed, ())):
+        threading.Thread(target=target, args=args, name="fake-docker-exec", daemon=True).start()
+    return ours
+
+
+class FakeDockerClient:
+    """Drop-in for ``docker.DockerClient``; ``start_latency`` seconds are added to every container start."""
+
+    def __init__(self, start_latency: float = 0.0):
+        self.start_latency = start_latency
+        self.containers = FakeContainers(self)
+        self.images = FakeImages()
+        self.api = FakeAPIClient(self)
+
+    def ping(self) -> bool:
+        return True
+
+    def close(self):
+        for container in self.containers.list(all=True):
+            container.remove(force=True)
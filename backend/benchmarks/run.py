@@ -0,0 +1,359 @@
+"""Load test for the execution path.
+
+Drives the API with a seeded mix of workloads at a fixed concurrency and
+reports throughput plus p50/p95/p99 latency, end to end and for every stage
+of each invocation's trace. The app runs in this process against the fake
+Docker client (the default), a real daemon or the process backend, or
+``--url`` points at a running server. Results are written as JSON, and
+``--baseline`` compares them with an earlier run, exiting with status 1 on a
+regression, e.g.::
+
+    python benchmarks/run.py --requests 500 --concurrency 16 --output bench.json
+    python benchmarks/run.py --baseline bench.json --mix python-cpu=3,node-cpu=1
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx
+
+from workloads import Workload, build_workloads
+
+logger = logging.getLogger("benchmarks")
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Linearly interpolated percentile of ``values``, None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def summarize(values: List[float]) -> Dict[str, Optional[float]]:
+    summary = {f"p{p}": percentile(values, p) for p in PERCENTILES}
+    summary["mean"] = sum(values) / len(values) if values else None
+    summary["max"] = max(values) if values else None
+    return summary
+
+
+def flatten_spans(spans: List[Dict[str, Any]], into: Dict[str, float]) -> Dict[str, float]:
+    """Span durations by name, nested spans included."""
+    for span in spans:
+        into[span["name"]] = into.get(span["name"], 0.0) + span["duration"]
+        flatten_spans(span.get("children", []), into)
+    return into
+
+
+class Sample:
+    def __init__(self, workload: str, latency: float, status_code: int, stages: Dict[str, float],
+                 cold_start: Optional[bool], error: Optional[str] = None):
+        self.workload = workload
+        self.latency = latency
+        self.status_code = status_code
+        self.stages = stages
+        self.cold_start = cold_start
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class Benchmark:
+    """Deploys the workloads' functions through the API and invokes them from ``concurrency`` workers."""
+
+    def __init__(self, client: httpx.AsyncClient, workloads: Dict[str, Workload], concurrency: int):
+        self.client = client
+        self.workloads = workloads
+        self.concurrency = concurrency
+        self.function_ids: Dict[str, int] = {}
+        self._cold_deploys = 0
+
+    async def deploy(self, workload: Workload, suffix: str = "") -> int:
+        response = await self.client.post("/functions/", json=workload.function(suffix))
+        response.raise_for_status()
+        return response.json()["id"]
+
+    async def setup(self, warmup: int):
+        for name, workload in self.workloads.items():
+            if workload.cold:
+                continue
+            self.function_ids[name] = await self.deploy(workload)
+            for _ in range(warmup):
+                await self.invoke(workload)
+
+    async def invoke(self, workload: Workload) -> Sample:
+        if workload.cold:
+            # Deploying is not part of the measured call
+            self._cold_deploys += 1
+            function_id = await self.deploy(workload, f"-{self._cold_deploys}")
+        else:
+            function_id = self.function_ids[workload.name]
+
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(f"/functions/{function_id}/execute", json=workload.make_input())
+        except httpx.HTTPError as e:
+            return Sample(workload.name, time.perf_counter() - start, 0, {}, None, f"{type(e).__name__}: {e}")
+        latency = time.perf_counter() - start
+
+        if response.status_code != 200:
+            return Sample(workload.name, latency, response.status_code, {}, None, response.text[:200])
+        body = response.json()
+        trace = body.get("trace") or {}
+        stages = flatten_spans(trace.get("spans", []), {})
+        cold_start = next((span.get("attributes", {}).get("cold_start") for span in trace.get("spans", [])
+                           if span["name"] == "pool_acquire"), None)
+        return Sample(workload.name, latency, response.status_code, stages, cold_start)
+
+    async def run(self, schedule: List[str]) -> Tuple[List[Sample], float]:
+        queue: asyncio.Queue = asyncio.Queue()
+        for name in schedule:
+            queue.put_nowait(name)
+        samples: List[Sample] = []
+
+        async def worker():
+            while not queue.empty():
+                samples.append(await self.invoke(self.workloads[queue.get_nowait()]))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return samples, time.perf_counter() - start
+
+
+def report(samples: List[Sample], duration: float) -> Dict[str, Any]:
+    def section(group: List[Sample]) -> Dict[str, Any]:
+        ok = [s for s in group if s.ok]
+        stages: Dict[str, List[float]] = {}
+        for sample in ok:
+            for stage, seconds in sample.stages.items():
+                stages.setdefault(stage, []).append(seconds)
+        errors: Dict[str, int] = {}
+        for sample in group:
+            if not sample.ok:
+                errors[str(sample.status_code)] = errors.get(str(sample.status_code), 0) + 1
+        return {
+            "requests": len(group),
+            "errors": errors,
+            "throughput": len(ok) / duration if duration else None,
+            "cold_starts": sum(1 for s in ok if s.cold_start),
+            "latency": summarize([s.latency for s in ok]),
+            "stages": {stage: summarize(values) for stage, values in sorted(stages.items())},
+        }
+
+    by_workload: Dict[str, List[Sample]] = {}
+    for sample in samples:
+        by_workload.setdefault(sample.workload, []).append(sample)
+    return {
+        "duration": duration,
+        "overall": section(samples),
+        "workloads": {name: section(group) for name, group in sorted(by_workload.items())},
+    }
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Workloads whose p95 latency rose or throughput fell by more than ``tolerance`` against the baseline."""
+    regressions = []
+    for name, current in results["workloads"].items():
+        before = baseline.get("workloads", {}).get(name)
+        if not before:
+            continue
+        p95, base_p95 = current["latency"]["p95"], before["latency"]["p95"]
+        if p95 is not None and base_p95 and p95 > base_p95 * (1 + tolerance):
+            regressions.append(f"{name}: p95 latency {base_p95 * 1000:.1f} ms -> {p95 * 1000:.1f} ms")
+        rate, base_rate = current["throughput"], before["throughput"]
+        if rate is not None and base_rate and rate < base_rate * (1 - tolerance):
+            regressions.append(f"{name}: throughput {base_rate:.1f}/s -> {rate:.1f}/s")
+    return regressions
+
+
+def parse_mix(mix: Optional[str], workloads: Dict[str, Workload]) -> Dict[str, float]:
+    """``name=weight,...`` into weights; every workload weighs 1 by default."""
+    if not mix:
+        return {name: 1.0 for name in workloads}
+    weights = {}
+    for entry in mix.split(","):
+        name, _, weight = entry.strip().partition("=")
+        if name not in workloads:
+            raise SystemExit(f"Unknown workload {name!r}; choose from {', '.join(workloads)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def build_schedule(weights: Dict[str, float], requests: int, seed: int) -> List[str]:
+    """``requests`` workload names in proportion to ``weights``, in a seeded random order."""
+    names = list(weights)
+    total = sum(weights.values())
+    counts = {name: int(requests * weights[name] / total) for name in names}
+    # Hand out what rounding left over to the heaviest workloads
+    for name in sorted(names, key=lambda n: weights[n], reverse=True)[:requests - sum(counts.values())]:
+        counts[name] += 1
+    schedule = [name for name in names for _ in range(counts[name])]
+    random.Random(seed).shuffle(schedule)
+    return schedule
+
+
+def start_app(args):
+    """Import the app in this process on the chosen backend, with a throwaway database unless one is given."""
+    os.environ["RUNTIME_BACKEND"] = "process" if args.backend == "process" else "docker"
+    if args.backend == "fake":
+        import docker
+        from fake_docker import FakeDockerClient
+
+        fake = FakeDockerClient(start_latency=args.fake_start_latency)
+        docker.from_env = lambda *a, **kw: fake
+        docker.DockerClient = lambda *a, **kw: fake
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+        import database
+    else:
+        from sqlalchemy import create_engine
+        from sqlalchemy.orm import sessionmaker
+        from sqlalchemy.pool import StaticPool
+        import database
+
+        database.engine = create_engine("sqlite://", connect_args={"check_same_thread": False},
+                                        poolclass=StaticPool)
+        database.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=database.engine)
+    import models
+
+    models.Base.metadata.create_all(database.engine)
+    import main
+    return main
+
+
+def stop_app(main):
+    main.shutdown_services()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, workloads: Dict[str, Workload], schedule: List[str]) -> Dict[str, Any]:
+    main = None
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+    else:
+        main = start_app(args)
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://benchmark",
+                                   timeout=args.timeout)
+    try:
+        async with client:
+            benchmark = Benchmark(client, {name: workloads[name] for name in set(schedule)}, args.concurrency)
+            await benchmark.setup(args.warmup)
+            samples, duration = await benchmark.run(schedule)
+    finally:
+        if main is not None:
+            stop_app(main)
+    return report(samples, duration)
+
+
+def print_summary(results: Dict[str, Any]):
+    def ms(value):
+        return f"{value * 1000:8.1f}" if value is not None else "       -"
+
+    print(f"{'workload':<14}{'reqs':>6}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for name, section in list(results["workloads"].items()) + [("overall", results["overall"])]:
+        latency = section["latency"]
+        print(f"{name:<14}{section['requests']:>6}{sum(section['errors'].values()):>8}"
+              f"{section['throughput'] or 0:>9.1f}{ms(latency['p50'])} {ms(latency['p95'])} {ms(latency['p99'])}")
+    print("\nstage p50/p95/p99 ms (overall)")
+    for stage, summary in results["overall"]["stages"].items():
+        print(f"  {stage:<16}{ms(summary['p50'])} {ms(summary['p95'])} {ms(summary['p99'])}")
+
+
+def parse_args(argv=None):
+    names = ", ".join(build_workloads())
+    parser = argparse.ArgumentParser(description="Benchmark the function execution path.")
+    parser.add_argument("--backend", choices=("fake", "docker", "process"), default="fake",
+                        help="runtime for the in-process app: the fake Docker client, a real daemon or local processes")
+    parser.add_argument("--url", help="benchmark a running server instead of starting the app in this process")
+    parser.add_argument("--database-url", help="database for the in-process app (default: in-memory SQLite)")
+    parser.add_argument("--fake-start-latency", type=float, default=0.0,
+                        help="seconds the fake Docker client takes to start a container")
+    parser.add_argument("--requests", type=int, default=200, help="measured invocations in total")
+    parser.add_argument("--concurrency", type=int, default=8, help="invocations in flight at once")
+    parser.add_argument("--warmup", type=int, default=3, help="unmeasured invocations per warm workload")
+    parser.add_argument("--mix", help=f"comma-separated name=weight; workloads: {names}")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the order of invocations")
+    parser.add_argument("--cpu-iterations", type=int, default=200_000)
+    parser.add_argument("--sleep-ms", type=int, default=50)
+    parser.add_argument("--small-payload", type=int, default=256, help="bytes")
+    parser.add_argument("--large-payload", type=int, default=256 * 1024, help="bytes")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds to wait for one response")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative change against the baseline that counts as a regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    workloads = build_workloads(args.cpu_iterations, args.sleep_ms, args.small_payload, args.large_payload)
+    weights = parse_mix(args.mix, workloads)
+    schedule = build_schedule(weights, args.requests, args.seed)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "revision": git_revision(),
+            "target": args.url or args.backend,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "mix": weights,
+            "parameters": {"cpu_iterations": args.cpu_iterations, "sleep_ms": args.sleep_ms,
+                           "small_payload": args.small_payload, "large_payload": args.large_payload,
+                           "fake_start_latency": args.fake_start_latency},
+        },
+    }
+    results.update(asyncio.run(run(args, workloads, schedule)))
+    print_summary(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\nRegressions against {args.baseline}:")
+            for regression in regressions:
+                print(f"  {regression}")
+            return 1
+        print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
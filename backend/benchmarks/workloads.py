@@ -0,0 +1,95 @@
+"""The functions a benchmark run invokes, one per combination of language and kind of work."""
+from typing import Dict, Any, Callable, List
+
+LANGUAGES = {"python": "python", "node": "javascript"}
+
+CODE = {
+    ("python", "noop"): """
+def main(input_data):
+    return {"ok": True}
+""",
+    ("python", "cpu"): """
+def main(input_data):
+    total = 0
+    for i in range(input_data["iterations"]):
+        total += i * i
+    return {"total": total}
+""",
+    ("python", "sleep"): """
+import time
+
+def main(input_data):
+    time.sleep(input_data["ms"] / 1000)
+    return {"slept": input_data["ms"]}
+""",
+    ("python", "echo"): """
+def main(input_data):
+    return input_data
+""",
+    ("javascript", "noop"): """
+function main(inputData) {
+    return { ok: true };
+}
+""",
+    ("javascript", "cpu"): """
+function main(inputData) {
+    let total = 0;
+    for (let i = 0; i < inputData.iterations; i++) {
+        total += i * i;
+    }
+    return { total };
+}
+""",
+    ("javascript", "sleep"): """
+async function main(inputData) {
+    await new Promise((resolve) => setTimeout(resolve, inputData.ms));
+    return { slept: inputData.ms };
+}
+""",
+    ("javascript", "echo"): """
+function main(inputData) {
+    return inputData;
+}
+""",
+}
+
+
+class Workload:
+    """One entry of the mix.
+
+    A warm workload deploys its function once and warms it up before
+    measuring; a cold one deploys a fresh function for every invocation, so
+    each measured call pays for binding and loading code into a container.
+    """
+
+    def __init__(self, name: str, language: str, kind: str, make_input: Callable[[], Dict[str, Any]],
+                 cold: bool = False):
+        self.name = name
+        self.language = language
+        self.kind = kind
+        self.make_input = make_input
+        self.cold = cold
+
+    @property
+    def code(self) -> str:
+        return CODE[(self.language, self.kind)]
+
+    def function(self, suffix: str = "") -> Dict[str, Any]:
+        """Body for ``POST /functions/``."""
+        name = f"bench-{self.name}{suffix}"
+        return {"name": name, "route": f"/bench/{name}", "language": self.language, "code": self.code, "timeout": 60}
+
+
+def build_workloads(cpu_iterations: int = 200_000, sleep_ms: int = 50, small_payload: int = 256,
+                    large_payload: int = 256 * 1024) -> Dict[str, Workload]:
+    """Every workload, by name: ``<python|node>-<cold|cpu|sleep|small|large>``."""
+    workloads: List[Workload] = []
+    for prefix, language in LANGUAGES.items():
+        workloads += [
+            Workload(f"{prefix}-cold", language, "noop", dict, cold=True),
+            Workload(f"{prefix}-cpu", language, "cpu", lambda: {"iterations": cpu_iterations}),
+            Workload(f"{prefix}-sleep", language, "sleep", lambda: {"ms": sleep_ms}),
+            Workload(f"{prefix}-small", language, "echo", lambda: {"data": "x" * small_payload}),
+            Workload(f"{prefix}-large", language, "echo", lambda: {"data": "x" * large_payload}),
+        ]
+    return {workload.name: workload for workload in workloads}
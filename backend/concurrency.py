@@ -0,0 +1,184 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import functools
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, AsyncIterator, Iterator
+
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_WORKERS = int(os.getenv("EXECUTION_WORKERS", "32"))
+EXECUTION_QUEUE_SIZE = int(os.getenv("EXECUTION_QUEUE_SIZE", "256"))
+FUNCTION_CONCURRENCY = int(os.getenv("FUNCTION_CONCURRENCY", "8"))
+FUNCTION_QUEUE_SIZE = int(os.getenv("FUNCTION_QUEUE_SIZE", "64"))
+EXECUTION_QUEUE_TIMEOUT = float(os.getenv("EXECUTION_QUEUE_TIMEOUT", "30"))
+
+
+class ExecutionRejected(Exception):
+    """An invocation was not admitted; maps to an HTTP error with Retry-After."""
+
+    def __init__(self, message: str, status_code: int, retry_after: int):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class _FunctionSlot:
+    def __init__(self, limit: int):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.pending = 0  # running + waiting invocations of this function
+
+
+class ExecutionLimiter:
+    """Runs blocking invocations on a dedicated thread pool with admission control.
+
+    At most ``max_workers`` invocations run at once, and at most
+    ``per_function_limit`` of them for the same function. Up to ``max_queue``
+    more may wait for a slot. Anything beyond that is rejected straight away:
+    429 when a single function is over its own queue share, 503 when the
+    platform as a whole is saturated. Execution never touches the event loop's
+    default thread pool, so other endpoints keep responding under load.
+    """
+
+    def __init__(self, max_workers: int = EXECUTION_WORKERS, max_queue: int = EXECUTION_QUEUE_SIZE,
+                 per_function_limit: int = FUNCTION_CONCURRENCY, per_function_queue: int = FUNCTION_QUEUE_SIZE,
+                 queue_timeout: float = EXECUTION_QUEUE_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.per_function_limit = per_function_limit
+        self.per_function_queue = per_function_queue
+        self.queue_timeout = queue_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="execution")
+
+        self._global = None  # created on first use, inside the running event loop
+        self._functions: Dict[str, _FunctionSlot] = {}
+        self._running = 0
+        self._waiting = 0
+        self._rejected = 0
+        self._timed_out = 0
+        self._avg_duration = 1.0  # exponentially weighted, seconds
+
+    async def run(self, function_id: str, func: Callable, *args, **kwargs) -> Any:
+        """Run ``func(*args, **kwargs)`` on the execution pool once admitted."""
+        async with self._admitted(function_id):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def stream(self, function_id: str, func: Callable[..., Iterator[Any]], *args, **kwargs) -> AsyncIterator[Any]:
+        """Like ``run`` for a ``func`` returning an iterator, yielding its items as they are produced.
+
+        The iterator is consumed on a single execution thread and holds its slot
+        until it is exhausted. If the caller stops early, the iterator is closed
+        after the item it is currently producing.
+        """
+        async with self._admitted(function_id):
+            loop = asyncio.get_running_loop()
+            items: asyncio.Queue = asyncio.Queue()
+            stopped = threading.Event()
+
+            def pump():
+                iterator = func(*args, **kwargs)
+                try:
+                    for item in iterator:
+                        loop.call_soon_threadsafe(items.put_nowait, (True, item))
+                        if stopped.is_set():
+                            break
+                except Exception as e:
+                    loop.call_soon_threadsafe(items.put_nowait, (False, e))
+                    return
+                finally:
+                    if hasattr(iterator, "close"):
+                        iterator.close()
+                loop.call_soon_threadsafe(items.put_nowait, (False, None))
+
+            pumping = loop.run_in_executor(self.executor, pump)
+            try:
+                while True:
+                    more, item = await items.get()
+                    if not more:
+                        if item is not None:
+                            raise item
+                        break
+                    yield item
+            finally:
+                stopped.set()
+                # Keep the slot until the execution thread is really done with the invocation
+                await asyncio.shield(pumping)
+
+    @asynccontextmanager
+    async def _admitted(self, function_id: str):
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.max_workers)
+
+        slot = self._functions.get(function_id)
+        if slot is not None and slot.pending >= self.per_function_limit + self.per_function_queue:
+            self._rejected += 1
+            telemetry.REJECTIONS.labels(function_id, "429").inc()
+            raise ExecutionRejected(f"Too many concurrent invocations of function {function_id}",
+                                    429, self._retry_after(slot.pending))
+        if self._waiting + self._running >= self.max_workers + self.max_queue:
+            self._rejected += 1
+            telemetry.REJECTIONS.labels(function_id, "503").inc()
+            raise ExecutionRejected("Execution queue is full", 503, self._retry_after(self._waiting))
+
+        if slot is None:
+            slot = self._functions[function_id] = _FunctionSlot(self.per_function_limit)
+        slot.pending += 1
+        self._waiting += 1
+        acquired = []
+        queued_at = time.monotonic()
+        try:
+            try:
+                deadline = queued_at + self.queue_timeout
+                for semaphore in (slot.semaphore, self._global):
+                    await asyncio.wait_for(semaphore.acquire(), max(0.0, deadline - time.monotonic()))
+                    acquired.append(semaphore)
+            except asyncio.TimeoutError:
+                self._timed_out += 1
+                telemetry.REJECTIONS.labels(function_id, "503").inc()
+                raise ExecutionRejected(f"Timed out after {self.queue_timeout}s waiting for an execution slot",
+                                        503, self._retry_after(self._waiting))
+            finally:
+                self._waiting -= 1
+
+            self._running += 1
+            start = time.monotonic()
+            telemetry.QUEUE_WAIT_SECONDS.labels("sync").observe(start - queued_at)
+            try:
+                yield
+            finally:
+                self._running -= 1
+                self._avg_duration = 0.9 * self._avg_duration + 0.1 * (time.monotonic() - start)
+        finally:
+            for semaphore in acquired:
+                semaphore.release()
+            slot.pending -= 1
+            if slot.pending == 0:
+                self._functions.pop(function_id, None)
+
+    def _retry_after(self, queued: int) -> int:
+        # Rough time for the queue ahead of the caller to drain
+        return max(1, math.ceil(self._avg_duration * (queued + 1) / self.max_workers))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "per_function_limit": self.per_function_limit,
+            "per_function_queue": self.per_function_queue,
+            "running": self._running,
+            "waiting": self._waiting,
+            "rejected": self._rejected,
+            "timed_out": self._timed_out,
+            "avg_duration": self._avg_duration,
+            "functions": {function_id: slot.pending for function_id, slot in self._functions.items()},
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,640 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, Any, Optional, Tuple, Callable
+
+logger = logging.getLogger(__name__)
+
+# Images used for each supported language
+LANGUAGE_IMAGES = {
+    "python": "python:3.9",
+    "javascript": "node:18",
+}
+
+# Pool sizing, per language. POOL_MIN_<LANGUAGE> / POOL_MAX_<LANGUAGE> override the defaults.
+DEFAULT_POOL_MIN = int(os.getenv("POOL_MIN_SIZE", "2"))
+DEFAULT_POOL_MAX = int(os.getenv("POOL_MAX_SIZE", "20"))
+POOL_IDLE_TTL = float(os.getenv("POOL_IDLE_TTL", "300"))            # seconds an idle container is kept
+POOL_REAP_INTERVAL = float(os.getenv("POOL_REAP_INTERVAL", "15"))   # seconds between eviction passes
+POOL_ACQUIRE_TIMEOUT = float(os.getenv("POOL_ACQUIRE_TIMEOUT", "30"))
+# Replica sets: how far one function may scale out, and how long extra replicas idle before scaling in
+POOL_MAX_REPLICAS = int(os.getenv("POOL_MAX_REPLICAS", "8"))
+POOL_SCALE_IN_IDLE = float(os.getenv("POOL_SCALE_IN_IDLE", "30"))
+# Bytes of memory limits all pooled containers may add up to; 0 leaves only the per-language counts
+POOL_MEMORY_BUDGET = int(os.getenv("POOL_MEMORY_BUDGET", "0"))
+
+# Label used to find containers owned by the pool (including ones left over from a previous run)
+POOL_LABEL = "serverless.pool"
+
+COLD_START_SAMPLES = 1000
+
+
+class PoolExhaustedError(RuntimeError):
+    """Raised when no container could be acquired before the timeout."""
+
+
+class PooledContainer:
+    """A running container tracked by the pool."""
+
+    def __init__(self, container, language: str, image: str, host: Optional[str] = None, limits=None):
+        self.container = container
+        self.id = container.id
+        self.language = language
+        self.image = image
+        self.host = host                # worker host it runs on, with a backend spread over several
+        self.limits = limits            # memory and CPU it may use, see runtime_backends.ResourceLimits
+        self.function_id: Optional[str] = None  # function this container is bound to, if any
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.in_use = False
+        self.use_count = 0
+        self.agent = None            # runtime agent connection, set by the engine's prepare hook
+        self.deployed_hash: Optional[str] = None  # hash of the code loaded into the agent
+        self.prewarmed = False       # started ahead of demand and not used by an invocation yet
+
+
+class ContainerPool:
+    """Language-keyed pool of pre-started containers.
+
+    Each language keeps ``min_size`` unbound, pre-warmed containers ready to be
+    handed out. A container serving a function stays bound to that function and
+    is reused by its later calls. Each container runs one invocation at a time,
+    so the containers bound to a function form its replica set: concurrent calls
+    scale it out to at most ``max_replicas`` containers, after which callers wait
+    for a replica to free up. Extra replicas are scaled back in once idle for
+    ``scale_in_idle`` seconds; a function's last replica is kept for
+    ``idle_ttl`` seconds. The least recently used idle container is evicted when
+    a language reaches ``max_size``, or when the memory limits of all containers
+    would exceed ``memory_budget``, so a budget holds more small containers than
+    large ones. A container handed to a function with different limits is
+    resized in place, or recreated where the backend cannot resize it.
+    ``prepare`` is called on every new container before it is
+    handed out or parked as warm. Containers are created and destroyed through
+    the runtime ``backend``, which may run them as something lighter than Docker containers,
+    or spread them over several hosts; containers are then tracked per host and
+    ``retire_host`` drops those of a host that went away.
+    """
+
+    def __init__(self, backend, images: Optional[Dict[str, str]] = None,
+                 prepare: Optional[Callable[[PooledContainer], None]] = None,
+                 min_size: Optional[Dict[str, int]] = None, max_size: Optional[Dict[str, int]] = None,
+                 idle_ttl: float = POOL_IDLE_TTL, reap_interval: float = POOL_REAP_INTERVAL,
+                 acquire_timeout: float = POOL_ACQUIRE_TIMEOUT, max_replicas: int = POOL_MAX_REPLICAS,
+                 scale_in_idle: float = POOL_SCALE_IN_IDLE, memory_budget: int = POOL_MEMORY_BUDGET):
+        self.backend = backend
+        self.images = dict(images or LANGUAGE_IMAGES)
+        self.prepare = prepare
+        self.min_size = {
+            language: int(os.getenv(f"POOL_MIN_{language.upper()}", DEFAULT_POOL_MIN))
+            for language in self.images
+        }
+        self.max_size = {
+            language: int(os.getenv(f"POOL_MAX_{language.upper()}", DEFAULT_POOL_MAX))
+            for language in self.images
+        }
+        self.min_size.update(min_size or {})
+        self.max_size.update(max_size or {})
+        self.idle_ttl = idle_ttl
+        self.reap_interval = reap_interval
+        self.acquire_timeout = acquire_timeout
+        self.max_replicas = max_replicas
+        self.scale_in_idle = scale_in_idle
+        self.memory_budget = memory_budget
+
+        self._lock = threading.Condition()
+        self._containers: Dict[str, PooledContainer] = {}
+        # Idle containers per language, least recently used first
+        self._idle: Dict[str, "OrderedDict[str, PooledContainer]"] = {
+            language: OrderedDict() for language in self.images
+        }
+        self._pending: Dict[str, int] = {language: 0 for language in self.images}
+        self._pending_memory = 0
+        # Replica set of each function, plus replicas of it still being started
+        self._replicas: Dict[str, Dict[str, PooledContainer]] = {}
+        self._starting: Dict[str, int] = {}
+        # Replica counts a function keeps until a deadline regardless of idleness, set by the pre-warmer
+        self._holds: Dict[str, Tuple[int, float]] = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._scale_outs = 0
+        self._prewarmed = 0
+        self._prewarm_hits = 0
+        self._resizes = 0
+        self._recreates = 0
+        self._cold_starts = deque(maxlen=COLD_START_SAMPLES)
+
+        self._stop = threading.Event()
+        self._reaper = None
+
+    # ------------------------------------------------------------------ lifecycle
+
+    def start(self):
+        """Remove leftover pool containers and start the background warm/evict loop."""
+        self._remove_stale_containers()
+        self._reaper = threading.Thread(target=self._reap_loop, name="container-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def shutdown(self):
+        """Stop the background loop and remove every container owned by the pool."""
+        self._stop.set()
+        if self._reaper is not None:
+            self._reaper.join(timeout=self.reap_interval + 5)
+        with self._lock:
+            containers = list(self._containers.values())
+            self._containers.clear()
+            for idle in self._idle.values():
+                idle.clear()
+            self._lock.notify_all()
+        for pooled in containers:
+            self._destroy(pooled)
+        logger.info(f"Container pool shut down, removed {len(containers)} containers")
+
+    def _remove_stale_containers(self):
+        try:
+            self.backend.remove_stale(POOL_LABEL)
+        except Exception as e:
+            logger.warning(f"Could not remove stale pool containers: {str(e)}")
+
+    # ------------------------------------------------------------------ acquire / release
+
+    def acquire(self, function_id: str, language: str, image: Optional[str] = None,
+                avoid_host: Optional[str] = None, limits=None) -> Tuple[PooledContainer, bool]:
+        """Get a container for ``function_id``, running ``image`` (the language's base image by default).
+
+        An idle replica of the function is used first. Otherwise the replica set
+        scales out with a pre-warmed container, or a cold-started one, unless it
+        is already at ``max_replicas``, in which case this waits for a replica.
+        Pre-warmed containers run the base image, so functions with their own
+        dependency image always cold start new replicas. Containers on ``avoid_host``
+        are passed over, e.g. to retry an invocation elsewhere. The container
+        runs with ``limits``, the backend's defaults if not given.
+        Returns the container and whether it had to be cold started.
+        """
+        if language not in self.images:
+            raise ValueError(f"Unsupported language: {language}")
+        image = image or self.images[language]
+        limits = limits or self.backend.default_limits
+
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._lock:
+            while True:
+                pooled = self._take_replica(function_id, language, image, avoid_host, limits)
+                if pooled is not None:
+                    self._hits += 1
+                    break
+
+                if self._replica_count(function_id) < self.max_replicas:
+                    pooled = self._take_warm(function_id, language, image, avoid_host)
+                    if pooled is not None:
+                        self._hits += 1
+                        self._scale_outs += 1
+                        break
+
+                    if self._make_room(language, limits.memory):
+                        self._reserve(function_id, language, limits)
+                        self._misses += 1
+                        self._scale_outs += 1
+                        break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(f"No {language} container available for function "
+                                             f"{function_id} after {self.acquire_timeout}s")
+                self._lock.wait(remaining)
+
+        if pooled is None:
+            return self._cold_start(function_id, language, image, avoid_host, limits), True
+        return self._fit(pooled, function_id, avoid_host, limits)
+
+    def scale_out(self, function_id: str, language: str, image: Optional[str] = None,
+                  limits=None) -> Optional[PooledContainer]:
+        """Add one replica to ``function_id`` ahead of demand, without waiting or evicting.
+
+        Returns the new replica checked out, so the caller can load code into it
+        before releasing it, or None if the function or language is at its limit.
+        """
+        image = image or self.images[language]
+        limits = limits or self.backend.default_limits
+        with self._lock:
+            if self._replica_count(function_id) >= self.max_replicas:
+                return None
+            pooled = self._take_warm(function_id, language, image)
+            if pooled is None:
+                if not self._fits(language, limits.memory):
+                    return None
+                self._reserve(function_id, language, limits)
+        if pooled is None:
+            pooled = self._cold_start(function_id, language, image, limits=limits)
+        else:
+            pooled, _ = self._fit(pooled, function_id, None, limits)
+        with self._lock:
+            pooled.prewarmed = True
+            self._prewarmed += 1
+        return pooled
+
+    def hold(self, function_id: str, replicas: int, until: float):
+        """Keep up to ``replicas`` idle replicas of a function from being scaled in before ``until``."""
+        with self._lock:
+            self._holds[function_id] = (replicas, until)
+
+    def replica_count(self, function_id: str) -> int:
+        with self._lock:
+            return self._replica_count(function_id)
+
+    def _cold_start(self, function_id: str, language: str, image: str,
+                    avoid_host: Optional[str] = None, limits=None) -> PooledContainer:
+        # Runs outside the lock so other callers are not blocked on the backend. The caller has
+        # already counted the container with _reserve.
+        limits = limits or self.backend.default_limits
+        start = time.time()
+        try:
+            pooled = self._create(language, image, function_id, avoid_host, limits)
+        finally:
+            with self._lock:
+                self._pending[language] -= 1
+                self._pending_memory -= limits.memory
+                self._starting[function_id] -= 1
+                if not self._starting[function_id]:
+                    del self._starting[function_id]
+                self._lock.notify_all()
+        self._cold_starts.append(time.time() - start)
+
+        with self._lock:
+            self._containers[pooled.id] = pooled
+            self._bind(pooled, function_id)
+            pooled.in_use = True
+            pooled.use_count += 1
+        return pooled
+
+    def _fit(self, pooled: PooledContainer, function_id: str, avoid_host: Optional[str],
+             limits) -> Tuple[PooledContainer, bool]:
+        """Give a checked out container ``limits``: resized in place, or else replaced by a new one.
+
+        Growing takes pool memory like a cold start does, so idle containers are
+        evicted to fit the budget; if it still does not fit, the container keeps
+        its current limits. Returns the container to use and whether it was cold started.
+        """
+        if pooled.limits == limits:
+            return pooled, False
+        with self._lock:
+            if limits.memory > pooled.limits.memory and \
+                    not self._make_room(pooled.language, limits.memory, replacing=pooled):
+                logger.warning(f"No room in the pool memory budget to grow container {pooled.id} for function "
+                               f"{function_id}, keeping its current limits")
+                return pooled, False
+            # Counted with the new limits from here on, so nothing else takes the room meanwhile
+            pooled.limits = limits
+        try:
+            resized = self.backend.resize(pooled.container, limits)
+        except Exception as e:
+            logger.warning(f"Error resizing container {pooled.id}: {str(e)}")
+            resized = False
+        if resized:
+            with self._lock:
+                self._resizes += 1
+            logger.info(f"Resized container {pooled.id} to {limits.memory // (1024 * 1024)} MB "
+                        f"and {limits.cpu:g} CPUs for function {function_id}")
+            return pooled, False
+
+        logger.info(f"Recreating container {pooled.id} with new limits for function {function_id}")
+        with self._lock:
+            self._forget(pooled)
+            self._reserve(function_id, pooled.language, limits)
+            self._recreates += 1
+            self._lock.notify_all()
+        threading.Thread(target=self._destroy, args=(pooled,), daemon=True).start()
+        return self._cold_start(function_id, pooled.language, pooled.image, avoid_host, limits), True
+
+    def release(self, pooled: PooledContainer, healthy: bool = True):
+        """Return a container to the pool, or destroy it if it is no longer usable.
+
+        Unusable containers are removed in the background so the caller is not held up.
+        """
+        with self._lock:
+            pooled.in_use = False
+            pooled.last_used = time.time()
+            if not healthy or pooled.id not in self._containers:
+                self._forget(pooled)
+                destroy = True
+            else:
+                self._idle[pooled.language][pooled.id] = pooled
+                destroy = False
+            self._lock.notify_all()
+        if destroy:
+            threading.Thread(target=self._destroy, args=(pooled,), daemon=True).start()
+
+    def discard(self, function_id: str):
+        """Remove every container bound to ``function_id``.
+
+        Containers currently running an invocation are dropped when released.
+        """
+        with self._lock:
+            bound = list(self._replicas.get(function_id, {}).values())
+            idle = [p for p in bound if not p.in_use]
+            for pooled in bound:
+                self._forget(pooled)
+            self._lock.notify_all()
+        for pooled in idle:
+            self._destroy(pooled)
+        if bound:
+            logger.info(f"Discarded {len(bound)} containers for function {function_id}")
+
+    def invalidate(self, function_id: str):
+        """Forget the code loaded into containers bound to ``function_id``.
+
+        The containers stay warm; their agents reload the code on next use.
+        """
+        with self._lock:
+            for pooled in self._replicas.get(function_id, {}).values():
+                pooled.deployed_hash = None
+
+    def retire_host(self, host: str):
+        """Remove every container on a host that went down or is being drained.
+
+        Containers still running an invocation are dropped when released.
+        """
+        with self._lock:
+            on_host = [p for p in self._containers.values() if p.host == host]
+            idle = [p for p in on_host if not p.in_use]
+            for pooled in on_host:
+                self._forget(pooled)
+            self._lock.notify_all()
+        for pooled in idle:
+            self._destroy(pooled)
+        logger.info(f"Retired {len(on_host)} containers on host {host}")
+
+    def _take_replica(self, function_id: str, language: str, image: str,
+                      avoid_host: Optional[str] = None, limits=None) -> Optional[PooledContainer]:
+        # Replicas run one invocation at a time, so an idle one is the least busy. Taking the most
+        # recently used keeps load on as few replicas as possible and lets the rest scale in. One that
+        # already has the function's limits goes first, as the others need resizing.
+        idle = self._idle[language]
+        chosen = None
+        for pooled in self._replicas.get(function_id, {}).values():
+            if pooled.id in idle and pooled.image == image and (avoid_host is None or pooled.host != avoid_host) \
+                    and (chosen is None or (pooled.limits == limits, pooled.last_used)
+                         > (chosen.limits == limits, chosen.last_used)):
+                chosen = pooled
+        if chosen is None:
+            return None
+        if chosen.prewarmed:
+            chosen.prewarmed = False
+            self._prewarm_hits += 1
+        return self._checkout(chosen)
+
+    def _take_warm(self, function_id: str, language: str, image: str,
+                   avoid_host: Optional[str] = None) -> Optional[PooledContainer]:
+        for pooled in self._idle[language].values():
+            if pooled.function_id is None and pooled.image == image and (avoid_host is None or pooled.host != avoid_host):
+                self._bind(pooled, function_id)
+                return self._checkout(pooled)
+        return None
+
+    def _checkout(self, pooled: PooledContainer) -> PooledContainer:
+        del self._idle[pooled.language][pooled.id]
+        pooled.in_use = True
+        pooled.use_count += 1
+        return pooled
+
+    def _bind(self, pooled: PooledContainer, function_id: str):
+        pooled.function_id = function_id
+        self._replicas.setdefault(function_id, {})[pooled.id] = pooled
+
+    def _replica_count(self, function_id: str) -> int:
+        return len(self._replicas.get(function_id, {})) + self._starting.get(function_id, 0)
+
+    def _lru_idle(self, language: Optional[str] = None) -> Optional[PooledContainer]:
+        """The least recently used idle container of ``language``, or of any language."""
+        candidates = [next(iter(idle.values())) for lang, idle in self._idle.items()
+                      if idle and (language is None or lang == language)]
+        return min(candidates, key=lambda p: p.last_used, default=None)
+
+    def _size(self, language: str) -> int:
+        count = sum(1 for p in self._containers.values() if p.language == language)
+        return count + self._pending[language]
+
+    def _memory(self) -> int:
+        """Memory limits of every container, including ones being started, in bytes."""
+        return sum(p.limits.memory for p in self._containers.values()) + self._pending_memory
+
+    def _fits(self, language: str, memory: int, replacing: Optional[PooledContainer] = None) -> bool:
+        """Whether a new container of ``memory`` bytes fits, or ``replacing`` once given that much."""
+        if replacing is None and self._size(language) >= self.max_size[language]:
+            return False
+        freed = replacing.limits.memory if replacing is not None else 0
+        return not self.memory_budget or self._memory() - freed + memory <= self.memory_budget
+
+    def _make_room(self, language: str, memory: int, replacing: Optional[PooledContainer] = None) -> bool:
+        """Evict idle containers, least recently used first, until a new one of ``memory`` bytes fits.
+
+        With ``replacing``, room is made for that container to grow to ``memory`` bytes instead.
+        """
+        while not self._fits(language, memory, replacing):
+            # The language's own count is full, or else any language's container frees memory
+            full = replacing is None and self._size(language) >= self.max_size[language]
+            victim = self._lru_idle(language if full else None)
+            if victim is None:
+                return False
+            self._forget(victim)
+            self._evictions += 1
+            logger.info(f"Evicting LRU container {victim.id} ({victim.language}) to make room")
+            threading.Thread(target=self._destroy, args=(victim,), daemon=True).start()
+        return True
+
+    def _reserve(self, function_id: str, language: str, limits):
+        """Count a container about to be cold started for ``function_id``."""
+        self._pending[language] += 1
+        self._pending_memory += limits.memory
+        self._starting[function_id] = self._starting.get(function_id, 0) + 1
+
+    def _forget(self, pooled: PooledContainer):
+        self._containers.pop(pooled.id, None)
+        self._idle[pooled.language].pop(pooled.id, None)
+        replicas = self._replicas.get(pooled.function_id)
+        if replicas is not None:
+            replicas.pop(pooled.id, None)
+            if not replicas:
+                del self._replicas[pooled.function_id]
+
+    # ------------------------------------------------------------------ runtime backend
+
+    def _create(self, language: str, image: Optional[str] = None, function_id: Optional[str] = None,
+                avoid_host: Optional[str] = None, limits=None) -> PooledContainer:
+        image = image or self.images[language]
+        limits = limits or self.backend.default_limits
+        name = f"pool_{language}_{uuid.uuid4().hex[:12]}"
+        logger.info(f"Starting {language} container {name}")
+        labels = {POOL_LABEL: "true", f"{POOL_LABEL}.language": language}
+        if function_id is not None:
+            # Lets a backend spread over several hosts place it near the function's other replicas
+            labels[f"{POOL_LABEL}.function"] = function_id
+        try:
+            container = self.backend.create(language, image, name, labels, avoid_host=avoid_host, limits=limits)
+        except RuntimeError:
+            raise
+        except Exception as e:
+            logger.error(f"Error creating container: {str(e)}")
+            raise RuntimeError(f"Failed to create {self.backend.name} container: {str(e)}")
+        logger.info(f"Container created: {container.id} ({language})")
+        pooled = PooledContainer(container, language, image, self.backend.host_of(container), limits)
+        if self.prepare is not None:
+            try:
+                self.prepare(pooled)
+            except Exception:
+                self._destroy(pooled)
+                raise
+        return pooled
+
+    def _destroy(self, pooled: PooledContainer):
+        if pooled.agent is not None:
+            pooled.agent.close()
+        try:
+            self.backend.destroy(pooled.container)
+            logger.info(f"Removed container {pooled.id} ({pooled.language})")
+        except Exception as e:
+            logger.error(f"Error removing container {pooled.id}: {str(e)}")
+
+    # ------------------------------------------------------------------ background maintenance
+
+    def _reap_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.evict_idle()
+                self.warm()
+            except Exception as e:
+                logger.error(f"Container pool maintenance failed: {str(e)}")
+            self._stop.wait(self.reap_interval)
+
+    def evict_idle(self):
+        """Destroy idle containers unused for longer than the TTL.
+
+        Extra replicas of a function are scaled in after ``scale_in_idle``.
+        Unbound pre-warmed containers are kept up to the language's ``min_size``.
+        """
+        now = time.time()
+        expired = []
+        with self._lock:
+            self._holds = {f: hold for f, hold in self._holds.items() if hold[1] > now}
+            for language, idle in self._idle.items():
+                warm = sum(1 for p in idle.values() if p.function_id is None)
+                for pooled in list(idle.values()):
+                    idle_for = now - pooled.last_used
+                    if pooled.function_id is None:
+                        if idle_for < self.idle_ttl or warm <= self.min_size[language]:
+                            continue
+                        warm -= 1
+                    elif len(self._replicas[pooled.function_id]) <= self._holds.get(pooled.function_id, (0, 0))[0]:
+                        continue
+                    elif idle_for < self.idle_ttl:
+                        if idle_for < self.scale_in_idle or len(self._replicas[pooled.function_id]) <= 1:
+                            continue
+                    self._forget(pooled)
+                    expired.append(pooled)
+            self._evictions += len(expired)
+        for pooled in expired:
+            logger.info(f"Evicting idle container {pooled.id} bound to function {pooled.function_id}")
+            self._destroy(pooled)
+
+    def warm(self):
+        """Top up each language with unbound containers until ``min_size`` is reached."""
+        limits = self.backend.default_limits
+        for language in self.images:
+            while not self._stop.is_set():
+                with self._lock:
+                    warm = sum(1 for p in self._idle[language].values() if p.function_id is None)
+                    if warm + self._pending[language] >= self.min_size[language] \
+                            or not self._fits(language, limits.memory):
+                        break
+                    self._pending[language] += 1
+                    self._pending_memory += limits.memory
+                try:
+                    pooled = self._create(language, limits=limits)
+                except Exception as e:
+                    logger.error(f"Failed to pre-warm {language} container: {str(e)}")
+                    with self._lock:
+                        self._pending[language] -= 1
+                        self._pending_memory -= limits.memory
+                    break
+                with self._lock:
+                    self._pending[language] -= 1
+                    self._pending_memory -= limits.memory
+                    self._containers[pooled.id] = pooled
+                    self._idle[language][pooled.id] = pooled
+                    self._lock.notify_all()
+
+    # ------------------------------------------------------------------ stats
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            languages = {}
+            for language in self.images:
+                containers = [p for p in self._containers.values() if p.language == language]
+                idle = self._idle[language]
+                languages[language] = {
+                    "image": self.images[language],
+                    "min_size": self.min_size[language],
+                    "max_size": self.max_size[language],
+                    "total": len(containers),
+                    "in_use": sum(1 for p in containers if p.in_use),
+                    "idle": len(idle),
+                    "warm": sum(1 for p in idle.values() if p.function_id is None),
+                    "starting": self._pending[language],
+                    "memory": sum(p.limits.memory for p in containers),
+                }
+            replicas = {
+                function_id: {
+                    "replicas": len(bound),
+                    "in_use": sum(1 for p in bound.values() if p.in_use),
+                    "starting": self._starting.get(function_id, 0),
+                    "images": sorted({p.image for p in bound.values()}),
+                    "memory": sum(p.limits.memory for p in bound.values()),
+                }
+                for function_id, bound in self._replicas.items()
+            }
+            hosts = {}
+            for pooled in self._containers.values():
+                if pooled.host is not None:
+                    host = hosts.setdefault(pooled.host, {"total": 0, "in_use": 0, "idle": 0, "warm": 0})
+                    host["total"] += 1
+                    host["in_use"] += pooled.in_use
+                    host["idle"] += not pooled.in_use
+                    host["warm"] += not pooled.in_use and pooled.function_id is None
+            cold_starts = sorted(self._cold_starts)
+            acquisitions = self._hits + self._misses
+            return {
+                "backend": self.backend.stats(),
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / acquisitions if acquisitions else 0.0,
+                "evictions": self._evictions,
+                "scale_outs": self._scale_outs,
+                "prewarmed": self._prewarmed,
+                "prewarm_hits": self._prewarm_hits,
+                "max_replicas": self.max_replicas,
+                "resizes": self._resizes,
+                "recreates": self._recreates,
+                "memory": self._memory(),
+                "memory_budget": self.memory_budget,
+                "cold_start_latency": {
+                    "count": len(cold_starts),
+                    "avg": sum(cold_starts) / len(cold_starts) if cold_starts else 0.0,
+                    "p50": _percentile(cold_starts, 50),
+                    "p99": _percentile(cold_starts, 99),
+                    "max": cold_starts[-1] if cold_starts else 0.0,
+                },
+                "languages": languages,
+                "functions": replicas,
+                "hosts": hosts,
+            }
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
@@ -0,0 +1,59 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+DEPLOYMENT_CACHE_SIZE = int(os.getenv("DEPLOYMENT_CACHE_SIZE", "1024"))
+
+
+def code_hash(language: str, code: str) -> str:
+    """Content hash identifying one deployable version of a function."""
+    digest = hashlib.sha256()
+    digest.update(language.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(code.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Deployment:
+    """A function's code as it is loaded into a runtime agent."""
+
+    def __init__(self, function_id: str, language: str, code: str):
+        self.function_id = function_id
+        self.language = language
+        self.code = code
+        self.hash = code_hash(language, code)
+
+
+class DeploymentCache:
+    """Current deployment per function, bounded with LRU eviction.
+
+    Containers remember the hash of the deployment loaded into their agent, so
+    a warm call only has to compare hashes to know the code is already there.
+    """
+
+    def __init__(self, max_size: int = DEPLOYMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Deployment]" = OrderedDict()
+
+    def get(self, function_id: str, language: str, code: str) -> Deployment:
+        """Return the deployment for this code, hashing it only when it changed."""
+        with self._lock:
+            deployment = self._entries.get(function_id)
+            if deployment is not None and deployment.language == language and deployment.code == code:
+                self._entries.move_to_end(function_id)
+                return deployment
+
+        deployment = Deployment(function_id, language, code)
+        with self._lock:
+            self._entries[function_id] = deployment
+            self._entries.move_to_end(function_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return deployment
+
+    def invalidate(self, function_id: str):
+        with self._lock:
+            self._entries.pop(function_id, None)
+
@@ -1,15 +1,17 @@
-import docker
 import time
-import psutil
-import json
-import subprocess
-import platform
 import os
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Iterable, Iterator, Tuple
 from datetime import datetime
-import tempfile
-import tarfile
+
+from container_pool import ContainerPool, LANGUAGE_IMAGES
+from agent_client import AgentConnection, AgentError, AgentTimeout, FunctionTimeout
+from invocation_logs import LogBuffer
+from deployment_cache import DeploymentCache
+from images import ImageBuilder, ImageNotReadyError, ImageBuildError, normalize_dependencies
+from runtime_backends import ResourceLimits, RuntimeBackend, SandboxError, create_backend
+import telemetry
+from tracing import Trace
 
 # Configure logging
 logging.basicConfig(
@@ -19,342 +21,426 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Used when a function has no timeout of its own, in seconds
+DEFAULT_FUNCTION_TIMEOUT = float(os.getenv("DEFAULT_FUNCTION_TIMEOUT", "30"))
+# Fork-server mode: Python functions are imported once per container and every call runs in a
+# copy-on-write fork of that process, so calls do not share state. Each fork may grow by at most
+# PYTHON_FORK_MEMORY_LIMIT bytes of address space.
+PYTHON_FORK_SERVER = os.getenv("PYTHON_FORK_SERVER", "false").lower() == "true"
+PYTHON_FORK_MEMORY_LIMIT = int(os.getenv("PYTHON_FORK_MEMORY_LIMIT", str(256 * 1024 * 1024)))
+# With several worker hosts, how many times an invocation whose host failed is retried on another one
+HOST_RETRIES = int(os.getenv("HOST_RETRIES", "1"))
+
+class ExecutionError(Exception):
+    """An invocation failed. ``metrics`` holds what was recorded for it."""
+
+    def __init__(self, message: str, metrics: Dict[str, Any]):
+        super().__init__(message)
+        self.metrics = metrics
+
+class ExecutionTimeoutError(ExecutionError):
+    """The function ran past its timeout and was stopped."""
+
 class ExecutionEngine:
-    def __init__(self):
-        self.docker_available = False
-        self.docker_client = None
-        self.container_pool = {}
+    def __init__(self, backend: Optional[RuntimeBackend] = None):
         self.metrics = {}
-        
-        try:
-            if platform.system() == 'Windows':
-                # Use Windows named pipe
-                base_url = 'npipe:////./pipe/docker_engine'
-                self.docker_client = docker.DockerClient(base_url=base_url)
-            else:
-                self.docker_client = docker.from_env()
-                
-            # Test connection
-            self.docker_client.ping()
-            self.docker_available = True
-            logger.info("Docker is available and running")
-            
-            # Ensure Python image is available
-            try:
-                self.docker_client.images.get('python:3.9')
-                logger.info("Python 3.9 image is already available")
-            except docker.errors.ImageNotFound:
-                logger.info("Pulling Python 3.9 image...")
-                self.docker_client.images.pull('python:3.9')
-                logger.info("Python 3.9 image pulled successfully")
-            
-            # Ensure Node.js image is available
-            try:
-                self.docker_client.images.get('node:18')
-                logger.info("Node.js 18 image is already available")
-            except docker.errors.ImageNotFound:
-                logger.info("Pulling Node.js 18 image...")
-                self.docker_client.images.pull('node:18')
-                logger.info("Node.js 18 image pulled successfully")
-                
-        except Exception as e:
-            logger.error(f"Docker initialization error: {str(e)}")
-            logger.error("Docker is required to run this application. Please ensure Docker is running properly.")
-            raise RuntimeError(f"Docker is required but not available: {str(e)}")
 
-    def create_container(self, function_id: str, image: str) -> str:
-        """Create a new container for a function."""
-        logger.info(f"Creating container for function {function_id}")
-        
-        # Remove any existing container with the same name
-        try:
-            old_container_name = f"function_{function_id}"
-            try:
-                old_container = self.docker_client.containers.get(old_container_name)
-                logger.info(f"Found existing container {old_container.id} with name {old_container_name}")
-                logger.info(f"Stopping existing container {old_container.id}")
-                old_container.stop()
-                logger.info(f"Removing existing container {old_container.id}")
-                old_container.remove()
-            except docker.errors.NotFound:
-                logger.info(f"No existing container with name {old_container_name}")
-                pass
-        except Exception as e:
-            logger.warning(f"Error handling existing container: {str(e)}")
-        
-        try:
-            container = self.docker_client.containers.run(
-                image,
-                detach=True,
-                name=f"function_{function_id}",
-                mem_limit='512m',
-                cpu_period=100000,
-                cpu_quota=50000,
-                tty=True,  # Keep container running
-                command="tail -f /dev/null"  # Keep container alive
-            )
-            logger.info(f"Container created: {container.id} for function {function_id}")
-            return container.id
-        except docker.errors.APIError as e:
-            logger.error(f"Docker API error while creating container: {str(e)}")
-            raise RuntimeError(f"Failed to create Docker container: {str(e)}")
-        except Exception as e:
-            logger.error(f"Error creating container: {str(e)}")
-            raise RuntimeError(f"Failed to create Docker container: {str(e)}")
+        # Where containers run: Docker by default, sandboxed local processes (RUNTIME_BACKEND=process),
+        # or several worker hosts (RUNTIME_BACKEND=hosts)
+        self.backend = backend or create_backend()
+        logger.info(f"Using the {self.backend.name} runtime backend")
+
+        # Base images are pulled and dependency images built in the background, so startup never waits on them
+        self.image_builder = None
+        if self.backend.supports_images:
+            self.image_builder = ImageBuilder(self.backend.docker_client, LANGUAGE_IMAGES)
+            self.image_builder.start()
+
+        # Current code version per function, compared by hash against what each container has loaded
+        self.deployments = DeploymentCache()
+        # Memory and CPU limits per function, set by the resource sizer; others get the backend's defaults
+        self.limits: Dict[str, ResourceLimits] = {}
+
+        # Pre-warmed containers per language, each running a runtime agent, handed out on demand
+        self.pool = ContainerPool(self.backend, LANGUAGE_IMAGES, prepare=self._prepare_container)
+        self.pool.start()
+        # Containers on a host that goes down or is drained leave the pool
+        self.backend.start(self.pool.retire_host)
 
-    def execute_function(self, function_id: str, code: str, input_data: Dict[str, Any], language: str = "python") -> Dict[str, Any]:
-        """Execute a function in a container."""
+    def execute_function(self, function_id: str, code: str, input_data: Dict[str, Any], language: str = "python",
+                         timeout: Optional[float] = None, dependencies: Optional[str] = None,
+                         trace: Optional[Trace] = None, profile: bool = False,
+                         log: Optional[LogBuffer] = None) -> Dict[str, Any]:
+        """Execute a function in a container, stopping it after ``timeout`` seconds.
+
+        A function with ``dependencies`` runs in its prebuilt dependency image;
+        ``ImageNotReadyError`` is raised while that is still being built. When
+        the worker host fails, the invocation is retried on another. Each
+        step is recorded as a span of ``trace``, whose id goes in the metrics.
+        With ``profile`` the result also carries the function's hottest frames.
+        What the function prints, including while its code loads, goes to ``log``.
+        """
+        for _, payload in self._execute(function_id, code, input_data, language, timeout, dependencies,
+                                        stream=False, trace=trace, profile=profile, log=log):
+            pass
+        return payload
+
+    def execute_function_stream(self, function_id: str, code: str, input_data: Dict[str, Any],
+                                language: str = "python", timeout: Optional[float] = None,
+                                dependencies: Optional[str] = None, trace: Optional[Trace] = None,
+                                profile: bool = False, log: Optional[LogBuffer] = None) -> Iterator[Tuple[str, Any]]:
+        """Execute a function, yielding its output as it is produced.
+
+        Yields ``("chunk", data)`` for every item a generator function yields,
+        then ``("result", {"result": ..., "metrics": ...})`` once it returns.
+        Failures raise the same errors as ``execute_function``. Closing the
+        iterator early recycles the container, since the function may still be
+        running in it.
+        """
+        return self._execute(function_id, code, input_data, language, timeout, dependencies, stream=True,
+                             trace=trace, profile=profile, log=log)
+
+    def _execute(self, function_id: str, code: str, input_data: Dict[str, Any], language: str,
+                 timeout: Optional[float], dependencies: Optional[str], stream: bool,
+                 trace: Optional[Trace] = None, profile: bool = False,
+                 log: Optional[LogBuffer] = None) -> Iterator[Tuple[str, Any]]:
+        timeout = timeout or DEFAULT_FUNCTION_TIMEOUT
+        trace = trace or Trace()
+        image = self._image_for(language, dependencies)
         start_time = time.time()
-        logger.info(f"Starting execution of function {function_id} using language: {language}")
+        logger.debug(f"Starting execution of function {function_id} using language: {language}")
         
+        pooled = None
+        healthy = True
+        finished = False
         try:
-            # Get or create container based on language
-            container_id = self.container_pool.get(function_id)
-            
-            # If container exists but might be for a different language, remove it
-            if container_id:
+            retries = 0
+            avoid_host = None
+            while True:
+                invoked = streamed = False
                 try:
-                    container = self.docker_client.containers.get(container_id)
-                    if language == "python" and not container.image.tags[0].startswith("python:"):
-                        logger.info(f"Container {container_id} is not a Python container. Cleaning up.")
-                        self.cleanup(function_id)
-                        container_id = None
-                    elif language == "javascript" and not container.image.tags[0].startswith("node:"):
-                        logger.info(f"Container {container_id} is not a Node.js container. Cleaning up.")
-                        self.cleanup(function_id)
-                        container_id = None
+                    # Get a warm container from the pool, cold starting one only if none is free
+                    with trace.span("pool_acquire") as span:
+                        acquire_start = time.perf_counter()
+                        pooled, cold_start = self.pool.acquire(function_id, language, image, avoid_host,
+                                                               self.limits.get(function_id))
+                        telemetry.observe_stage("cold_start" if cold_start else "pool_acquire", language,
+                                                time.perf_counter() - acquire_start)
+                        span.attributes.update(container=pooled.id, cold_start=cold_start)
+                        if pooled.host is not None:
+                            span.attributes["host"] = pooled.host
+                    if cold_start:
+                        logger.info(f"Cold started container {pooled.id} for function {function_id}")
+                    else:
+                        logger.debug(f"Reusing pooled container {pooled.id} for function {function_id}")
+
+                    with trace.span("deploy"):
+                        agent = self._deploy(pooled, function_id, language, code, timeout, trace, log)
+                    invoked = True
+                    with trace.span("exec") as span, telemetry.timed("invoke", language):
+                        if stream:
+                            for response in agent.invoke_stream(input_data, timeout=timeout, profile=profile,
+                                                                log=log):
+                                if response.get("type") == "chunk":
+                                    streamed = True
+                                    yield "chunk", response.get("data")
+                        else:
+                            response, _ = agent.invoke(input_data, timeout=timeout, profile=profile, log=log)
+                        # Time spent in the function itself, as measured by the agent; the rest is round trip
+                        span.attributes["function_time"] = (response.get("usage") or {}).get("wall_time")
+                    break
                 except Exception as e:
-                    logger.warning(f"Error checking container image: {str(e)}")
-                    self.cleanup(function_id)
-                    container_id = None
-            
-            # Create new container if needed
-            if not container_id:
-                logger.info(f"No existing container found for function {function_id}")
-                image = "python:3.9" if language == "python" else "node:18"
-                container_id = self.create_container(function_id, image)
-                self.container_pool[function_id] = container_id
-                logger.info(f"Added container {container_id} to pool for function {function_id}")
-            else:
-                logger.info(f"Reusing existing container {container_id} for function {function_id}")
-
-            # Prepare execution environment
-            container = self.docker_client.containers.get(container_id)
-            logger.info(f"Retrieved container {container.id} for execution")
-            
-            if language == "python":
-                # Create a proper Python script with the function code
-                wrapper_script = f"""#!/usr/bin/env python3
-import json
-import sys
-import os
+                    if pooled is None or streamed or retries >= HOST_RETRIES \
+                            or not self._retry_elsewhere(e, pooled, invoked):
+                        raise
+                    retries += 1
+                    avoid_host = pooled.host
+                    logger.warning(f"Retrying function {function_id} on another host after host {avoid_host} "
+                                   f"failed: {str(e)}")
+                    telemetry.HOST_RETRIES.labels(avoid_host).inc()
+                    self.pool.release(pooled, healthy=False)
+                    pooled = None
+            logger.debug(f"Function execution completed in container {pooled.id}")
 
-# User function code
-{code}
+            with trace.span("result_parse"):
+                result = response.get("result")
 
-# Main execution
-if __name__ == "__main__":
-    try:
-        # Get input data from environment variable or file
-        input_str = os.environ.get("INPUT", "{{}}")
-        input_data = json.loads(input_str)
-        
-        # Execute the function
-        result = main(input_data)
-        
-        # Print the result as JSON on its own line
-        print("\\n##RESULT_START##")
-        print(json.dumps({{"result": result}}))
-        print("##RESULT_END##")
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print("\\n##RESULT_START##")
-        print(json.dumps({{"error": str(e)}}))
-        print("##RESULT_END##")
-"""
-                # Create a temp file with the script
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-                    f.write(wrapper_script)
-                    temp_file = f.name
-                
-                # Copy code to container
-                container.exec_run("mkdir -p /tmp")
-                try:
-                    # Create a tar archive with the file
-                    with tempfile.NamedTemporaryFile(suffix='.tar') as tar_file:
-                        with tarfile.open(fileobj=tar_file, mode='w') as tar:
-                            tar.add(temp_file, arcname='function.py')
-                        tar_file.flush()
-                        tar_file.seek(0)
-                        # Copy the archive to the container
-                        container.put_archive('/tmp', tar_file.read())
-                        
-                    # Make the script executable
-                    container.exec_run("chmod +x /tmp/function.py")
-                finally:
-                    # Clean up temp file
-                    os.unlink(temp_file)
-                
-                # Execute with better debugging
-                exec_result = container.exec_run(
-                    "bash -c 'echo \"INPUT=$INPUT\" && python /tmp/function.py'",
-                    environment={"INPUT": json.dumps(input_data)}
-                )
-            
-            elif language == "javascript":
-                # Create a Node.js script with the function code
-                wrapper_script = f"""// User function code
-{code}
-
-// Main execution
-(async () => {{
-    try {{
-        // Get input data from environment variable
-        const inputStr = process.env.INPUT || '{{}}';
-        const inputData = JSON.parse(inputStr);
-        
-        // Execute the function
-        const result = await main(inputData);
-        
-        // Print the result as JSON
-        console.log("\\n##RESULT_START##");
-        console.log(JSON.stringify({{ result }}));
-        console.log("##RESULT_END##");
-    }} catch (error) {{
-        console.error(error);
-        console.log("\\n##RESULT_START##");
-        console.log(JSON.stringify({{ error: error.message }}));
-        console.log("##RESULT_END##");
-    }}
-}})();
-"""
-                # Create a temp file with the script
-                with tempfile.NamedTemporaryFile(mode='w', suffix='.js', delete=False) as f:
-                    f.write(wrapper_script)
-                    temp_file = f.name
-                
-                # Copy code to container
-                container.exec_run("mkdir -p /tmp")
-                try:
-                    # Create a tar archive with the file
-                    with tempfile.NamedTemporaryFile(suffix='.tar') as tar_file:
-                        with tarfile.open(fileobj=tar_file, mode='w') as tar:
-                            tar.add(temp_file, arcname='function.js')
-                        tar_file.flush()
-                        tar_file.seek(0)
-                        # Copy the archive to the container
-                        container.put_archive('/tmp', tar_file.read())
-                finally:
-                    # Clean up temp file
-                    os.unlink(temp_file)
-                
-                # Execute with Node.js
-                exec_result = container.exec_run(
-                    "bash -c 'echo \"INPUT=$INPUT\" && node /tmp/function.js'",
-                    environment={"INPUT": json.dumps(input_data)}
-                )
-            else:
-                raise ValueError(f"Unsupported language: {language}")
-            
-            logger.info(f"Function execution completed with exit code: {exec_result.exit_code}")
-            
-            # Collect metrics
-            end_time = time.time()
-            execution_time = end_time - start_time
-            
-            # Get container stats
-            stats = container.stats(stream=False)
-            memory_usage = stats['memory_stats']['usage'] / (1024 * 1024)  # Convert to MB
-            cpu_usage = self._calculate_cpu_usage(stats)
-            logger.info(f"Collected metrics: Memory: {memory_usage:.2f}MB, CPU: {cpu_usage:.2f}%, Time: {execution_time:.4f}s")
-            
-            # Parse the result
-            result = exec_result.output.decode()
-            logger.info(f"Raw function output: {result}")
-            
-            # Extract JSON result using markers
-            result_str = ""
-            in_result = False
-            for line in result.splitlines():
-                if "##RESULT_START##" in line:
-                    in_result = True
-                    continue
-                elif "##RESULT_END##" in line:
-                    in_result = False
-                    continue
-                elif in_result:
-                    result_str = line.strip()
-            
-            # Parse the extracted JSON
-            if result_str:
-                try:
-                    json_result = json.loads(result_str)
-                    logger.info(f"Parsed JSON result: {json_result}")
-                    if "error" in json_result:
-                        logger.error(f"Function returned error: {json_result['error']}")
-                        raise Exception(json_result["error"])
-                    result = json_result["result"]
-                except json.JSONDecodeError:
-                    logger.warning(f"Could not parse function result as JSON: {result_str}")
-                    # Keep the raw output as result
-                    result = result_str
-            else:
-                logger.warning(f"Could not find the result section in output, returning raw output")
-            
-            # Store metrics
-            self.metrics[function_id] = {
-                "execution_time": execution_time,
-                "memory_usage": memory_usage,
-                "cpu_usage": cpu_usage,
-                "status": "success",
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            logger.info(f"Execution completed for function {function_id}")
-            
-            return {
+                # Collect metrics
+                end_time = time.time()
+                execution_time = end_time - start_time
+
+                # The agent measures the invocation itself from cgroup counters, so this costs no extra round trip
+                memory_usage, cpu_usage = self._usage_metrics(response.get("usage") or {})
+                logger.debug(f"Collected metrics: Memory: {memory_usage:.2f}MB, CPU: {cpu_usage:.2f}%, Time: {execution_time:.4f}s")
+
+                # Store metrics
+                self.metrics[function_id] = {
+                    "execution_time": execution_time,
+                    "memory_usage": memory_usage,
+                    "cpu_usage": cpu_usage,
+                    "status": "success",
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "trace_id": trace.trace_id,
+                }
+            logger.debug(f"Execution completed for function {function_id}")
+            telemetry.observe_stage("total", language, execution_time)
+            telemetry.record_invocation(function_id, language, "success")
+
+            finished = True
+            payload = {
                 "result": result,
                 "metrics": self.metrics[function_id]
             }
+            if "profile" in response:
+                payload["profile"] = response["profile"]
+            yield "result", payload
             
         except Exception as e:
-            # Store error metrics
-            logger.error(f"Function execution failed: {str(e)}")
-            self.metrics[function_id] = {
-                "execution_time": time.time() - start_time,
-                "memory_usage": 0,
-                "cpu_usage": 0,
-                "status": "failure",
-                "error_message": str(e),
-                "timestamp": datetime.utcnow().isoformat()
-            }
-            raise
+            finished = True
+            metrics = self._failure_metrics(function_id, e, start_time, timeout)
+            metrics["trace_id"] = trace.trace_id
+            telemetry.observe_stage("total", language, metrics["execution_time"])
+            telemetry.record_invocation(function_id, language, metrics["status"], e)
+            healthy = self._container_healthy(e)
+            if metrics["status"] == "timeout":
+                raise ExecutionTimeoutError(metrics["error_message"], metrics) from e
+            raise ExecutionError(str(e), metrics) from e
+        finally:
+            if pooled is not None:
+                # A stream abandoned part way leaves the function running in the container
+                self.pool.release(pooled, healthy=healthy and finished)
+
+    def execute_batch(self, function_id: str, code: str, inputs: Iterable[Tuple[int, Any]], language: str = "python",
+                      timeout: Optional[float] = None, dependencies: Optional[str] = None
+                      ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """Execute a function over many inputs on one warm container, yielding ``(index, outcome)`` per input.
 
-    def _calculate_cpu_usage(self, stats: Dict[str, Any]) -> float:
-        """Calculate CPU usage percentage from container stats."""
+        ``inputs`` yields ``(index, input_data)`` pairs and may be shared by
+        several batches running in parallel. The container is acquired and the
+        code loaded once, so every further input costs a single round trip to
+        the runtime agent. An outcome is ``{"result": ..., "metrics": ...}``,
+        or ``{"error": ..., "metrics": ...}`` for an input that failed; a
+        failure never stops the rest of the batch.
+        """
+        timeout = timeout or DEFAULT_FUNCTION_TIMEOUT
+        image = self._image_for(language, dependencies)
+        pooled = None
+        finished = False
         try:
-            cpu_delta = stats['cpu_stats']['cpu_usage']['total_usage'] - stats['precpu_stats']['cpu_usage']['total_usage']
-            system_delta = stats['cpu_stats']['system_cpu_usage'] - stats['precpu_stats']['system_cpu_usage']
-            cpu_usage = (cpu_delta / system_delta) * 100 if system_delta > 0 else 0
-            return cpu_usage
-        except Exception as e:
-            logger.error(f"Error calculating CPU usage: {str(e)}")
-            return 0.0
+            for index, input_data in inputs:
+                start_time = time.time()
+                try:
+                    if pooled is None:
+                        acquire_start = time.perf_counter()
+                        pooled, cold_start = self.pool.acquire(function_id, language, image,
+                                                               limits=self.limits.get(function_id))
+                        telemetry.observe_stage("cold_start" if cold_start else "pool_acquire", language,
+                                                time.perf_counter() - acquire_start)
+                    agent = self._deploy(pooled, function_id, language, code, timeout)
+                    with telemetry.timed("invoke", language):
+                        response, _ = agent.invoke(input_data, timeout=timeout)
+                except Exception as e:
+                    metrics = self._failure_metrics(function_id, e, start_time, timeout)
+                    telemetry.observe_stage("total", language, metrics["execution_time"])
+                    telemetry.record_invocation(function_id, language, metrics["status"], e)
+                    if pooled is not None and not self._container_healthy(e):
+                        # Carry on with a fresh container rather than one in an unknown state
+                        self.pool.release(pooled, healthy=False)
+                        pooled = None
+                    yield index, {"error": metrics["error_message"], "metrics": metrics}
+                    continue
+
+                memory_usage, cpu_usage = self._usage_metrics(response.get("usage") or {})
+                metrics = {
+                    "execution_time": time.time() - start_time,
+                    "memory_usage": memory_usage,
+                    "cpu_usage": cpu_usage,
+                    "status": "success",
+                    "timestamp": datetime.utcnow().isoformat()
+                }
+                telemetry.observe_stage("total", language, metrics["execution_time"])
+                telemetry.record_invocation(function_id, language, "success")
+                yield index, {"result": response.get("result"), "metrics": metrics}
+            finished = True
+        finally:
+            if pooled is not None:
+                self.pool.release(pooled, healthy=finished)
+
+    def _deploy(self, pooled, function_id: str, language: str, code: str, timeout: float,
+                trace: Optional[Trace] = None, log: Optional[LogBuffer] = None) -> AgentConnection:
+        """Make sure the container's runtime agent is up and has this function's code loaded."""
+        trace = trace or Trace()
+        agent = pooled.agent
+        if agent is None or not agent.alive:
+            with trace.span("agent_start"):
+                self._prepare_container(pooled)
+            agent = pooled.agent
+        deployment = self.deployments.get(function_id, language, code)
+        if pooled.deployed_hash != deployment.hash:
+            logger.info(f"Loading code {deployment.hash[:12]} for function {function_id} into container {pooled.id}")
+            pooled.deployed_hash = None
+            with trace.span("code_load", code_hash=deployment.hash[:12]), telemetry.timed("code_load", language):
+                if language == "python" and PYTHON_FORK_SERVER:
+                    agent.load(deployment.code, timeout=timeout, fork=True, memory_limit=PYTHON_FORK_MEMORY_LIMIT,
+                               log=log)
+                else:
+                    agent.load(deployment.code, timeout=timeout, log=log)
+            pooled.deployed_hash = deployment.hash
+        return agent
+
+    def _failure_metrics(self, function_id: str, error: Exception, start_time: float, timeout: float) -> Dict[str, Any]:
+        timed_out = isinstance(error, (FunctionTimeout, AgentTimeout))
+        if timed_out:
+            logger.error(f"Function {function_id} timed out after {timeout}s")
+        else:
+            logger.error(f"Function execution failed: {str(error)}")
+        self.metrics[function_id] = {
+            "execution_time": time.time() - start_time,
+            "memory_usage": 0,
+            "cpu_usage": 0,
+            "status": "timeout" if timed_out else "failure",
+            "error_message": f"Function timed out after {timeout}s" if timed_out else str(error),
+            "timestamp": datetime.utcnow().isoformat()
+        }
+        return self.metrics[function_id]
+
+    def _container_healthy(self, error: Exception) -> bool:
+        # Backend or agent failures leave the container in an unknown state. That includes an
+        # agent stuck past its deadline, so the container is recycled to kill the runaway code.
+        return not isinstance(error, (AgentError, SandboxError) + self.backend.errors)
+
+    def _retry_elsewhere(self, error: Exception, pooled, invoked: bool) -> bool:
+        """Whether an attempt that failed with ``error`` should be retried on another host.
+
+        Only failures of the container or its host count. Once the function has
+        been sent, only if its host is found to be down, so a function that
+        crashes its own container is not run a second time.
+        """
+        if pooled.host is None or self._container_healthy(error) or isinstance(error, AgentTimeout):
+            return False
+        return not invoked or not self.backend.check_host(pooled.host)
+
+    def _prepare_container(self, pooled):
+        """Install and start the runtime agent in a pooled container."""
+        if pooled.agent is not None:
+            pooled.agent.close()
+        pooled.deployed_hash = None
+        with telemetry.timed("agent_start", pooled.language):
+            transport = self.backend.exec(pooled.container, pooled.language)
+            pooled.agent = AgentConnection(transport, pooled.language).start()
+
+    def _image_for(self, language: str, dependencies: Optional[str]) -> Optional[str]:
+        """The image to run a function in; None for the language's default."""
+        if self.image_builder is None:
+            if normalize_dependencies(language, dependencies):
+                raise ImageBuildError(f"Function dependencies need the docker runtime backend, "
+                                      f"not {self.backend.name}")
+            return None
+        return self.image_builder.image_for(language, dependencies)
+
+    def _usage_metrics(self, usage: Dict[str, Any]):
+        """Convert agent-reported usage to memory in MB and CPU as a percentage of one core."""
+        memory_usage = usage.get("memory_peak", 0) / (1024 * 1024)
+        wall_time = usage.get("wall_time") or 0
+        cpu_usage = usage.get("cpu_time", 0) / wall_time * 100 if wall_time > 0 else 0.0
+        return memory_usage, cpu_usage
 
     def cleanup(self, function_id: str):
         """Clean up resources for a function."""
-        container_id = self.container_pool.get(function_id)
-        if container_id:
+        logger.info(f"Cleaning up containers for function {function_id}")
+        self.pool.discard(function_id)
+
+    def invalidate(self, function_id: str, discard_containers: bool = False):
+        """Drop the cached deployment of a function after its code or language changed."""
+        logger.info(f"Invalidating deployment of function {function_id}")
+        self.deployments.invalidate(function_id)
+        if discard_containers:
+            self.pool.discard(function_id)
+        else:
+            self.pool.invalidate(function_id)
+
+    def set_limits(self, function_id: str, limits: Optional[ResourceLimits]):
+        """Run a function's containers with ``limits`` from now on, or the defaults for None.
+
+        Its containers are resized, or recreated, as they are next acquired.
+        """
+        if limits is None:
+            self.limits.pop(function_id, None)
+        else:
+            self.limits[function_id] = limits
+
+    def prewarm(self, function_id: str, code: str, language: str, replicas: int,
+                dependencies: Optional[str] = None, hold: float = 0) -> int:
+        """Bring a function up to ``replicas`` warm containers with its code already loaded.
+
+        The replicas are kept from scaling in for ``hold`` seconds. Returns how
+        many containers were added; stops early at pool limits or on a failure.
+        """
+        try:
+            image = self._image_for(language, dependencies)
+        except (ImageNotReadyError, ImageBuildError):
+            return 0
+        self.pool.hold(function_id, replicas, time.time() + hold)
+
+        added = 0
+        while self.pool.replica_count(function_id) < replicas:
+            pooled = self.pool.scale_out(function_id, language, image, self.limits.get(function_id))
+            if pooled is None:
+                break
+            healthy = True
             try:
-                logger.info(f"Cleaning up container {container_id} for function {function_id}")
-                container = self.docker_client.containers.get(container_id)
-                logger.info(f"Stopping container {container_id}")
-                container.stop()
-                logger.info(f"Removing container {container_id}")
-                container.remove()
-                del self.container_pool[function_id]
-                logger.info(f"Container {container_id} successfully removed from pool")
+                self._deploy(pooled, function_id, language, code, DEFAULT_FUNCTION_TIMEOUT)
             except Exception as e:
-                logger.error(f"Error cleaning up container: {str(e)}")
-        else:
-            logger.info(f"No container found in pool for function {function_id}")
\ No newline at end of file
+                logger.error(f"Failed to pre-warm function {function_id}: {str(e)}")
+                healthy = False
+            finally:
+                self.pool.release(pooled, healthy=healthy)
+            if not healthy:
+                break
+            added += 1
+        return added
+
+    def prepare_image(self, language: str, dependencies: Optional[str]):
+        """Start building a function's dependency image in the background, if it needs one."""
+        if self.image_builder is not None:
+            self.image_builder.ensure(language, dependencies)
+
+    def prebuild_images(self, functions):
+        """Ensure dependency images for ``(language, dependencies)`` pairs, e.g. every function at startup."""
+        if self.image_builder is not None:
+            self.image_builder.prebuild(functions)
+
+    def image_stats(self) -> Dict[str, Any]:
+        if self.image_builder is None:
+            return {"backend": self.backend.name, "images": {}}
+        return self.image_builder.stats()
+
+    def host_stats(self) -> Dict[str, Any]:
+        """Worker hosts with their state, next to the pool's containers on each."""
+        stats = self.backend.stats()
+        pool = self.pool.stats()["hosts"]
+        for name, host in stats.get("hosts", {}).items():
+            host["pool"] = pool.get(name, {"total": 0, "in_use": 0, "idle": 0, "warm": 0})
+        return stats
+
+    def drain_host(self, host: str):
+        """Stop placing containers on a worker host and remove its idle ones; busy ones go when released."""
+        if not hasattr(self.backend, "drain"):
+            raise ValueError(f"The {self.backend.name} runtime backend has no worker hosts")
+        self.backend.drain(host)
+
+    def resume_host(self, host: str):
+        if not hasattr(self.backend, "resume"):
+            raise ValueError(f"The {self.backend.name} runtime backend has no worker hosts")
+        self.backend.resume(host)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """Return container pool statistics."""
+        return self.pool.stats()
+
+    def shutdown(self):
+        """Remove every pooled container."""
+        if self.image_builder is not None:
+            self.image_builder.shutdown()
+        self.pool.shutdown()
+        self.backend.shutdown()
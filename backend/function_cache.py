@@ -0,0 +1,87 @@
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Any, Optional, Callable
+
+FUNCTION_CACHE_SIZE = int(os.getenv("FUNCTION_CACHE_SIZE", "1024"))
+
+
+class CachedFunction:
+    """Read-only snapshot of a Function row, safe to share between requests."""
+
+    def __init__(self, function):
+        self.id = function.id
+        self.name = function.name
+        self.route = function.route
+        self.language = function.language
+        self.code = function.code
+        self.timeout = function.timeout
+        self.environment_variables = dict(function.environment_variables or {})
+        self.dependencies: Optional[str] = function.dependencies
+        self.updated_at: Optional[datetime] = function.updated_at
+        self.cacheable = bool(function.cacheable)
+        self.cache_ttl: Optional[int] = function.cache_ttl
+
+
+class FunctionCache:
+    """LRU cache of function definitions for the invoke path.
+
+    Every invalidation bumps a per-function generation. A load that started
+    before an invalidation is not stored, so a concurrent update can never be
+    overwritten by the older row it replaced.
+    """
+
+    def __init__(self, max_size: int = FUNCTION_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, CachedFunction]" = OrderedDict()
+        self._generations: Dict[int, int] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, function_id: int, loader: Callable[[int], Any]) -> Optional[CachedFunction]:
+        """Return the cached function, calling ``loader`` (which returns a Function row or None) on a miss."""
+        with self._lock:
+            cached = self._entries.get(function_id)
+            if cached is not None:
+                self._entries.move_to_end(function_id)
+                self._hits += 1
+                return cached
+            self._misses += 1
+            generation = self._generations.get(function_id, 0)
+
+        function = loader(function_id)
+        if function is None:
+            return None
+        cached = CachedFunction(function)
+
+        with self._lock:
+            if self._generations.get(function_id, 0) == generation:
+                self._entries[function_id] = cached
+                self._entries.move_to_end(function_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return cached
+
+    def invalidate(self, function_id: int):
+        with self._lock:
+            self._entries.pop(function_id, None)
+            self._generations[function_id] = self._generations.get(function_id, 0) + 1
+            self._invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
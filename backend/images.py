@@ -0,0 +1,235 @@
+import io
+import os
+import json
+import time
+import hashlib
+import logging
+import tarfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Iterable, Tuple
+
+import docker
+
+logger = logging.getLogger(__name__)
+
+IMAGE_BUILD_WORKERS = int(os.getenv("IMAGE_BUILD_WORKERS", "2"))
+IMAGE_REPOSITORY = os.getenv("FUNCTION_IMAGE_REPOSITORY", "serverless-functions")
+IMAGE_LABEL = "serverless.dependencies"
+# Retry-After, in seconds, sent while a function's image is still building
+IMAGE_RETRY_AFTER = int(os.getenv("IMAGE_RETRY_AFTER", "10"))
+
+# Dependency manifest file and Dockerfile of the derived image, per language
+DEPENDENCY_FILES = {
+    "python": "requirements.txt",
+    "javascript": "package.json",
+}
+DOCKERFILES = {
+    "python": (
+        "FROM {base}\n"
+        "COPY requirements.txt /opt/function/requirements.txt\n"
+        "RUN pip install --no-cache-dir -r /opt/function/requirements.txt\n"
+    ),
+    "javascript": (
+        "FROM {base}\n"
+        "WORKDIR /opt/function\n"
+        "COPY package.json package.json\n"
+        "RUN npm install --omit=dev --no-audit --no-fund\n"
+        "ENV NODE_PATH=/opt/function/node_modules\n"
+        "WORKDIR /\n"
+    ),
+}
+
+
+class ImageNotReadyError(RuntimeError):
+    """The function's dependency image is still being built."""
+
+
+class ImageBuildError(RuntimeError):
+    """The function's dependency image could not be built."""
+
+
+def normalize_dependencies(language: str, dependencies: Optional[str]) -> Optional[str]:
+    """Canonical form of a requirements.txt / package.json, or None if it declares nothing.
+
+    Functions whose dependencies only differ in order, comments or package.json
+    metadata share one image. Raises ValueError for a manifest that cannot be parsed.
+    """
+    if not dependencies or not dependencies.strip():
+        return None
+    if language == "python":
+        lines = {line.strip() for line in dependencies.splitlines()}
+        requirements = sorted(line for line in lines if line and not line.startswith("#"))
+        return "\n".join(requirements) + "\n" if requirements else None
+    if language == "javascript":
+        try:
+            manifest = json.loads(dependencies)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"package.json is not valid JSON: {str(e)}")
+        if not isinstance(manifest, dict) or not isinstance(manifest.get("dependencies", {}), dict):
+            raise ValueError("package.json must be an object with a \"dependencies\" object")
+        packages = manifest.get("dependencies") or {}
+        if not packages:
+            return None
+        return json.dumps({"name": "function", "private": True, "dependencies": dict(sorted(packages.items()))},
+                          indent=2)
+    raise ValueError(f"Dependencies are not supported for language: {language}")
+
+
+class ImageBuilder:
+    """Builds and caches derived images holding a function's third-party dependencies.
+
+    An image is tagged with a hash of the base image and the normalized
+    dependency set, so functions declaring the same dependencies share it and a
+    rebuild only happens when the set changes. Builds run on a small thread pool
+    in the background; ``image_for`` never blocks on one. Base images are pulled
+    in the background too, so API startup does not wait on the registry.
+    """
+
+    def __init__(self, docker_client, base_images: Dict[str, str], workers: int = IMAGE_BUILD_WORKERS):
+        self.docker_client = docker_client
+        self.base_images = dict(base_images)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-build")
+        self._base_states: Dict[str, str] = {language: "pending" for language in self.base_images}
+        self._images: Dict[str, Dict[str, Any]] = {}
+        self._builds = 0
+        self._build_failures = 0
+
+    def start(self):
+        """Make sure the base images are present, without holding up the caller."""
+        for language in self.base_images:
+            self._executor.submit(self._pull_base, language)
+
+    def ensure(self, language: str, dependencies: Optional[str], retry_failed: bool = True) -> Optional[str]:
+        """Start building the image for a dependency set unless it exists. Returns its tag, or None for none."""
+        normalized = normalize_dependencies(language, dependencies)
+        if normalized is None:
+            return None
+        tag = self.image_tag(language, normalized)
+        with self._lock:
+            state = self._images.get(tag)
+            if state is not None and (state["state"] in ("building", "ready") or not retry_failed):
+                return tag
+            self._images[tag] = {"language": language, "state": "building", "error": None, "build_time": None}
+
+        if self._exists(tag):
+            with self._lock:
+                self._images[tag]["state"] = "ready"
+            return tag
+        logger.info(f"Building dependency image {tag}")
+        self._executor.submit(self._build, language, normalized, tag)
+        return tag
+
+    def image_for(self, language: str, dependencies: Optional[str]) -> Optional[str]:
+        """The image to run a function in. Raises if its dependency image is not ready yet."""
+        # A failed build is only retried when the function is saved again
+        tag = self.ensure(language, dependencies, retry_failed=False)
+        if tag is None:
+            return self.base_images.get(language)
+        with self._lock:
+            state = dict(self._images[tag])
+        if state["state"] == "failed":
+            raise ImageBuildError(f"Installing dependencies failed: {state['error']}")
+        if state["state"] != "ready":
+            raise ImageNotReadyError("Function dependencies are still being installed")
+        return tag
+
+    def prebuild(self, functions: Iterable[Tuple[str, Optional[str]]]):
+        """Ensure images for ``(language, dependencies)`` pairs, e.g. every stored function at startup."""
+        for language, dependencies in functions:
+            try:
+                self.ensure(language, dependencies)
+            except ValueError as e:
+                logger.warning(f"Skipping invalid {language} dependencies: {str(e)}")
+
+    def image_tag(self, language: str, normalized: str) -> str:
+        dockerfile = DOCKERFILES[language].format(base=self.base_images[language])
+        digest = hashlib.sha256(f"{dockerfile}\0{normalized}".encode("utf-8")).hexdigest()
+        return f"{IMAGE_REPOSITORY}:{language}-{digest[:16]}"
+
+    def _exists(self, tag: str) -> bool:
+        try:
+            self.docker_client.images.get(tag)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
+        except Exception as e:
+            logger.warning(f"Could not look up image {tag}: {str(e)}")
+            return False
+
+    def _build(self, language: str, normalized: str, tag: str):
+        start = time.time()
+        try:
+            context = self._build_context(language, normalized)
+            self.docker_client.images.build(
+                fileobj=context,
+                custom_context=True,
+                tag=tag,
+                rm=True,
+                pull=False,
+                labels={IMAGE_LABEL: "true", f"{IMAGE_LABEL}.language": language},
+            )
+        except Exception as e:
+            error = str(e)
+            build_log = getattr(e, "build_log", None)
+            if build_log:
+                lines = [entry.get("stream", "").strip() for entry in build_log if entry.get("stream")]
+                error = f"{error}: {' | '.join(lines[-5:])}"
+            logger.error(f"Building dependency image {tag} failed: {error}")
+            with self._lock:
+                self._images[tag].update(state="failed", error=error)
+                self._build_failures += 1
+            return
+        duration = time.time() - start
+        logger.info(f"Built dependency image {tag} in {duration:.1f}s")
+        with self._lock:
+            self._images[tag].update(state="ready", build_time=duration)
+            self._builds += 1
+
+    def _build_context(self, language: str, normalized: str) -> io.BytesIO:
+        files = {
+            "Dockerfile": DOCKERFILES[language].format(base=self.base_images[language]),
+            DEPENDENCY_FILES[language]: normalized,
+        }
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w") as archive:
+            for name, content in files.items():
+                data = content.encode("utf-8")
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                archive.addfile(info, io.BytesIO(data))
+        buffer.seek(0)
+        return buffer
+
+    def _pull_base(self, language: str):
+        image = self.base_images[language]
+        if self._exists(image):
+            self._base_states[language] = "ready"
+            logger.info(f"Base image {image} is already available")
+            return
+        self._base_states[language] = "pulling"
+        logger.info(f"Pulling base image {image}...")
+        try:
+            self.docker_client.images.pull(image)
+        except Exception as e:
+            self._base_states[language] = "failed"
+            logger.error(f"Pulling base image {image} failed: {str(e)}")
+            return
+        self._base_states[language] = "ready"
+        logger.info(f"Base image {image} pulled successfully")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "base_images": {
+                    language: {"image": image, "state": self._base_states[language]}
+                    for language, image in self.base_images.items()
+                },
+                "images": {tag: dict(state) for tag, state in self._images.items()},
+                "builds": self._builds,
+                "build_failures": self._build_failures,
+            }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
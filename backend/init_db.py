@@ -1,6 +1,6 @@
 import pymysql
 from database import engine
-from models import Base
+from migrations import upgrade_schema
 
 def init_db():
     # First, create the database if it doesn't exist
@@ -19,9 +19,10 @@ def init_db():
     finally:
         connection.close()
     
-    # Now create the tables
+    # Now create the tables, or add what is missing to the ones from an earlier version
     print("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
+    for statement in upgrade_schema(engine):
+        print(f"  {statement}")
     print("Database tables created successfully!")
 
 if __name__ == "__main__":
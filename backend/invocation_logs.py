@@ -0,0 +1,365 @@
+import os
+import time
+import zlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# Output kept per invocation: the first LOG_HEAD_BYTES, then the most recent bytes up to LOG_MAX_BYTES in all
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(64 * 1024)))
+LOG_HEAD_BYTES = int(os.getenv("LOG_HEAD_BYTES", str(8 * 1024)))
+LOG_RETENTION = float(os.getenv("LOG_RETENTION", str(3 * 24 * 3600)))  # seconds logs are kept
+LOG_MAX_PER_FUNCTION = int(os.getenv("LOG_MAX_PER_FUNCTION", "1000"))  # invocations kept per function
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))      # seconds
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_MAX_PENDING = int(os.getenv("LOG_MAX_PENDING", "5000"))             # finished logs waiting to be written
+LOG_PURGE_INTERVAL = float(os.getenv("LOG_PURGE_INTERVAL", "300"))     # seconds between retention passes
+LOG_FOLLOW_POLL = float(os.getenv("LOG_FOLLOW_POLL", "1.0"))           # seconds a follower waits per read
+
+
+def truncation_marker(dropped: int) -> bytes:
+    return f"\n[... {dropped} bytes truncated ...]\n".encode("utf-8")
+
+
+class LogBuffer:
+    """What one invocation wrote to stdout and stderr, capped at ``max_bytes``.
+
+    The first ``head_bytes`` are always kept, as that is where startup
+    messages and the first error usually are; past that the buffer is a ring
+    of the most recent output. Dropped output shows up as a truncation marker
+    between the two. Positions in the stream count every byte written, so a
+    follower can pick up where it left off.
+    """
+
+    def __init__(self, invocation_id: Optional[str] = None, function_id: Optional[int] = None,
+                 max_bytes: int = LOG_MAX_BYTES, head_bytes: int = LOG_HEAD_BYTES):
+        self.invocation_id = invocation_id
+        self.function_id = function_id
+        self.max_bytes = max_bytes
+        self.head_bytes = min(head_bytes, max_bytes)
+        self.created_at = datetime.utcnow()
+        self.done = False
+        self._cond = threading.Condition()
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._written = 0
+
+    def write(self, data: bytes):
+        with self._cond:
+            self._written += len(data)
+            room = self.head_bytes - len(self._head)
+            if room > 0:
+                self._head += data[:room]
+                data = data[room:]
+            if data:
+                self._tail += data
+                excess = len(self._head) + len(self._tail) - self.max_bytes
+                if excess > 0:
+                    del self._tail[:excess]
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self._cond.notify_all()
+
+    @property
+    def size(self) -> int:
+        """Bytes written, including any dropped."""
+        return self._written
+
+    @property
+    def dropped(self) -> int:
+        return self._written - len(self._head) - len(self._tail)
+
+    def snapshot(self) -> Tuple[bytes, int]:
+        """The kept output, with a truncation marker if any was dropped, and the stream position it ends at."""
+        with self._cond:
+            return self._contents(), self._written
+
+    def text(self) -> str:
+        return self.snapshot()[0].decode("utf-8", errors="replace")
+
+    def read_from(self, position: int, wait: float = 0) -> Tuple[bytes, int, bool]:
+        """Output after stream ``position``, waiting up to ``wait`` seconds for some.
+
+        Returns the data, the position it ends at and whether the invocation has finished.
+        """
+        with self._cond:
+            if wait and self._written <= position and not self.done:
+                self._cond.wait(wait)
+            data = bytearray()
+            if position < len(self._head):
+                data += self._head[position:]
+            tail_start = self._written - len(self._tail)
+            if position < tail_start and self.dropped:
+                data += truncation_marker(tail_start - max(position, len(self._head)))
+            data += self._tail[max(0, position - tail_start):]
+            return bytes(data), self._written, self.done
+
+    def _contents(self) -> bytes:
+        dropped = self.dropped
+        return bytes(self._head) + (truncation_marker(dropped) if dropped else b"") + bytes(self._tail)
+
+
+class StoredLog:
+    """A finished invocation's output as read back from storage; reads like a finished LogBuffer."""
+
+    done = True
+
+    def __init__(self, row: models.InvocationLog):
+        self.invocation_id = row.id
+        self.function_id = row.function_id
+        self.created_at = row.created_at
+        self.size = row.size
+        self.dropped = row.dropped
+        self._data = zlib.decompress(row.data) if row.data else b""
+
+    def snapshot(self) -> Tuple[bytes, int]:
+        return self._data, self.size
+
+    def text(self) -> str:
+        return self._data.decode("utf-8", errors="replace")
+
+    def read_from(self, position: int, wait: float = 0) -> Tuple[bytes, int, bool]:
+        return (self._data if position < self.size else b""), self.size, True
+
+
+class LogStore:
+    """Per-invocation output buffers, written to the database in the background.
+
+    ``open`` hands out a live buffer for an invocation, readable and followable
+    while it runs. Once closed it is queued, compressed and written in
+    batches every ``flush_interval`` seconds, so invocations never wait on
+    the database; it stays readable from memory until written. Invocations that
+    printed nothing are not stored. Stored logs are kept for ``retention``
+    seconds and at most ``max_per_function`` invocations per function.
+    If the database falls behind by ``max_pending`` logs, new ones are dropped
+    and counted, as are logs the database rejects, e.g. of a deleted function.
+    """
+
+    def __init__(self, session_factory, retention: float = LOG_RETENTION,
+                 max_per_function: int = LOG_MAX_PER_FUNCTION, flush_interval: float = LOG_FLUSH_INTERVAL,
+                 batch_size: int = LOG_BATCH_SIZE, max_pending: int = LOG_MAX_PENDING):
+        self.session_factory = session_factory
+        self.retention = retention
+        self.max_per_function = max_per_function
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+
+        self._lock = threading.Condition()
+        self._live: Dict[str, LogBuffer] = {}
+        self._pending: List[LogBuffer] = []
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_purge = 0.0
+
+        self._opened = 0
+        self._written = 0
+        self._bytes_written = 0
+        self._truncated = 0
+        self._dropped = 0
+        self._purged = 0
+        self._flush_failures = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="invocation-logs", daemon=True)
+        self._thread.start()
+
+    def open(self, invocation_id: str, function_id: int) -> LogBuffer:
+        buffer = LogBuffer(invocation_id, function_id)
+        with self._lock:
+            self._live[invocation_id] = buffer
+            self._opened += 1
+        return buffer
+
+    def close(self, buffer: LogBuffer):
+        """Mark the invocation finished and queue its output to be written."""
+        buffer.finish()
+        with self._lock:
+            if buffer.dropped:
+                self._truncated += 1
+            if not buffer.size:
+                self._forget(buffer)
+            elif len(self._pending) >= self.max_pending:
+                self._dropped += 1
+                self._forget(buffer)
+            else:
+                self._pending.append(buffer)
+                if len(self._pending) >= self.batch_size:
+                    self._lock.notify()
+
+    def get(self, invocation_id: str):
+        """The live buffer or stored log of an invocation, or None."""
+        with self._lock:
+            buffer = self._live.get(invocation_id)
+        if buffer is not None:
+            return buffer
+        with self.session_factory() as db:
+            row = db.get(models.InvocationLog, invocation_id)
+            return StoredLog(row) if row is not None else None
+
+    def follow(self, log, position: int = 0) -> Iterator[bytes]:
+        """Yield a log's output from ``position`` on as it is written, until the invocation finishes."""
+        while True:
+            data, position, done = log.read_from(position, wait=LOG_FOLLOW_POLL)
+            if data:
+                yield data
+            if done:
+                return
+
+    def discard(self, function_id: int):
+        """Drop the queued and stored logs of a function, e.g. before it is deleted."""
+        with self._lock:
+            for buffer in self._pending:
+                if buffer.function_id == function_id:
+                    self._forget(buffer)
+            self._pending = [buffer for buffer in self._pending if buffer.function_id != function_id]
+        with self.session_factory() as db:
+            db.execute(delete(models.InvocationLog).where(models.InvocationLog.function_id == function_id))
+            db.commit()
+
+    def flush(self) -> int:
+        """Write every finished log queued so far. Returns the number written."""
+        with self._lock:
+            buffers, self._pending = self._pending, []
+        if not buffers:
+            return 0
+        # A retried async invocation reuses its id; the latest attempt wins
+        latest = {buffer.invocation_id: buffer for buffer in buffers}
+        rows = []
+        for buffer in latest.values():
+            data, size = buffer.snapshot()
+            rows.append({
+                "id": buffer.invocation_id,
+                "function_id": buffer.function_id,
+                "created_at": buffer.created_at,
+                "size": size,
+                "dropped": buffer.dropped,
+                "data": zlib.compress(data),
+            })
+        try:
+            try:
+                self._write(rows)
+            except IntegrityError as e:
+                logger.warning(f"Batch of {len(rows)} invocation logs was rejected, writing them one by one: {str(e)}")
+                rows = self._write_each(rows)
+        except Exception as e:
+            # Writes replace any row with the same id, so logs written before the failure can be queued again
+            logger.error(f"Failed to write {len(rows)} invocation logs: {str(e)}")
+            with self._lock:
+                self._flush_failures += 1
+                # Put them back in front, keeping within the limit
+                keep = max(0, self.max_pending - len(self._pending))
+                for buffer in buffers[keep:]:
+                    self._forget(buffer)
+                self._dropped += len(buffers) - min(len(buffers), keep)
+                self._pending = buffers[:keep] + self._pending
+            return 0
+
+        with self._lock:
+            for buffer in buffers:
+                self._forget(buffer)
+            self._written += len(rows)
+            self._bytes_written += sum(len(row["data"]) for row in rows)
+        return len(rows)
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        with self.session_factory() as db:
+            db.execute(delete(models.InvocationLog).where(models.InvocationLog.id.in_([row["id"] for row in rows])))
+            db.execute(insert(models.InvocationLog), rows)
+            db.commit()
+
+    def _write_each(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Write rows separately, dropping those the database rejects. Returns the rows written."""
+        written = []
+        for row in rows:
+            try:
+                self._write([row])
+                written.append(row)
+            except IntegrityError as e:
+                logger.error(f"Dropped log of invocation {row['id']} of function {row['function_id']}: {str(e)}")
+                with self._lock:
+                    self._dropped += 1
+        return written
+
+    def purge(self, now: Optional[datetime] = None) -> int:
+        """Delete logs past the retention period or beyond the per-function limit. Returns how many."""
+        now = now or datetime.utcnow()
+        logs = models.InvocationLog
+        with self.session_factory() as db:
+            purged = db.execute(delete(logs).where(logs.created_at < now - timedelta(seconds=self.retention))).rowcount
+            crowded = db.execute(
+                select(logs.function_id).group_by(logs.function_id).having(func.count() > self.max_per_function)
+            ).scalars().all()
+            for function_id in crowded:
+                # Keep the newest max_per_function, going by the oldest of those
+                cutoff = db.execute(
+                    select(logs.created_at).where(logs.function_id == function_id)
+                    .order_by(logs.created_at.desc()).offset(self.max_per_function - 1).limit(1)
+                ).scalar()
+                purged += db.execute(
+                    delete(logs).where(logs.function_id == function_id).where(logs.created_at < cutoff)
+                ).rowcount
+            db.commit()
+        with self._lock:
+            self._purged += purged
+        return purged
+
+    def _forget(self, buffer: LogBuffer):
+        # Called with the lock held; a newer attempt may have taken over the id
+        if self._live.get(buffer.invocation_id) is buffer:
+            del self._live[buffer.invocation_id]
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                if len(self._pending) < self.batch_size:
+                    self._lock.wait(self.flush_interval)
+            failures = self._flush_failures
+            self.flush()
+            if self._flush_failures > failures:
+                # Back off instead of hammering a database that is struggling
+                self._stop.wait(self.flush_interval)
+            if time.time() - self._last_purge >= LOG_PURGE_INTERVAL:
+                self._last_purge = time.time()
+                try:
+                    purged = self.purge()
+                    if purged:
+                        logger.info(f"Purged {purged} invocation logs")
+                except Exception as e:
+                    logger.error(f"Failed to purge invocation logs: {str(e)}")
+
+    def shutdown(self):
+        """Stop the background thread and write whatever is still queued."""
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        written = self.flush()
+        logger.info(f"Invocation log store shut down, flushed {written} remaining logs")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "live": sum(1 for buffer in self._live.values() if not buffer.done),
+                "pending": len(self._pending),
+                "opened": self._opened,
+                "written": self._written,
+                "bytes_written": self._bytes_written,
+                "truncated": self._truncated,
+                "dropped": self._dropped,
+                "purged": self._purged,
+                "flush_failures": self._flush_failures,
+                "max_bytes": LOG_MAX_BYTES,
+            }
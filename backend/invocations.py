@@ -0,0 +1,375 @@
+import os
+import uuid
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Callable
+
+import httpx
+from sqlalchemy import select, update, delete, func
+
+import models
+import telemetry
+
+logger = logging.getLogger(__name__)
+
+ASYNC_WORKERS = int(os.getenv("ASYNC_WORKERS", "4"))
+ASYNC_POLL_INTERVAL = float(os.getenv("ASYNC_POLL_INTERVAL", "1.0"))  # seconds
+ASYNC_MAX_ATTEMPTS = int(os.getenv("ASYNC_MAX_ATTEMPTS", "3"))
+ASYNC_RETRY_BACKOFF = float(os.getenv("ASYNC_RETRY_BACKOFF", "2.0"))  # seconds, doubled per attempt
+ASYNC_RETRY_BACKOFF_MAX = float(os.getenv("ASYNC_RETRY_BACKOFF_MAX", "300"))
+ASYNC_RESULT_TTL = int(os.getenv("ASYNC_RESULT_TTL", str(24 * 3600)))  # seconds
+# How long a claimed invocation may run past its timeout before another worker takes it over
+ASYNC_LEASE_GRACE = float(os.getenv("ASYNC_LEASE_GRACE", "60"))
+ASYNC_CALLBACK_TIMEOUT = float(os.getenv("ASYNC_CALLBACK_TIMEOUT", "10"))
+ASYNC_CALLBACK_ATTEMPTS = int(os.getenv("ASYNC_CALLBACK_ATTEMPTS", "3"))
+
+
+class PermanentFailure(Exception):
+    """Raised by the execute callable for a failure that retrying cannot fix."""
+
+
+class InvocationQueue:
+    """Runs asynchronous invocations from the ``invocations`` table on a pool of worker threads.
+
+    The table is the queue: workers claim due rows with a conditional update,
+    so several API processes can share it. A claim holds a lease; a row whose
+    worker died is picked up again once the lease runs out. Failed attempts are
+    retried with exponential backoff until ``max_attempts``, after which the
+    invocation fails for good and is copied to the dead-letter table. Results
+    are kept for ``result_ttl`` seconds. If the caller gave a callback URL, the
+    final state is POSTed to it.
+    """
+
+    def __init__(self, session_factory, execute: Callable[[int, Any, str], Dict[str, Any]],
+                 timeout_for: Callable[[int], Optional[float]] = lambda function_id: None,
+                 workers: int = ASYNC_WORKERS, poll_interval: float = ASYNC_POLL_INTERVAL,
+                 max_attempts: int = ASYNC_MAX_ATTEMPTS, result_ttl: int = ASYNC_RESULT_TTL):
+        self.session_factory = session_factory
+        self.execute = execute
+        self.timeout_for = timeout_for
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.result_ttl = result_ttl
+
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        self._callbacks = ThreadPoolExecutor(max_workers=2, thread_name_prefix="invocation-callback")
+        self._stats_lock = threading.Lock()
+        self._counts = {"submitted": 0, "succeeded": 0, "retried": 0, "failed": 0,
+                        "lease_expired": 0, "callbacks_delivered": 0, "callbacks_failed": 0, "expired": 0,
+                        "discarded": 0}
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"invocation-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, name="invocation-maintenance", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def submit(self, function_id: int, input_data: Any, callback_url: Optional[str] = None,
+               max_attempts: Optional[int] = None) -> models.Invocation:
+        """Queue an invocation and return its row; a worker picks it up straight away if one is free."""
+        invocation = models.Invocation(
+            id=uuid.uuid4().hex,
+            function_id=function_id,
+            status="queued",
+            input=input_data,
+            callback_url=callback_url,
+            attempts=0,
+            max_attempts=max_attempts or self.max_attempts,
+            next_attempt_at=datetime.utcnow(),
+            created_at=datetime.utcnow(),
+        )
+        with self.session_factory() as db:
+            db.add(invocation)
+            db.commit()
+            db.refresh(invocation)
+            db.expunge(invocation)
+        self._count("submitted")
+        with self._wakeup:
+            self._wakeup.notify()
+        return invocation
+
+    def get(self, invocation_id: str) -> Optional[models.Invocation]:
+        with self.session_factory() as db:
+            invocation = db.get(models.Invocation, invocation_id)
+            if invocation is not None:
+                db.expunge(invocation)
+            return invocation
+
+    def discard(self, function_id: int) -> int:
+        """Drop a function's invocations and dead letters, e.g. before the function is deleted.
+
+        Invocations not finished yet are failed rather than run, and kept, no
+        longer tied to the function, until their result TTL so callers polling
+        them see why. Returns how many were failed.
+        """
+        now = datetime.utcnow()
+        error = "Function was deleted"
+        with self.session_factory() as db:
+            pending = db.scalars(
+                select(models.Invocation)
+                .where(models.Invocation.function_id == function_id)
+                .where(models.Invocation.status.in_(("queued", "running")))
+            ).all()
+            for invocation in pending:
+                db.expunge(invocation)
+            if pending:
+                db.execute(
+                    update(models.Invocation)
+                    .where(models.Invocation.id.in_([invocation.id for invocation in pending]))
+                    .values(status="failed", error_message=error, function_id=None, finished_at=now,
+                            lease_expires_at=None, expires_at=now + timedelta(seconds=self.result_ttl))
+                )
+            db.execute(delete(models.Invocation).where(models.Invocation.function_id == function_id))
+            db.execute(delete(models.DeadLetter).where(models.DeadLetter.function_id == function_id))
+            db.commit()
+        for invocation in pending:
+            if invocation.callback_url:
+                self._callbacks.submit(self._deliver, invocation.id, invocation.callback_url, {
+                    "invocation_id": invocation.id,
+                    "function_id": function_id,
+                    "status": "failed",
+                    "result": None,
+                    "error": error,
+                    "metrics": None,
+                    "attempts": invocation.attempts,
+                })
+        if pending:
+            logger.info(f"Failed {len(pending)} unfinished invocations of deleted function {function_id}")
+            self._count("discarded", len(pending))
+        return len(pending)
+
+    # ------------------------------------------------------------------ workers
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                invocation = self._claim()
+            except Exception as e:
+                logger.error(f"Failed to claim an invocation: {str(e)}")
+                invocation = None
+            if invocation is None:
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+            try:
+                self._run(invocation)
+            except Exception as e:
+                # Its lease runs out and the invocation is picked up again, or dead-lettered
+                logger.error(f"Failed to run invocation {invocation.id}: {str(e)}")
+
+    def _claim(self) -> Optional[models.Invocation]:
+        now = datetime.utcnow()
+        with self.session_factory() as db:
+            candidates = db.scalars(
+                select(models.Invocation.id)
+                .where(models.Invocation.status == "queued")
+                .where(models.Invocation.next_attempt_at <= now)
+                .order_by(models.Invocation.next_attempt_at)
+                .limit(self.workers)
+            ).all()
+            for invocation_id in candidates:
+                invocation = db.get(models.Invocation, invocation_id)
+                timeout = self.timeout_for(invocation.function_id) or 0
+                # Only one worker's update matches while the row is still queued
+                claimed = db.execute(
+                    update(models.Invocation)
+                    .where(models.Invocation.id == invocation_id)
+                    .where(models.Invocation.status == "queued")
+                    .values(status="running", started_at=now, attempts=models.Invocation.attempts + 1,
+                            lease_expires_at=now + timedelta(seconds=timeout + ASYNC_LEASE_GRACE))
+                ).rowcount
+                db.commit()
+                if claimed:
+                    db.refresh(invocation)
+                    db.expunge(invocation)
+                    return invocation
+        return None
+
+    def _run(self, invocation: models.Invocation):
+        # Time the invocation was due but waited for a free worker, not counting retry backoff
+        telemetry.QUEUE_WAIT_SECONDS.labels("async").observe(
+            max(0.0, (invocation.started_at - invocation.next_attempt_at).total_seconds()))
+        logger.info(f"Running invocation {invocation.id} of function {invocation.function_id} "
+                    f"(attempt {invocation.attempts}/{invocation.max_attempts})")
+        try:
+            outcome = self.execute(invocation.function_id, invocation.input, invocation.id)
+        except Exception as e:
+            retry = not isinstance(e, PermanentFailure) and invocation.attempts < invocation.max_attempts
+            self._fail(invocation, str(e), getattr(e, "metrics", None), retry)
+            return
+        if self._finish(invocation, status="succeeded", result=outcome.get("result"), metrics=outcome.get("metrics")):
+            self._count("succeeded")
+
+    def _fail(self, invocation: models.Invocation, error: str, metrics: Optional[Dict[str, Any]], retry: bool):
+        if retry:
+            delay = min(ASYNC_RETRY_BACKOFF_MAX, ASYNC_RETRY_BACKOFF * 2 ** (invocation.attempts - 1))
+            delay *= random.uniform(0.8, 1.2)  # jitter, so failed batches do not retry in lockstep
+            logger.warning(f"Invocation {invocation.id} failed, retrying in {delay:.1f}s: {error}")
+            with self.session_factory() as db:
+                db.execute(
+                    update(models.Invocation)
+                    .where(models.Invocation.id == invocation.id)
+                    .where(models.Invocation.status == "running")
+                    .values(status="queued", error_message=error, metrics=metrics, lease_expires_at=None,
+                            next_attempt_at=datetime.utcnow() + timedelta(seconds=delay))
+                )
+                db.commit()
+            self._count("retried")
+            return
+
+        logger.error(f"Invocation {invocation.id} failed after {invocation.attempts} attempts: {error}")
+        if self._finish(invocation, status="failed", error=error, metrics=metrics, dead_letter=True):
+            self._count("failed")
+
+    def _finish(self, invocation: models.Invocation, status: str, result: Any = None, error: Optional[str] = None,
+                metrics: Optional[Dict[str, Any]] = None, dead_letter: bool = False) -> bool:
+        now = datetime.utcnow()
+        with self.session_factory() as db:
+            finished = db.execute(
+                update(models.Invocation)
+                .where(models.Invocation.id == invocation.id)
+                .where(models.Invocation.status == "running")
+                .values(status=status, result=result, error_message=error, metrics=metrics, finished_at=now,
+                        lease_expires_at=None, expires_at=now + timedelta(seconds=self.result_ttl))
+            ).rowcount
+            if not finished:
+                # Already failed by discard, as its function was deleted while it ran
+                return False
+            if dead_letter:
+                db.add(models.DeadLetter(
+                    invocation_id=invocation.id,
+                    function_id=invocation.function_id,
+                    input=invocation.input,
+                    error_message=error,
+                    attempts=invocation.attempts,
+                    created_at=now,
+                ))
+            db.commit()
+        if invocation.callback_url:
+            payload = {
+                "invocation_id": invocation.id,
+                "function_id": invocation.function_id,
+                "status": status,
+                "result": result,
+                "error": error,
+                "metrics": metrics,
+                "attempts": invocation.attempts,
+            }
+            self._callbacks.submit(self._deliver, invocation.id, invocation.callback_url, payload)
+        return True
+
+    def _deliver(self, invocation_id: str, url: str, payload: Dict[str, Any]):
+        delivered = False
+        for attempt in range(ASYNC_CALLBACK_ATTEMPTS):
+            try:
+                response = httpx.post(url, json=payload, timeout=ASYNC_CALLBACK_TIMEOUT)
+                response.raise_for_status()
+                delivered = True
+                break
+            except httpx.HTTPError as e:
+                logger.warning(f"Callback for invocation {invocation_id} to {url} failed: {str(e)}")
+                if self._stop.wait(ASYNC_RETRY_BACKOFF * 2 ** attempt):
+                    break
+        self._count("callbacks_delivered" if delivered else "callbacks_failed")
+        try:
+            with self.session_factory() as db:
+                db.execute(
+                    update(models.Invocation)
+                    .where(models.Invocation.id == invocation_id)
+                    .values(callback_status="delivered" if delivered else "failed")
+                )
+                db.commit()
+        except Exception as e:
+            logger.error(f"Failed to record callback status of invocation {invocation_id}: {str(e)}")
+
+    # ------------------------------------------------------------------ maintenance
+
+    def _maintain(self):
+        while not self._stop.wait(self.poll_interval * 10):
+            try:
+                self.recover_expired_leases()
+                self.purge_expired()
+            except Exception as e:
+                logger.error(f"Invocation maintenance failed: {str(e)}")
+
+    def recover_expired_leases(self) -> int:
+        """Requeue running invocations whose worker stopped renewing them, e.g. after a crash.
+
+        One that has used up its attempts fails for good and is dead-lettered
+        instead, so an invocation that takes its worker down every time is not
+        retried forever. Returns how many were requeued.
+        """
+        error = "Worker lease expired"
+        now = datetime.utcnow()
+        with self.session_factory() as db:
+            expired = db.scalars(
+                select(models.Invocation)
+                .where(models.Invocation.status == "running")
+                .where(models.Invocation.lease_expires_at < now)
+            ).all()
+            for invocation in expired:
+                db.expunge(invocation)
+            requeue = [invocation.id for invocation in expired if invocation.attempts < invocation.max_attempts]
+            recovered = 0
+            if requeue:
+                recovered = db.execute(
+                    update(models.Invocation)
+                    .where(models.Invocation.id.in_(requeue))
+                    .where(models.Invocation.status == "running")
+                    .values(status="queued", lease_expires_at=None, next_attempt_at=now, error_message=error)
+                ).rowcount
+                db.commit()
+        if recovered:
+            logger.warning(f"Requeued {recovered} invocations with expired leases")
+            self._count("lease_expired", recovered)
+
+        for invocation in expired:
+            if invocation.attempts < invocation.max_attempts:
+                continue
+            logger.error(f"Invocation {invocation.id} failed after {invocation.attempts} attempts: {error}")
+            if self._finish(invocation, status="failed", error=error, dead_letter=True):
+                self._count("lease_expired")
+                self._count("failed")
+        return recovered
+
+    def purge_expired(self) -> int:
+        """Delete finished invocations whose results are past their TTL."""
+        with self.session_factory() as db:
+            purged = db.execute(
+                delete(models.Invocation).where(models.Invocation.expires_at < datetime.utcnow())
+            ).rowcount
+            db.commit()
+        if purged:
+            self._count("expired", purged)
+        return purged
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self._counts[key] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self.session_factory() as db:
+            by_status = dict(db.execute(
+                select(models.Invocation.status, func.count()).group_by(models.Invocation.status)
+            ).all())
+        with self._stats_lock:
+            counts = dict(self._counts)
+        return {"workers": self.workers, "queue": by_status, **counts}
+
+    def shutdown(self):
+        """Stop the workers after their current invocation. Queued invocations stay in the table."""
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=self.poll_interval + 1)
+        self._callbacks.shutdown(wait=False)
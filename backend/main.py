@@ -1,17 +1,38 @@
-from fastapi import FastAPI, Depends, HTTPException
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import and_, or_
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Any, List, Optional
+from datetime import datetime, timedelta
+from contextlib import closing
 import json
 import uvicorn
 import logging
 import signal
 import sys
+import threading
+import time
 
 import models
 import database
 import schemas
-from execution_engine import ExecutionEngine
+from execution_engine import ExecutionEngine, ExecutionError, ExecutionTimeoutError
+from concurrency import ExecutionLimiter, ExecutionRejected
+from metrics_sink import MetricsSink
+from function_cache import FunctionCache
+from result_cache import ResultCache, result_key
+from routing import RouteTable, build_http_event, parse_http_result
+from metrics_rollup import ROLLUP_SECONDS, query_buckets
+from invocations import InvocationQueue, PermanentFailure
+from invocation_logs import LogStore
+from migrations import upgrade_schema
+from images import ImageNotReadyError, ImageBuildError, IMAGE_RETRY_AFTER, normalize_dependencies
+from prewarmer import Prewarmer
+from resource_sizing import ResourceSizer
+from batch import Batch, BATCH_PARALLELISM, BATCH_MAX_PARALLELISM, feed_json_array, feed_ndjson
+import telemetry
+from tracing import Trace
 
 # Configure logging
 logging.basicConfig(
@@ -30,9 +51,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Log-Size", "X-Log-Truncated"],
 )
 
+# A database set up by an earlier version lacks the newer tables and columns
+try:
+    upgrade_schema(database.engine)
+except Exception as e:
+    logger.error(f"Failed to upgrade the database schema: {str(e)}")
+
 execution_engine = ExecutionEngine()
+execution_limiter = ExecutionLimiter()
+telemetry.register_platform(execution_engine.pool_stats, execution_limiter.stats)
+metrics_sink = MetricsSink(database.SessionLocal)
+metrics_sink.start()
+function_cache = FunctionCache()
+result_cache = ResultCache()
+route_table = RouteTable(database.SessionLocal)
+# What each invocation prints, kept apart from the platform's own log and written in the background
+invocation_logs = LogStore(database.SessionLocal)
+invocation_logs.start()
+# Async invocations; the callables are looked up late since they are defined further down
+invocation_queue = InvocationQueue(
+    database.SessionLocal,
+    lambda function_id, input_data, invocation_id: run_queued_invocation(function_id, input_data, invocation_id),
+    timeout_for=lambda function_id: queued_invocation_timeout(function_id),
+)
+invocation_queue.start()
+
+def prebuild_function_images():
+    """Build any dependency images missing for stored functions, e.g. on a fresh Docker host."""
+    try:
+        with database.SessionLocal() as db:
+            functions = db.query(models.Function.language, models.Function.dependencies) \
+                .filter(models.Function.dependencies.isnot(None)).all()
+        execution_engine.prebuild_images(functions)
+    except Exception as e:
+        logger.error(f"Failed to prebuild function images: {str(e)}")
+
+threading.Thread(target=prebuild_function_images, name="image-prebuild", daemon=True).start()
+
+# Keeps containers warm ahead of the demand predicted from metrics history, starting with a pass on startup
+prewarmer = Prewarmer(database.SessionLocal, execution_engine,
+                      lambda function_id: function_cache.get(function_id, load_function))
+prewarmer.start()
+# Sets each function's container limits, from its own settings or its metrics history
+resource_sizer = ResourceSizer(database.SessionLocal, execution_engine)
+resource_sizer.start()
 
 # Dependency
 def get_db():
@@ -44,10 +109,14 @@ def get_db():
 
 @app.post("/functions/")
 def create_function(function: schemas.FunctionCreate, db: Session = Depends(get_db)):
+    validate_dependencies(function.language, function.dependencies)
     db_function = models.Function(**function.dict())
     db.add(db_function)
     db.commit()
     db.refresh(db_function)
+    route_table.rebuild()
+    execution_engine.prepare_image(db_function.language, db_function.dependencies)
+    resource_sizer.refresh(db_function.id, db_function.memory_limit, db_function.cpu_limit)
     return db_function
 
 @app.get("/functions/", response_model=List[schemas.Function])
@@ -67,13 +136,37 @@ def update_function(function_id: int, function: schemas.FunctionUpdate, db: Sess
     if db_function is None:
         raise HTTPException(status_code=404, detail="Function not found")
     
-    for key, value in function.dict(exclude_unset=True).items():
+    changes = function.dict(exclude_unset=True)
+    language_changed = "language" in changes and changes["language"] != db_function.language
+    code_changed = "code" in changes and changes["code"] != db_function.code
+    dependencies_changed = "dependencies" in changes and changes["dependencies"] != db_function.dependencies
+    validate_dependencies(changes.get("language", db_function.language),
+                          changes.get("dependencies", db_function.dependencies))
+    for key, value in changes.items():
         setattr(db_function, key, value)
     
     db.commit()
     db.refresh(db_function)
+    function_cache.invalidate(function_id)
+    if code_changed or language_changed or dependencies_changed:
+        result_cache.invalidate(function_id)
+    if "route" in changes:
+        route_table.rebuild()
+    if "memory_limit" in changes or "cpu_limit" in changes:
+        resource_sizer.refresh(function_id, db_function.memory_limit, db_function.cpu_limit)
+    if language_changed or dependencies_changed:
+        execution_engine.prepare_image(db_function.language, db_function.dependencies)
+    if code_changed or language_changed or dependencies_changed:
+        # Containers of the old language or dependency image can never serve this function again
+        execution_engine.invalidate(str(function_id), discard_containers=language_changed or dependencies_changed)
     return db_function
 
+def validate_dependencies(language: str, dependencies: Optional[str]):
+    try:
+        normalize_dependencies(language, dependencies)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.delete("/functions/{function_id}")
 def delete_function(function_id: int, db: Session = Depends(get_db)):
     function = db.query(models.Function).filter(models.Function.id == function_id).first()
@@ -81,62 +174,528 @@ def delete_function(function_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Function not found")
     
     execution_engine.cleanup(str(function_id))
+    # Rows that reference the function go first, or the delete breaks their foreign keys
+    metrics_sink.discard(function_id)
+    invocation_queue.discard(function_id)
+    invocation_logs.discard(function_id)
+    db.query(models.FunctionMetricsRollup).filter(models.FunctionMetricsRollup.function_id == function_id) \
+        .delete(synchronize_session=False)
     db.delete(function)
     db.commit()
+    function_cache.invalidate(function_id)
+    result_cache.invalidate(function_id)
+    resource_sizer.forget(function_id)
+    route_table.rebuild()
     return {"message": "Function deleted successfully"}
 
 @app.post("/functions/{function_id}/execute")
-def execute_function(function_id: int, input_data: dict, db: Session = Depends(get_db)):
-    logger.info(f"Received request to execute function {function_id}")
-    function = db.query(models.Function).filter(models.Function.id == function_id).first()
+async def execute_function(function_id: int, input_data: dict, stream: bool = Query(False),
+                           profile: bool = Query(False)):
+    """Execute a function. The response carries its trace and whether it came from the result cache
+    (``cached``, for functions marked cacheable); with ``profile=true`` also its hottest frames."""
+    logger.debug(f"Received request to execute function {function_id}")
+    if stream:
+        return await stream_function_limited(function_id, input_data, profile)
+    return await run_function_limited(function_id, input_data, profile)
+
+async def run_function_limited(function_id: int, input_data: Any, profile: bool = False):
+    trace = Trace()
+    try:
+        # Runs on the engine's own thread pool so a burst of invocations cannot starve other endpoints
+        return await execution_limiter.run(str(function_id), run_function, function_id, input_data, trace, profile)
+    except ExecutionRejected as e:
+        logger.warning(f"Rejected execution of function {function_id}: {str(e)}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def stream_function_limited(function_id: int, input_data: Any, profile: bool = False):
+    """Execute a function and send its output as server-sent events while it runs.
+
+    Every item a generator function yields is sent as an unnamed event, then a
+    ``result`` event with the return value, metrics and trace. A failure after
+    the stream has started is sent as an ``error`` event.
+    """
+    trace = Trace()
+    events = execution_limiter.stream(str(function_id), stream_function, function_id, input_data, trace, profile)
+    try:
+        # Wait for the first event so rejections and early failures still get a proper status code
+        first = await events.__anext__()
+    except ExecutionRejected as e:
+        logger.warning(f"Rejected execution of function {function_id}: {str(e)}")
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    return StreamingResponse(stream_events(first, events), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+async def stream_events(first, events):
+    try:
+        kind, payload = first
+        yield sse_event(payload, None if kind == "chunk" else kind)
+        async for kind, payload in events:
+            yield sse_event(payload, None if kind == "chunk" else kind)
+    except HTTPException as e:
+        yield sse_event({"status_code": e.status_code, "detail": e.detail}, "error")
+    finally:
+        await events.aclose()
+
+def sse_event(data: Any, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+@app.post("/functions/{function_id}/execute_batch")
+async def execute_batch(function_id: int, request: Request,
+                        parallelism: int = Query(BATCH_PARALLELISM, ge=1, le=BATCH_MAX_PARALLELISM),
+                        ordered: bool = True):
+    """Execute a function over a JSON array, or an NDJSON stream, of inputs.
+
+    Responds with one NDJSON line per input as soon as it is done, either
+    ``{"index": i, "result": ..., "metrics": ...}`` or ``{"index": i, "error": ...}``.
+    Lines come in input order unless ``ordered=false``.
+    """
+    function = function_cache.get(function_id, load_function)
+    if function is None:
+        raise HTTPException(status_code=404, detail="Function not found")
+
+    batch = Batch(execution_limiter, str(function_id), lambda inputs: run_batch_lane(function_id, function, inputs),
+                  parallelism=parallelism, ordered=ordered)
+    batch.start()
+    try:
+        try:
+            if "ndjson" in request.headers.get("content-type", ""):
+                # Lanes are already running, so execution overlaps with the upload
+                await feed_ndjson(request.stream(), batch.inputs)
+            else:
+                feed_json_array(await request.body(), batch.inputs)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        batch.inputs.close()
+        logger.info(f"Running batch of {batch.inputs.count} inputs for function {function_id} on {parallelism} lanes")
+
+        results = batch.results()
+        try:
+            # Wait for the first outcome so a batch that was not admitted at all gets a proper status code
+            first = await results.__anext__()
+        except StopAsyncIteration:
+            first = None
+        except ExecutionRejected as e:
+            logger.warning(f"Rejected batch for function {function_id}: {str(e)}")
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except BaseException:
+        # Also on a client that disconnects mid-upload: lanes waiting for more inputs would otherwise wait for good
+        await batch.close()
+        raise
+    return StreamingResponse(batch_lines(first, results), media_type="application/x-ndjson")
+
+async def batch_lines(first, results):
+    if first is None:
+        return
+    yield json.dumps(first) + "\n"
+    async for outcome in results:
+        yield json.dumps(outcome) + "\n"
+
+def run_batch_lane(function_id: int, function, inputs):
+    """One lane of a batch: executes inputs on a single warm container until none are left."""
+    for index, outcome in execution_engine.execute_batch(
+        str(function_id),
+        function.code,
+        inputs,
+        language=function.language,
+        timeout=function.timeout,
+        dependencies=function.dependencies
+    ):
+        metrics_sink.record(function_id, outcome["metrics"])
+        yield index, outcome
+
+@app.post("/functions/{function_id}/invoke")
+async def invoke_function(function_id: int, input_data: dict, response: Response,
+                          async_: bool = Query(False, alias="async"), callback_url: Optional[str] = None,
+                          max_attempts: Optional[int] = Query(None, ge=1, le=10)):
+    """Invoke a function. With ``async=true``, queue it and return an invocation id to poll straight away."""
+    if not async_:
+        return await run_function_limited(function_id, input_data)
+    if function_cache.get(function_id, load_function) is None:
+        raise HTTPException(status_code=404, detail="Function not found")
+    invocation = invocation_queue.submit(function_id, input_data, callback_url=callback_url,
+                                         max_attempts=max_attempts)
+    logger.info(f"Queued invocation {invocation.id} of function {function_id}")
+    response.status_code = 202
+    return schemas.InvocationAccepted(invocation_id=invocation.id, status=invocation.status,
+                                      status_url=f"/invocations/{invocation.id}")
+
+def run_queued_invocation(function_id: int, input_data: Any, invocation_id: str):
+    """Execute an invocation taken off the async queue, on one of its worker threads.
+
+    Its output is logged under the invocation id; a retry replaces that of the failed attempt.
+    """
+    trace = Trace()
+    with trace.span("function_lookup"):
+        function = function_cache.get(function_id, load_function)
+    if function is None:
+        raise PermanentFailure("Function not found")
+    log = invocation_logs.open(invocation_id, function_id)
+    try:
+        result = execution_engine.execute_function(
+            str(function_id),
+            function.code,
+            input_data,
+            language=function.language,
+            timeout=function.timeout,
+            dependencies=function.dependencies,
+            trace=trace,
+            log=log
+        )
+    except ImageBuildError as e:
+        raise PermanentFailure(str(e))
+    except ExecutionError as e:
+        record_metrics(function_id, e.metrics, trace)
+        raise
+    finally:
+        invocation_logs.close(log)
+    record_metrics(function_id, result["metrics"], trace)
+    return result
+
+def queued_invocation_timeout(function_id: int) -> Optional[float]:
+    function = function_cache.get(function_id, load_function)
+    return function.timeout if function is not None else None
+
+def load_function(function_id: int):
+    with database.SessionLocal() as db:
+        return db.query(models.Function).filter(models.Function.id == function_id).first()
+
+def run_function(function_id: int, input_data: Any, trace: Optional[Trace] = None, profile: bool = False):
+    """Look up and execute a function, blocking until it completes."""
+    trace = trace or Trace()
+    # Time between the request coming in and an execution slot picking it up
+    trace.add_span("queue_wait", trace.started, time.perf_counter())
+    with trace.span("function_lookup"):
+        function = function_cache.get(function_id, load_function)
     if function is None:
         logger.warning(f"Function {function_id} not found")
         raise HTTPException(status_code=404, detail="Function not found")
-    
+
+    cache_key = None
+    if function.cacheable and not profile:
+        cache_key = result_key(function_id, function.language, function.code, function.dependencies, input_data)
+        with trace.span("result_cache") as span:
+            cached = result_cache.get(cache_key)
+            span.attributes["hit"] = cached is not None
+        telemetry.RESULT_CACHE_LOOKUPS.labels(str(function_id), "hit" if cached is not None else "miss").inc()
+        if cached is not None:
+            # Served without running the function, so there are no new metrics to record
+            logger.info(f"Function {function_id} answered from the result cache")
+            result, metrics = cached
+            trace.finish()
+            return {"result": result, "metrics": metrics, "cached": True, "trace": trace.as_dict()}
+
+    # The function's output is logged under the trace id, readable at /functions/{id}/invocations/{trace id}/logs
+    log = invocation_logs.open(trace.trace_id, function_id)
     try:
-        logger.info(f"Starting execution of function {function_id} with input: {input_data}")
+        logger.debug(f"Starting execution of function {function_id}")
         result = execution_engine.execute_function(
             str(function_id), 
             function.code, 
             input_data,
-            language=function.language
+            language=function.language,
+            timeout=function.timeout,
+            dependencies=function.dependencies,
+            trace=trace,
+            profile=profile,
+            log=log
         )
         
-        # Store metrics
-        logger.info(f"Storing metrics for function {function_id}")
-        metrics = models.FunctionMetrics(
-            function_id=function_id,
-            execution_time=result["metrics"]["execution_time"],
-            memory_usage=result["metrics"]["memory_usage"],
-            cpu_usage=result["metrics"]["cpu_usage"],
-            status=result["metrics"]["status"],
-            error_message=result["metrics"].get("error_message")
-        )
-        db.add(metrics)
-        db.commit()
-        logger.info(f"Function {function_id} executed successfully")
-        
+        # Metrics are written in batches in the background
+        record_metrics(function_id, result["metrics"], trace)
+        logger.debug(f"Function {function_id} executed successfully")
+        if cache_key is not None:
+            result_cache.put(cache_key, function_id, result["result"], result["metrics"], function.cache_ttl)
+
+        result["cached"] = False
+        result["trace"] = trace.as_dict()
         return result
-    except Exception as e:
+    except ImageNotReadyError as e:
+        logger.warning(f"Function {function_id} is not ready: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(IMAGE_RETRY_AFTER)})
+    except ImageBuildError as e:
+        logger.error(f"Function {function_id} has no usable image: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    except ExecutionTimeoutError as e:
+        logger.error(f"Function {function_id} timed out: {str(e)}")
+        record_metrics(function_id, e.metrics, trace)
+        raise HTTPException(status_code=504, detail=str(e), headers={"X-Trace-Id": trace.trace_id})
+    except ExecutionError as e:
         logger.error(f"Error executing function {function_id}: {str(e)}")
+        record_metrics(function_id, e.metrics, trace)
+        raise HTTPException(status_code=500, detail=str(e), headers={"X-Trace-Id": trace.trace_id})
+    finally:
+        invocation_logs.close(log)
+
+def stream_function(function_id: int, input_data: Any, trace: Optional[Trace] = None, profile: bool = False):
+    """Look up and execute a function, yielding ("chunk", data) as it runs and finally ("result", ...)."""
+    trace = trace or Trace()
+    trace.add_span("queue_wait", trace.started, time.perf_counter())
+    with trace.span("function_lookup"):
+        function = function_cache.get(function_id, load_function)
+    if function is None:
+        logger.warning(f"Function {function_id} not found")
+        raise HTTPException(status_code=404, detail="Function not found")
+
+    log = invocation_logs.open(trace.trace_id, function_id)
+    try:
+        logger.debug(f"Starting streaming execution of function {function_id}")
+        with closing(execution_engine.execute_function_stream(
+            str(function_id),
+            function.code,
+            input_data,
+            language=function.language,
+            timeout=function.timeout,
+            dependencies=function.dependencies,
+            trace=trace,
+            profile=profile,
+            log=log
+        )) as events:
+            for kind, payload in events:
+                if kind == "result":
+                    record_metrics(function_id, payload["metrics"], trace)
+                    logger.debug(f"Function {function_id} executed successfully")
+                    payload["trace"] = trace.as_dict()
+                yield kind, payload
+    except ImageNotReadyError as e:
+        logger.warning(f"Function {function_id} is not ready: {str(e)}")
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(IMAGE_RETRY_AFTER)})
+    except ImageBuildError as e:
+        logger.error(f"Function {function_id} has no usable image: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+    except ExecutionTimeoutError as e:
+        logger.error(f"Function {function_id} timed out: {str(e)}")
+        record_metrics(function_id, e.metrics, trace)
+        raise HTTPException(status_code=504, detail=str(e), headers={"X-Trace-Id": trace.trace_id})
+    except ExecutionError as e:
+        logger.error(f"Error executing function {function_id}: {str(e)}")
+        record_metrics(function_id, e.metrics, trace)
+        raise HTTPException(status_code=500, detail=str(e), headers={"X-Trace-Id": trace.trace_id})
+    finally:
+        invocation_logs.close(log)
+
+def record_metrics(function_id: int, metrics, trace: Trace):
+    """Queue an invocation's metrics and trace for the database; the trace ends here."""
+    with trace.span("metrics_write"):
+        metrics_sink.record(function_id, metrics, trace.as_dict())
+    trace.finish()
 
-@app.get("/functions/{function_id}/metrics")
-def get_function_metrics(function_id: int, db: Session = Depends(get_db)):
-    metrics = db.query(models.FunctionMetrics).filter(
-        models.FunctionMetrics.function_id == function_id
-    ).order_by(models.FunctionMetrics.timestamp.desc()).all()
+@app.get("/functions/{function_id}/metrics", response_model=List[schemas.FunctionMetrics])
+def get_function_metrics(function_id: int, response: Response, limit: int = Query(100, ge=1, le=1000),
+                         cursor: Optional[str] = None, db: Session = Depends(get_db)):
+    """Raw metrics rows, newest first. Pass the X-Next-Cursor header back as ``cursor`` for the next page."""
+    query = db.query(models.FunctionMetrics).filter(models.FunctionMetrics.function_id == function_id)
+    if cursor:
+        try:
+            cursor_time, cursor_id = cursor.rsplit("_", 1)
+            cursor_time, cursor_id = datetime.fromisoformat(cursor_time), int(cursor_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.filter(or_(
+            models.FunctionMetrics.timestamp < cursor_time,
+            and_(models.FunctionMetrics.timestamp == cursor_time, models.FunctionMetrics.id < cursor_id),
+        ))
+    metrics = query.order_by(
+        models.FunctionMetrics.timestamp.desc(), models.FunctionMetrics.id.desc()
+    ).limit(limit).all()
+    if len(metrics) == limit:
+        last = metrics[-1]
+        response.headers["X-Next-Cursor"] = f"{last.timestamp.isoformat()}_{last.id}"
     return metrics
 
+@app.get("/functions/{function_id}/metrics/summary", response_model=schemas.MetricsSummary)
+def get_function_metrics_summary(function_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                                 bucket: int = Query(ROLLUP_SECONDS, ge=ROLLUP_SECONDS),
+                                 db: Session = Depends(get_db)):
+    """Per-bucket count, error rate and percentiles over a time range (default: the last hour)."""
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(hours=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    try:
+        buckets = query_buckets(db, function_id, start, end, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"function_id": function_id, "start": start, "end": end, "bucket_seconds": bucket, "buckets": buckets}
+
+@app.get("/traces/{trace_id}", response_model=schemas.Trace)
+def get_trace(trace_id: str, db: Session = Depends(get_db)):
+    """Stored span tree of an invocation. Metrics are written in batches, so a trace shows up within a second or so."""
+    metrics = db.query(models.FunctionMetrics).filter(models.FunctionMetrics.trace_id == trace_id).first()
+    if metrics is None or metrics.trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return {"trace_id": trace_id, "function_id": metrics.function_id, "status": metrics.status,
+            "timestamp": metrics.timestamp, **metrics.trace}
+
+@app.get("/functions/{function_id}/invocations/{invocation_id}/logs")
+def get_invocation_logs(function_id: int, invocation_id: str, tail: Optional[int] = Query(None, ge=1),
+                        follow: bool = False):
+    """What an invocation printed, as plain text. ``invocation_id`` is the trace id of a synchronous call.
+
+    Output past the size cap is cut from the middle, marked where it was cut.
+    ``tail`` limits it to the last lines; ``follow`` keeps the response open
+    and streams further output until the invocation finishes.
+    """
+    log = invocation_logs.get(invocation_id)
+    if log is None or log.function_id != function_id:
+        raise HTTPException(status_code=404, detail="Invocation logs not found")
+    data, position = log.snapshot()
+    if tail is not None:
+        data = b"".join(data.splitlines(keepends=True)[-tail:])
+    headers = {"X-Log-Size": str(log.size), "X-Log-Truncated": str(log.dropped)}
+    if follow and not log.done:
+        def lines():
+            yield data
+            yield from invocation_logs.follow(log, position)
+        return StreamingResponse(lines(), media_type="text/plain; charset=utf-8", headers=headers)
+    return PlainTextResponse(data.decode("utf-8", errors="replace"), headers=headers)
+
+@app.get("/logs/stats")
+def get_log_stats():
+    return invocation_logs.stats()
+
+@app.get("/invocations/stats")
+def get_invocation_stats():
+    return invocation_queue.stats()
+
+@app.get("/invocations/dead-letters", response_model=List[schemas.DeadLetter])
+def list_dead_letters(function_id: Optional[int] = None, limit: int = Query(100, ge=1, le=1000),
+                      db: Session = Depends(get_db)):
+    query = db.query(models.DeadLetter)
+    if function_id is not None:
+        query = query.filter(models.DeadLetter.function_id == function_id)
+    return query.order_by(models.DeadLetter.id.desc()).limit(limit).all()
+
+@app.get("/invocations/{invocation_id}", response_model=schemas.Invocation)
+def get_invocation(invocation_id: str):
+    """Status of an async invocation, with its result once finished. Gone after the result TTL."""
+    invocation = invocation_queue.get(invocation_id)
+    if invocation is None:
+        raise HTTPException(status_code=404, detail="Invocation not found")
+    return invocation
+
+@app.get("/hosts")
+def get_hosts():
+    """Worker hosts of the runtime backend, with their state and pooled containers."""
+    return execution_engine.host_stats()
+
+@app.post("/hosts/{host}/drain")
+def drain_host(host: str):
+    """Place nothing new on a host and remove its containers as they go idle, e.g. before maintenance."""
+    return change_host(execution_engine.drain_host, host)
+
+@app.post("/hosts/{host}/resume")
+def resume_host(host: str):
+    return change_host(execution_engine.resume_host, host)
+
+def change_host(change, host: str):
+    try:
+        change(host)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown host {host}")
+    return execution_engine.host_stats()["hosts"][host]
+
+@app.get("/pool/stats")
+def get_pool_stats():
+    return execution_engine.pool_stats()
+
+@app.get("/execution/stats")
+def get_execution_stats():
+    return execution_limiter.stats()
+
+@app.get("/metrics/sink/stats")
+def get_metrics_sink_stats():
+    return metrics_sink.stats()
+
+@app.get("/result-cache/stats")
+def get_result_cache_stats():
+    return result_cache.stats()
+
+@app.get("/function-cache/stats")
+def get_function_cache_stats():
+    return function_cache.stats()
+
+@app.get("/prewarm/stats")
+def get_prewarm_stats():
+    return prewarmer.stats()
+
+@app.get("/resources/stats")
+def get_resource_stats():
+    return resource_sizer.stats()
+
+@app.get("/images/stats")
+def get_image_stats():
+    return execution_engine.image_stats()
+
+@app.get("/routes/stats")
+def get_route_stats():
+    return route_table.stats()
+
+@app.get("/metrics")
+def get_prometheus_metrics():
+    """Prometheus exposition of per-stage latencies, pool occupancy and invocation counters."""
+    # Set as a header: as media_type, Starlette would append a second charset to it
+    return Response(content=telemetry.exposition(), headers={"Content-Type": telemetry.CONTENT_TYPE_LATEST})
+
+# Gateway: serve functions on their own route. Registered last so it never shadows the API above.
+@app.api_route("/{path:path}", methods=["GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"])
+async def invoke_route(path: str, request: Request):
+    """Invoke the function whose route is the longest prefix of ``path``, with the request as its event.
+
+    Any method reaches the function. A HEAD request runs it as a GET and gets
+    the same status and headers without the body. CORS preflight requests from
+    allowed origins are answered by the middleware before they get here.
+    """
+    match = route_table.resolve(path)
+    if match is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    function_id, route = match
+    logger.debug(f"Routing {request.method} /{path} to function {function_id}")
+
+    query = {}
+    for key, value in request.query_params.multi_items():
+        if key in query:
+            query[key] = query[key] + [value] if isinstance(query[key], list) else [query[key], value]
+        else:
+            query[key] = value
+    method = "GET" if request.method == "HEAD" else request.method
+    event = build_http_event(method, path, route, dict(request.headers), query, await request.body())
+
+    result = await run_function_limited(function_id, event)
+    try:
+        status_code, headers, body, raw = parse_http_result(result["result"])
+    except ValueError as e:
+        logger.warning(f"Function {function_id} returned a bad HTTP response: {str(e)}")
+        raise HTTPException(status_code=502, detail=str(e), headers={"X-Trace-Id": result["trace"]["trace_id"]})
+    headers["X-Trace-Id"] = result["trace"]["trace_id"]
+    if result["cached"]:
+        headers["X-Cache"] = "HIT"
+    if raw:
+        response = Response(content=body, status_code=status_code, headers=headers)
+    else:
+        response = JSONResponse(content=body, status_code=status_code, headers=headers)
+    if request.method == "HEAD":
+        # Keeps the Content-Length the GET response would have
+        return Response(status_code=status_code, headers=dict(response.headers))
+    return response
+
 # Setup shutdown handler for container cleanup
-def cleanup_on_shutdown(signum, frame):
-    logger.info("Received shutdown signal, cleaning up all containers...")
-    for function_id in list(execution_engine.container_pool.keys()):
+def shutdown_services():
+    """Stop every background service, continuing past any that fails."""
+    for shutdown in (prewarmer.shutdown, resource_sizer.shutdown, invocation_queue.shutdown,
+                     execution_limiter.shutdown, execution_engine.shutdown, metrics_sink.shutdown,
+                     invocation_logs.shutdown, result_cache.shutdown):
         try:
-            logger.info(f"Cleaning up container for function {function_id}")
-            execution_engine.cleanup(function_id)
+            shutdown()
         except Exception as e:
-            logger.error(f"Error cleaning up container for function {function_id}: {str(e)}")
+            logger.error(f"Error during shutdown: {str(e)}")
+
+
+def cleanup_on_shutdown(signum, frame):
+    logger.info("Received shutdown signal, cleaning up all containers...")
+    shutdown_services()
     logger.info("All containers cleaned up, shutting down")
     sys.exit(0)
 
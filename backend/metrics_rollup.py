@@ -0,0 +1,199 @@
+import os
+import math
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Iterable, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import models
+
+# Granularity of the pre-aggregated rollup rows, in seconds. Query buckets must be multiples of it.
+ROLLUP_SECONDS = int(os.getenv("METRICS_ROLLUP_SECONDS", "60"))
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class Histogram:
+    """Sparse log-scale histogram, mergeable across rollup rows.
+
+    Bucket ``i`` holds values in ``[minimum * growth**i, minimum * growth**(i+1))``,
+    so percentiles read from it are within ``growth - 1`` of the true value.
+    """
+
+    def __init__(self, minimum: float, growth: float = 1.1, counts: Dict[str, int] = None):
+        self.minimum = minimum
+        self.growth = growth
+        self.counts: Dict[str, int] = dict(counts or {})
+
+    def add(self, value: float, count: int = 1):
+        key = str(self._index(value))
+        self.counts[key] = self.counts.get(key, 0) + count
+
+    def merge(self, other: "Histogram"):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+
+    def percentile(self, pct: float) -> float:
+        total = sum(self.counts.values())
+        if not total:
+            return 0.0
+        rank = pct / 100 * total
+        seen = 0
+        for index in sorted(int(key) for key in self.counts):
+            seen += self.counts[str(index)]
+            if seen >= rank:
+                # Geometric middle of the bucket
+                return self.minimum * self.growth ** (index + 0.5) if index >= 0 else 0.0
+        return 0.0
+
+    def _index(self, value: float) -> int:
+        if value is None or value < self.minimum:
+            return -1
+        return int(math.log(value / self.minimum) / math.log(self.growth))
+
+
+def execution_time_histogram(counts=None) -> Histogram:
+    return Histogram(minimum=0.0001, counts=counts)  # seconds
+
+
+def memory_usage_histogram(counts=None) -> Histogram:
+    return Histogram(minimum=0.1, counts=counts)  # MB
+
+
+def bucket_start(timestamp: datetime, bucket_seconds: int = ROLLUP_SECONDS) -> datetime:
+    seconds = int((timestamp - EPOCH).total_seconds())
+    return EPOCH + timedelta(seconds=seconds - seconds % bucket_seconds)
+
+
+class _Aggregate:
+    def __init__(self):
+        self.count = 0
+        self.error_count = 0
+        self.total_execution_time = 0.0
+        self.total_memory_usage = 0.0
+        self.max_execution_time = 0.0
+        self.max_memory_usage = 0.0
+        self.execution_time = execution_time_histogram()
+        self.memory_usage = memory_usage_histogram()
+
+    def add_row(self, row: Dict[str, Any]):
+        execution_time = row.get("execution_time") or 0.0
+        memory_usage = row.get("memory_usage") or 0.0
+        self.count += 1
+        if row.get("status") != "success":
+            self.error_count += 1
+        self.total_execution_time += execution_time
+        self.total_memory_usage += memory_usage
+        self.max_execution_time = max(self.max_execution_time, execution_time)
+        self.max_memory_usage = max(self.max_memory_usage, memory_usage)
+        self.execution_time.add(execution_time)
+        self.memory_usage.add(memory_usage)
+
+    def add_rollup(self, rollup: "models.FunctionMetricsRollup"):
+        self.count += rollup.count
+        self.error_count += rollup.error_count
+        self.total_execution_time += rollup.total_execution_time
+        self.total_memory_usage += rollup.total_memory_usage
+        self.max_execution_time = max(self.max_execution_time, rollup.max_execution_time)
+        self.max_memory_usage = max(self.max_memory_usage, rollup.max_memory_usage)
+        self.execution_time.merge(execution_time_histogram(rollup.execution_time_histogram))
+        self.memory_usage.merge(memory_usage_histogram(rollup.memory_usage_histogram))
+
+
+def update_rollups(db: Session, rows: Iterable[Dict[str, Any]]):
+    """Fold newly written FunctionMetrics rows into their rollup rows.
+
+    Runs in the caller's transaction, so rollups commit together with the raw rows.
+    """
+    aggregates: Dict[Tuple[int, datetime], _Aggregate] = {}
+    for row in rows:
+        key = (row["function_id"], bucket_start(row["timestamp"]))
+        aggregates.setdefault(key, _Aggregate()).add_row(row)
+    if not aggregates:
+        return
+
+    function_ids = {function_id for function_id, _ in aggregates}
+    starts = {start for _, start in aggregates}
+    existing = {
+        (rollup.function_id, rollup.bucket_start): rollup
+        for rollup in db.scalars(
+            select(models.FunctionMetricsRollup)
+            .where(models.FunctionMetricsRollup.function_id.in_(function_ids))
+            .where(models.FunctionMetricsRollup.bucket_start.in_(starts))
+        )
+    }
+
+    for (function_id, start), aggregate in aggregates.items():
+        rollup = existing.get((function_id, start))
+        if rollup is None:
+            rollup = models.FunctionMetricsRollup(
+                function_id=function_id,
+                bucket_start=start,
+                count=0,
+                error_count=0,
+                total_execution_time=0.0,
+                total_memory_usage=0.0,
+                max_execution_time=0.0,
+                max_memory_usage=0.0,
+                execution_time_histogram={},
+                memory_usage_histogram={},
+            )
+            db.add(rollup)
+        execution_time = execution_time_histogram(rollup.execution_time_histogram)
+        execution_time.merge(aggregate.execution_time)
+        memory_usage = memory_usage_histogram(rollup.memory_usage_histogram)
+        memory_usage.merge(aggregate.memory_usage)
+
+        rollup.count += aggregate.count
+        rollup.error_count += aggregate.error_count
+        rollup.total_execution_time += aggregate.total_execution_time
+        rollup.total_memory_usage += aggregate.total_memory_usage
+        rollup.max_execution_time = max(rollup.max_execution_time, aggregate.max_execution_time)
+        rollup.max_memory_usage = max(rollup.max_memory_usage, aggregate.max_memory_usage)
+        # Assign new dicts so the JSON columns are seen as changed
+        rollup.execution_time_histogram = execution_time.counts
+        rollup.memory_usage_histogram = memory_usage.counts
+
+
+def query_buckets(db: Session, function_id: int, start: datetime, end: datetime,
+                  bucket_seconds: int) -> List[Dict[str, Any]]:
+    """Per-bucket counts, error rate and percentiles for a function, read from rollups only."""
+    if bucket_seconds <= 0 or bucket_seconds % ROLLUP_SECONDS:
+        raise ValueError(f"Bucket size must be a positive multiple of {ROLLUP_SECONDS} seconds")
+
+    rollups = db.scalars(
+        select(models.FunctionMetricsRollup)
+        .where(models.FunctionMetricsRollup.function_id == function_id)
+        .where(models.FunctionMetricsRollup.bucket_start >= bucket_start(start))
+        .where(models.FunctionMetricsRollup.bucket_start < end)
+        .order_by(models.FunctionMetricsRollup.bucket_start)
+    )
+    buckets: Dict[datetime, _Aggregate] = {}
+    for rollup in rollups:
+        buckets.setdefault(bucket_start(rollup.bucket_start, bucket_seconds), _Aggregate()).add_rollup(rollup)
+
+    return [
+        {
+            "start": start_time,
+            "end": start_time + timedelta(seconds=bucket_seconds),
+            "count": aggregate.count,
+            "errors": aggregate.error_count,
+            "error_rate": aggregate.error_count / aggregate.count if aggregate.count else 0.0,
+            "execution_time": _summary(aggregate.execution_time, aggregate.total_execution_time,
+                                       aggregate.max_execution_time, aggregate.count),
+            "memory_usage": _summary(aggregate.memory_usage, aggregate.total_memory_usage,
+                                     aggregate.max_memory_usage, aggregate.count),
+        }
+        for start_time, aggregate in sorted(buckets.items())
+    ]
+
+
+def _summary(histogram: Histogram, total: float, maximum: float, count: int) -> Dict[str, float]:
+    return {
+        "avg": total / count if count else 0.0,
+        "p50": min(histogram.percentile(50), maximum),
+        "p95": min(histogram.percentile(95), maximum),
+        "p99": min(histogram.percentile(99), maximum),
+        "max": maximum,
+    }
@@ -0,0 +1,176 @@
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+
+import models
+from metrics_rollup import update_rollups
+
+logger = logging.getLogger(__name__)
+
+METRICS_BATCH_SIZE = int(os.getenv("METRICS_BATCH_SIZE", "500"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL", "1.0"))  # seconds
+METRICS_MAX_BUFFER = int(os.getenv("METRICS_MAX_BUFFER", "50000"))
+
+ERROR_MESSAGE_LENGTH = 255  # size of FunctionMetrics.error_message
+
+
+class MetricsSink:
+    """Buffers FunctionMetrics rows in memory and writes them in bulk from a background thread.
+
+    A flush happens once ``batch_size`` rows are waiting or ``flush_interval``
+    seconds have passed. If the database falls behind and ``max_buffer`` rows
+    are already waiting, new rows are dropped and counted rather than slowing
+    down invocations. Rows from a failed flush are retried on the next one,
+    except when the batch breaks a constraint, e.g. a row of a function that
+    was deleted meanwhile: then rows are written one at a time and those that
+    still fail are dropped, so one bad row cannot hold up all the others.
+    Rollups for the metrics query API are updated in the same transaction.
+    """
+
+    def __init__(self, session_factory, batch_size: int = METRICS_BATCH_SIZE,
+                 flush_interval: float = METRICS_FLUSH_INTERVAL, max_buffer: int = METRICS_MAX_BUFFER):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+
+        self._lock = threading.Condition()
+        self._buffer: List[Dict[str, Any]] = []
+        self._stop = threading.Event()
+        self._thread = None
+
+        self._recorded = 0
+        self._written = 0
+        self._dropped = 0
+        self._flushes = 0
+        self._flush_failures = 0
+        self._last_flush_duration = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="metrics-sink", daemon=True)
+        self._thread.start()
+
+    def record(self, function_id: int, metrics: Optional[Dict[str, Any]],
+               trace: Optional[Dict[str, Any]] = None) -> bool:
+        """Queue one invocation's metrics, and its trace if it has one. Never blocks on the database."""
+        if not metrics:
+            return False
+        error_message = metrics.get("error_message")
+        row = {
+            "function_id": int(function_id),
+            "execution_time": metrics.get("execution_time", 0),
+            "memory_usage": metrics.get("memory_usage", 0),
+            "cpu_usage": metrics.get("cpu_usage", 0),
+            "status": metrics.get("status"),
+            "error_message": error_message[:ERROR_MESSAGE_LENGTH] if error_message else None,
+            "timestamp": datetime.utcnow(),
+            "trace_id": metrics.get("trace_id"),
+            "trace": {"duration": trace["duration"], "spans": trace["spans"]} if trace else None,
+        }
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self._dropped += 1
+                return False
+            self._buffer.append(row)
+            self._recorded += 1
+            if len(self._buffer) >= self.batch_size:
+                self._lock.notify()
+        return True
+
+    def discard(self, function_id: int):
+        """Drop a function's buffered rows, e.g. before it is deleted, so they do not write rollups for it after."""
+        with self._lock:
+            self._buffer = [row for row in self._buffer if row["function_id"] != function_id]
+
+    def flush(self) -> int:
+        """Write everything buffered so far. Returns the number of rows written."""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return 0
+
+        start = time.time()
+        try:
+            self._write(rows)
+        except IntegrityError as e:
+            logger.warning(f"Batch of {len(rows)} metrics rows was rejected, writing them one by one: {str(e)}")
+            rows = self._write_each(rows)
+        except Exception as e:
+            logger.error(f"Failed to write {len(rows)} metrics rows: {str(e)}")
+            with self._lock:
+                self._flush_failures += 1
+                # Put the rows back in front, keeping within the buffer limit
+                keep = max(0, self.max_buffer - len(self._buffer))
+                self._dropped += len(rows) - min(len(rows), keep)
+                self._buffer = rows[:keep] + self._buffer
+            return 0
+
+        with self._lock:
+            self._written += len(rows)
+            self._flushes += 1
+            self._last_flush_duration = time.time() - start
+        return len(rows)
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        with self.session_factory() as db:
+            db.execute(insert(models.FunctionMetrics), rows)
+            update_rollups(db, rows)
+            db.commit()
+
+    def _write_each(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Write rows separately, dropping those that fail. Returns the rows written."""
+        written = []
+        for index, row in enumerate(rows):
+            try:
+                self._write([row])
+                written.append(row)
+            except IntegrityError as e:
+                logger.error(f"Dropped metrics row of function {row['function_id']}: {str(e)}")
+                with self._lock:
+                    self._dropped += 1
+            except Exception as e:
+                logger.error(f"Failed to write {len(rows) - index} metrics rows: {str(e)}")
+                with self._lock:
+                    self._flush_failures += 1
+                    self._buffer = rows[index:] + self._buffer
+                break
+        return written
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                if len(self._buffer) < self.batch_size:
+                    self._lock.wait(self.flush_interval)
+            failures = self._flush_failures
+            self.flush()
+            if self._flush_failures > failures:
+                # Back off instead of hammering a database that is struggling
+                self._stop.wait(self.flush_interval)
+
+    def shutdown(self):
+        """Stop the background thread and write whatever is still buffered."""
+        self._stop.set()
+        with self._lock:
+            self._lock.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        written = self.flush()
+        logger.info(f"Metrics sink shut down, flushed {written} remaining rows")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "buffered": len(self._buffer),
+                "recorded": self._recorded,
+                "written": self._written,
+                "dropped": self._dropped,
+                "flushes": self._flushes,
+                "flush_failures": self._flush_failures,
+                "last_flush_duration": self._last_flush_duration,
+            }
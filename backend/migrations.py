@@ -0,0 +1,50 @@
+import logging
+from typing import List
+
+from sqlalchemy import inspect, literal, text
+
+from models import Base
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade_schema(engine) -> List[str]:
+    """Bring the database up to the models: create missing tables, then add missing columns and indexes.
+
+    ``create_all`` never alters a table that already exists, so columns added
+    to a model since a deployment was set up, e.g. ``functions.dependencies``
+    or ``function_metrics.trace_id``, are added here with ``ALTER TABLE``.
+    Nothing is ever dropped or changed. Returns the statements run.
+    """
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    preparer = engine.dialect.identifier_preparer
+    statements = []
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                statement = (f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {preparer.format_column(column)} "
+                             f"{column.type.compile(dialect=engine.dialect)}{_default_clause(column, engine.dialect)}")
+                connection.execute(text(statement))
+                statements.append(statement)
+
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(bind=connection)
+                    statements.append(f"CREATE INDEX {index.name}")
+    for statement in statements:
+        logger.info(f"Schema upgrade: {statement}")
+    return statements
+
+
+def _default_clause(column, dialect) -> str:
+    # Existing rows get a plain scalar default, e.g. cacheable = false; anything else is left NULL
+    default = column.default
+    if default is None or not default.is_scalar or not isinstance(default.arg, (bool, int, float, str)):
+        return ""
+    value = literal(default.arg, column.type).compile(dialect=dialect, compile_kwargs={"literal_binds": True})
+    return f" DEFAULT {value}"
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, JSON, Text
+from sqlalchemy import (Column, Integer, String, Float, Boolean, DateTime, ForeignKey, JSON, Text, LargeBinary, Index,
+                        UniqueConstraint)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -17,6 +18,11 @@ class Function(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     environment_variables = Column(JSON, default={})
+    dependencies = Column(Text, nullable=True)  # requirements.txt or package.json
+    cacheable = Column(Boolean, default=False)  # results are memoized by input, see result_cache
+    cache_ttl = Column(Integer, nullable=True)  # in seconds; RESULT_CACHE_TTL when not set
+    memory_limit = Column(Integer, nullable=True)  # in MB; derived from metrics history when not set
+    cpu_limit = Column(Float, nullable=True)       # in cores; derived from metrics history when not set
     metrics = relationship("FunctionMetrics", back_populates="function")
 
 class FunctionMetrics(Base):
@@ -30,4 +36,85 @@ class FunctionMetrics(Base):
     status = Column(String(50))     # success/failure
     error_message = Column(String(255), nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
-    function = relationship("Function", back_populates="metrics") 
\ No newline at end of file
+    trace_id = Column(String(32), nullable=True, index=True)
+    trace = Column(JSON, nullable=True)  # duration and span tree of the invocation, see tracing.Trace
+    function = relationship("Function", back_populates="metrics")
+
+    __table_args__ = (
+        Index("ix_function_metrics_function_id_timestamp", "function_id", "timestamp"),
+    )
+
+class FunctionMetricsRollup(Base):
+    """Per-minute aggregate of FunctionMetrics, maintained as rows are written."""
+    __tablename__ = "function_metrics_rollup"
+
+    id = Column(Integer, primary_key=True, index=True)
+    function_id = Column(Integer, ForeignKey("functions.id"))
+    bucket_start = Column(DateTime)
+    count = Column(Integer, default=0)
+    error_count = Column(Integer, default=0)
+    total_execution_time = Column(Float, default=0.0)  # in seconds
+    total_memory_usage = Column(Float, default=0.0)    # in MB
+    max_execution_time = Column(Float, default=0.0)
+    max_memory_usage = Column(Float, default=0.0)
+    execution_time_histogram = Column(JSON, default={})  # log-scale bucket index -> count
+    memory_usage_histogram = Column(JSON, default={})
+
+    __table_args__ = (
+        UniqueConstraint("function_id", "bucket_start", name="uq_function_metrics_rollup_bucket"),
+    ) 
+
+class Invocation(Base):
+    """An asynchronous invocation. The table doubles as the job queue and the result store."""
+    __tablename__ = "invocations"
+
+    id = Column(String(36), primary_key=True)
+    function_id = Column(Integer, ForeignKey("functions.id"))
+    status = Column(String(20), default="queued")  # queued/running/succeeded/failed
+    input = Column(JSON)
+    result = Column(JSON, nullable=True)
+    metrics = Column(JSON, nullable=True)
+    error_message = Column(Text, nullable=True)
+    callback_url = Column(String(2048), nullable=True)
+    callback_status = Column(String(20), nullable=True)  # delivered/failed
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=1)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_invocations_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("ix_invocations_expires_at", "expires_at"),
+    )
+
+class DeadLetter(Base):
+    """An asynchronous invocation that failed on every attempt."""
+    __tablename__ = "invocation_dead_letters"
+
+    id = Column(Integer, primary_key=True, index=True)
+    invocation_id = Column(String(36), index=True)
+    function_id = Column(Integer, ForeignKey("functions.id"))
+    input = Column(JSON)
+    error_message = Column(Text, nullable=True)
+    attempts = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class InvocationLog(Base):
+    """What one invocation printed, capped and zlib-compressed; see invocation_logs."""
+    __tablename__ = "invocation_logs"
+
+    id = Column(String(36), primary_key=True)  # trace id of a synchronous call, or the async invocation id
+    function_id = Column(Integer, ForeignKey("functions.id"))
+    created_at = Column(DateTime, default=datetime.utcnow)
+    size = Column(Integer)       # bytes printed, including any dropped
+    dropped = Column(Integer)    # bytes cut from the middle to stay within LOG_MAX_BYTES
+    data = Column(LargeBinary(length=16 * 1024 * 1024))
+
+    __table_args__ = (
+        Index("ix_invocation_logs_function_id_created_at", "function_id", "created_at"),
+        Index("ix_invocation_logs_created_at", "created_at"),
+    )
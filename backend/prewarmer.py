@@ -0,0 +1,193 @@
+import os
+import math
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Callable, Optional
+
+from sqlalchemy import select, and_, or_
+
+import models
+
+logger = logging.getLogger(__name__)
+
+PREWARM_INTERVAL = float(os.getenv("PREWARM_INTERVAL", "60"))       # seconds between planning passes
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "20"))               # functions kept warm at most
+PREWARM_HORIZON = float(os.getenv("PREWARM_HORIZON", "300"))        # seconds of demand to be ready for
+PREWARM_RECENT_WINDOW = float(os.getenv("PREWARM_RECENT_WINDOW", "900"))  # seconds, for the current rate
+PREWARM_LOOKBACK_DAYS = int(os.getenv("PREWARM_LOOKBACK_DAYS", "7"))  # same time of day on previous days
+PREWARM_HEADROOM = float(os.getenv("PREWARM_HEADROOM", "1.5"))      # extra capacity over the forecast
+PREWARM_MAX_REPLICAS = int(os.getenv("PREWARM_MAX_REPLICAS", "4"))  # per function
+# On startup, functions called within this many seconds get their warm container back even without a forecast
+PREWARM_RESTORE_WINDOW = float(os.getenv("PREWARM_RESTORE_WINDOW", str(24 * 3600)))
+
+
+class Forecast:
+    """Expected demand for one function over the next horizon."""
+
+    def __init__(self, function_id: int, rate: float, recent_rate: float, seasonal_rate: float,
+                 avg_execution_time: float, replicas: int):
+        self.function_id = function_id
+        self.rate = rate                  # invocations per second
+        self.recent_rate = recent_rate
+        self.seasonal_rate = seasonal_rate
+        self.avg_execution_time = avg_execution_time
+        self.replicas = replicas
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "rate": self.rate,
+            "recent_rate": self.recent_rate,
+            "seasonal_rate": self.seasonal_rate,
+            "avg_execution_time": self.avg_execution_time,
+            "replicas": self.replicas,
+        }
+
+
+class Prewarmer:
+    """Keeps warm containers ahead of the demand predicted from invocation history.
+
+    Every ``interval`` seconds the per-minute metrics rollups are read for two
+    signals: the call rate over the last ``recent_window`` seconds, and the rate
+    seen in the coming ``horizon`` at the same time of day on each of the last
+    ``lookback_days`` days, which covers daily peaks before they start. The
+    higher of the two, times the average execution time, gives the expected
+    concurrency (Little's law). The ``top_n`` busiest functions are scaled to
+    that many replicas plus headroom, with their code loaded, and held there
+    for the horizon. The first pass runs on startup and also restores one warm
+    replica for recently used functions.
+    """
+
+    def __init__(self, session_factory, engine, lookup: Callable[[int], Any],
+                 interval: float = PREWARM_INTERVAL, top_n: int = PREWARM_TOP_N,
+                 horizon: float = PREWARM_HORIZON, lookback_days: int = PREWARM_LOOKBACK_DAYS):
+        self.session_factory = session_factory
+        self.engine = engine
+        self.lookup = lookup
+        self.interval = interval
+        self.top_n = top_n
+        self.horizon = horizon
+        self.lookback_days = lookback_days
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._forecasts: Dict[int, Forecast] = {}
+        self._runs = 0
+        self._added = 0
+        self._failures = 0
+        self._last_run: Optional[datetime] = None
+        self._last_duration = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="prewarmer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        startup = True
+        while not self._stop.is_set():
+            try:
+                self.run_once(startup=startup)
+            except Exception as e:
+                logger.error(f"Pre-warming pass failed: {str(e)}")
+            startup = False
+            self._stop.wait(self.interval)
+
+    def run_once(self, startup: bool = False, now: Optional[datetime] = None) -> List[Forecast]:
+        """Forecast demand and warm containers for it. Returns the forecasts acted on."""
+        start = time.time()
+        forecasts = self.forecast(now or datetime.utcnow(), startup=startup)
+        added = 0
+        for forecast in forecasts:
+            # One function that cannot be warmed, e.g. its image failed to build, must not hold up the rest
+            try:
+                function = self.lookup(forecast.function_id)
+                if function is None:
+                    continue
+                added += self.engine.prewarm(
+                    str(forecast.function_id),
+                    function.code,
+                    function.language,
+                    forecast.replicas,
+                    dependencies=function.dependencies,
+                    hold=self.horizon + self.interval,
+                )
+            except Exception as e:
+                logger.error(f"Failed to pre-warm function {forecast.function_id}: {str(e)}")
+                self._failures += 1
+        if added:
+            logger.info(f"Pre-warmed {added} containers for {len(forecasts)} functions")
+        self._forecasts = {forecast.function_id: forecast for forecast in forecasts}
+        self._runs += 1
+        self._added += added
+        self._last_run = datetime.utcnow()
+        self._last_duration = time.time() - start
+        return forecasts
+
+    def forecast(self, now: datetime, startup: bool = False) -> List[Forecast]:
+        recent_start = now - timedelta(seconds=PREWARM_RECENT_WINDOW)
+        seasonal_windows = [
+            (now - timedelta(days=day), now - timedelta(days=day) + timedelta(seconds=self.horizon))
+            for day in range(1, self.lookback_days + 1)
+        ]
+        windows = [(recent_start, now)] + seasonal_windows
+        if startup:
+            windows.append((now - timedelta(seconds=PREWARM_RESTORE_WINDOW), now))
+
+        recent: Dict[int, int] = {}
+        seasonal: Dict[int, int] = {}
+        restore: Dict[int, int] = {}
+        calls: Dict[int, int] = {}
+        execution_time: Dict[int, float] = {}
+        rollup = models.FunctionMetricsRollup
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(rollup.function_id, rollup.bucket_start, rollup.count, rollup.total_execution_time)
+                .where(or_(*[and_(rollup.bucket_start >= low, rollup.bucket_start < high) for low, high in windows]))
+            ).all()
+        for function_id, bucket, count, total_execution_time in rows:
+            if recent_start <= bucket < now:
+                recent[function_id] = recent.get(function_id, 0) + count
+            if any(low <= bucket < high for low, high in seasonal_windows):
+                seasonal[function_id] = seasonal.get(function_id, 0) + count
+            restore[function_id] = restore.get(function_id, 0) + count
+            calls[function_id] = calls.get(function_id, 0) + count
+            execution_time[function_id] = execution_time.get(function_id, 0.0) + (total_execution_time or 0.0)
+
+        forecasts = []
+        for function_id in calls:
+            recent_rate = recent.get(function_id, 0) / PREWARM_RECENT_WINDOW
+            seasonal_rate = seasonal.get(function_id, 0) / (self.lookback_days * self.horizon)
+            rate = max(recent_rate, seasonal_rate)
+            avg_execution_time = execution_time[function_id] / calls[function_id] if calls[function_id] else 0.0
+            if rate * self.horizon >= 1:
+                concurrency = rate * max(avg_execution_time, 0.001)
+                replicas = min(PREWARM_MAX_REPLICAS, max(1, math.ceil(concurrency * PREWARM_HEADROOM)))
+            elif startup and restore.get(function_id):
+                replicas = 1
+            else:
+                continue
+            forecasts.append(Forecast(function_id, rate, recent_rate, seasonal_rate, avg_execution_time, replicas))
+
+        # Busiest first; on startup, functions with only restore history rank by how often they were called
+        forecasts.sort(key=lambda f: (f.rate, restore.get(f.function_id, 0)), reverse=True)
+        return forecasts[:self.top_n]
+
+    def stats(self) -> Dict[str, Any]:
+        pool = self.engine.pool_stats()
+        return {
+            "runs": self._runs,
+            "last_run": self._last_run.isoformat() if self._last_run else None,
+            "last_duration": self._last_duration,
+            "containers_added": self._added,
+            "failures": self._failures,
+            "warm_hit_ratio": pool["hit_ratio"],
+            "prewarmed": pool["prewarmed"],
+            "prewarm_hits": pool["prewarm_hits"],
+            "functions": {function_id: forecast.as_dict() for function_id, forecast in self._forecasts.items()},
+        }
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
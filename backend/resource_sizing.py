@@ -0,0 +1,285 @@
+import os
+import math
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, Tuple
+
+from sqlalchemy import select
+
+import models
+from runtime_backends import ResourceLimits
+
+logger = logging.getLogger(__name__)
+
+SIZING_INTERVAL = float(os.getenv("SIZING_INTERVAL", "300"))              # seconds between sizing passes
+SIZING_WINDOW = float(os.getenv("SIZING_WINDOW", str(24 * 3600)))         # seconds of history to size from
+SIZING_MIN_SAMPLES = int(os.getenv("SIZING_MIN_SAMPLES", "20"))           # calls needed before sizing a function
+SIZING_MAX_ROWS = int(os.getenv("SIZING_MAX_ROWS", "100000"))             # most recent calls read for memory and CPU usage
+# Memory: this percentile of peak usage, times the headroom, rounded up to the step and clamped (MB)
+SIZING_MEMORY_PERCENTILE = float(os.getenv("SIZING_MEMORY_PERCENTILE", "99"))
+SIZING_MEMORY_HEADROOM = float(os.getenv("SIZING_MEMORY_HEADROOM", "1.5"))
+SIZING_MEMORY_STEP = int(os.getenv("SIZING_MEMORY_STEP", "32"))
+SIZING_MEMORY_MIN = int(os.getenv("SIZING_MEMORY_MIN", "64"))
+SIZING_MEMORY_MAX = int(os.getenv("SIZING_MEMORY_MAX", "4096"))
+# CPU: this percentile of usage, in cores, times the headroom, rounded up to the step and clamped
+SIZING_CPU_PERCENTILE = float(os.getenv("SIZING_CPU_PERCENTILE", "95"))
+SIZING_CPU_HEADROOM = float(os.getenv("SIZING_CPU_HEADROOM", "1.25"))
+SIZING_CPU_STEP = float(os.getenv("SIZING_CPU_STEP", "0.1"))
+SIZING_CPU_MIN = float(os.getenv("SIZING_CPU_MIN", "0.1"))
+SIZING_CPU_MAX = float(os.getenv("SIZING_CPU_MAX", "2.0"))
+# Derived limits only change once they are this far (relative) from the current ones, so containers are not
+# resized back and forth on small swings
+SIZING_HYSTERESIS = float(os.getenv("SIZING_HYSTERESIS", "0.2"))
+
+MB = 1024 * 1024
+
+
+class Profile:
+    """Resource usage of one function over the sizing window, and the limits derived from it."""
+
+    def __init__(self, function_id: int, samples: int, memory_peak: float, memory_max: float, cpu: float):
+        self.function_id = function_id
+        self.samples = samples
+        self.memory_peak = memory_peak  # MB, at SIZING_MEMORY_PERCENTILE
+        self.memory_max = memory_max    # MB
+        self.cpu = cpu                  # cores, at SIZING_CPU_PERCENTILE
+
+    def limits(self) -> Tuple[int, float]:
+        """Memory in MB and CPU in cores."""
+        memory = _round_up(self.memory_peak * SIZING_MEMORY_HEADROOM, SIZING_MEMORY_STEP)
+        cpu = _round_up(self.cpu * SIZING_CPU_HEADROOM, SIZING_CPU_STEP)
+        return (int(min(max(memory, SIZING_MEMORY_MIN), SIZING_MEMORY_MAX)),
+                round(min(max(cpu, SIZING_CPU_MIN), SIZING_CPU_MAX), 3))
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "samples": self.samples,
+            "memory_peak": self.memory_peak,
+            "memory_max": self.memory_max,
+            "cpu": self.cpu,
+        }
+
+
+class Sizing:
+    """The limits a function's containers run with, and where each came from."""
+
+    def __init__(self, limits: ResourceLimits, memory_source: str, cpu_source: str,
+                 profile: Optional[Profile] = None):
+        self.limits = limits
+        self.memory_source = memory_source  # "explicit", "derived" or "default"
+        self.cpu_source = cpu_source
+        self.profile = profile
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            **self.limits.as_dict(),
+            "memory_source": self.memory_source,
+            "cpu_source": self.cpu_source,
+            "profile": self.profile.as_dict() if self.profile is not None else None,
+        }
+
+
+class ResourceSizer:
+    """Sets each function's container limits, from its own settings or its metrics history.
+
+    A function's ``memory_limit`` (MB) and ``cpu_limit`` (cores) are used as
+    given. Where one is not set, it is derived every ``interval`` seconds from
+    the function's last ``window`` seconds of calls, once there are at least
+    ``min_samples`` successful ones, counted from the per-minute rollups: a
+    high percentile of peak memory and of CPU usage of the successful calls,
+    read from the raw metrics, each with headroom on top. Anything else runs with the backend's defaults. Small functions then
+    take less of the pool's and the hosts' memory, and busy ones get more than
+    the default CPU share. Changed limits are handed to the engine, which
+    resizes or recreates the function's containers as they are next used.
+    """
+
+    def __init__(self, session_factory, engine, interval: float = SIZING_INTERVAL, window: float = SIZING_WINDOW,
+                 min_samples: int = SIZING_MIN_SAMPLES):
+        self.session_factory = session_factory
+        self.engine = engine
+        self.interval = interval
+        self.window = window
+        self.min_samples = min_samples
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._explicit: Dict[int, Tuple[Optional[int], Optional[float]]] = {}
+        self._profiles: Dict[int, Profile] = {}
+        self._sizings: Dict[int, Sizing] = {}
+        self._runs = 0
+        self._changes = 0
+        self._last_run: Optional[datetime] = None
+        self._last_duration = 0.0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="resource-sizer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Resource sizing pass failed: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def run_once(self, now: Optional[datetime] = None) -> Dict[int, Sizing]:
+        """Profile every function and apply the limits that changed. Returns the sizing of each."""
+        start = time.time()
+        now = now or datetime.utcnow()
+        with self.session_factory() as db:
+            explicit = {
+                function_id: (memory_limit, cpu_limit)
+                for function_id, memory_limit, cpu_limit in db.execute(
+                    select(models.Function.id, models.Function.memory_limit, models.Function.cpu_limit))
+            }
+            profiles = self.profile(db, now - timedelta(seconds=self.window), now)
+        with self._lock:
+            self._explicit = explicit
+            self._profiles = profiles
+            for function_id in set(self._sizings) - set(explicit):
+                self._apply(function_id, None)
+            for function_id in explicit:
+                self._apply(function_id, self._size(function_id))
+            self._runs += 1
+            self._last_run = datetime.utcnow()
+            self._last_duration = time.time() - start
+            return dict(self._sizings)
+
+    def profile(self, db, start: datetime, end: datetime) -> Dict[int, Profile]:
+        """Usage profiles of the functions with enough calls between ``start`` and ``end``."""
+        rollup = models.FunctionMetricsRollup
+        samples: Dict[int, int] = {}
+        rows = db.execute(
+            select(rollup.function_id, rollup.count, rollup.error_count)
+            .where(rollup.bucket_start >= start)
+            .where(rollup.bucket_start < end)
+        )
+        for function_id, count, error_count in rows:
+            samples[function_id] = samples.get(function_id, 0) + (count or 0) - (error_count or 0)
+        sized = {function_id for function_id, count in samples.items() if count >= self.min_samples}
+        if not sized:
+            return {}
+
+        # Failed calls, e.g. killed when out of memory, report no usage and would pull the limits down
+        metrics = models.FunctionMetrics
+        memory: Dict[int, list] = {}
+        cpu: Dict[int, list] = {}
+        rows = db.execute(
+            select(metrics.function_id, metrics.memory_usage, metrics.cpu_usage)
+            .where(metrics.timestamp >= start)
+            .where(metrics.timestamp < end)
+            .where(metrics.status == "success")
+            .where(metrics.function_id.in_(sized))
+            .order_by(metrics.timestamp.desc())
+            .limit(SIZING_MAX_ROWS)
+        )
+        for function_id, memory_usage, cpu_usage in rows:
+            memory.setdefault(function_id, []).append(memory_usage or 0.0)
+            cpu.setdefault(function_id, []).append((cpu_usage or 0.0) / 100)
+
+        return {
+            function_id: Profile(
+                function_id,
+                samples[function_id],
+                _percentile(sorted(memory[function_id]), SIZING_MEMORY_PERCENTILE),
+                max(memory[function_id]),
+                _percentile(sorted(cpu[function_id]), SIZING_CPU_PERCENTILE),
+            )
+            for function_id in sized if function_id in memory
+        }
+
+    def refresh(self, function_id: int, memory_limit: Optional[int], cpu_limit: Optional[float]):
+        """Apply a function's explicit limits straight away, e.g. after it was created or updated."""
+        with self._lock:
+            self._explicit[function_id] = (memory_limit, cpu_limit)
+            self._apply(function_id, self._size(function_id))
+
+    def forget(self, function_id: int):
+        with self._lock:
+            self._explicit.pop(function_id, None)
+            self._profiles.pop(function_id, None)
+            self._apply(function_id, None)
+
+    def _size(self, function_id: int) -> Optional[Sizing]:
+        # Called with the lock held
+        memory_limit, cpu_limit = self._explicit.get(function_id, (None, None))
+        profile = self._profiles.get(function_id)
+        derived_memory, derived_cpu = profile.limits() if profile is not None else (None, None)
+        current = self._sizings.get(function_id)
+        default = self.engine.backend.default_limits
+
+        if memory_limit:
+            memory, memory_source = memory_limit * MB, "explicit"
+        elif derived_memory is not None:
+            memory, memory_source = derived_memory * MB, "derived"
+            if current is not None and current.memory_source == "derived" \
+                    and not _moved(current.limits.memory, memory):
+                memory = current.limits.memory
+        else:
+            memory, memory_source = default.memory, "default"
+
+        if cpu_limit:
+            cpu, cpu_source = cpu_limit, "explicit"
+        elif derived_cpu is not None:
+            cpu, cpu_source = derived_cpu, "derived"
+            if current is not None and current.cpu_source == "derived" and not _moved(current.limits.cpu, cpu):
+                cpu = current.limits.cpu
+        else:
+            cpu, cpu_source = default.cpu, "default"
+
+        if memory_source == cpu_source == "default":
+            return None
+        return Sizing(ResourceLimits(memory, cpu), memory_source, cpu_source, profile)
+
+    def _apply(self, function_id: int, sizing: Optional[Sizing]):
+        # Called with the lock held
+        current = self._sizings.get(function_id)
+        if sizing is None:
+            if current is None:
+                return
+            del self._sizings[function_id]
+            self.engine.set_limits(str(function_id), None)
+            logger.info(f"Function {function_id} runs with the default limits again")
+        else:
+            self._sizings[function_id] = sizing
+            if current is not None and current.limits == sizing.limits:
+                return
+            self.engine.set_limits(str(function_id), sizing.limits)
+            logger.info(f"Function {function_id} now runs with {sizing.limits.memory // MB} MB "
+                        f"({sizing.memory_source}) and {sizing.limits.cpu:g} CPUs ({sizing.cpu_source})")
+        self._changes += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "runs": self._runs,
+                "last_run": self._last_run.isoformat() if self._last_run else None,
+                "last_duration": self._last_duration,
+                "changes": self._changes,
+                "default": self.engine.backend.default_limits.as_dict(),
+                "functions": {function_id: sizing.as_dict() for function_id, sizing in self._sizings.items()},
+            }
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def _round_up(value: float, step: float) -> float:
+    return math.ceil(value / step - 1e-9) * step
+
+
+def _moved(current: float, derived: float) -> bool:
+    return abs(derived - current) > SIZING_HYSTERESIS * current
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(math.ceil(pct / 100 * len(sorted_values))) - 1)
+    return sorted_values[max(0, index)]
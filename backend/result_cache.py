@@ -0,0 +1,236 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from deployment_cache import code_hash
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "4096"))                            # entries in memory
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))   # all entries in memory
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(1024 * 1024)))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "300"))  # seconds, for functions without a cache_ttl
+# SQLite file for a second, larger tier that survives restarts; off unless set
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", "")
+RESULT_CACHE_DISK_SIZE = int(os.getenv("RESULT_CACHE_DISK_SIZE", "100000"))                # entries on disk
+
+
+def result_key(function_id: int, language: str, code: str, dependencies: Optional[str], input_data: Any) -> str:
+    """Identifies one call: the function's code version and its input, canonicalized."""
+    digest = hashlib.sha256()
+    digest.update(str(function_id).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(code_hash(language, code).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update((dependencies or "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(json.dumps(input_data, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _Entry:
+    def __init__(self, function_id: int, payload: str, expires_at: float):
+        self.function_id = function_id
+        self.payload = payload  # JSON of {"result", "metrics"}
+        self.expires_at = expires_at
+
+
+class _DiskTier:
+    """Entries in a SQLite file, evicting the least recently used past ``max_size``."""
+
+    def __init__(self, path: str, max_size: int):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY, function_id INTEGER, payload TEXT, expires_at REAL, accessed_at REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_results_function_id ON results (function_id)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_results_accessed_at ON results (accessed_at)")
+        (self._size,) = self._db.execute("SELECT COUNT(*) FROM results").fetchone()
+
+    def get(self, key: str, now: float) -> Optional[_Entry]:
+        with self._lock:
+            row = self._db.execute("SELECT function_id, payload, expires_at FROM results WHERE key = ?",
+                                   (key,)).fetchone()
+            if row is None:
+                return None
+            if row[2] <= now:
+                self._size -= self._db.execute("DELETE FROM results WHERE key = ?", (key,)).rowcount
+                return None
+            self._db.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            return _Entry(row[0], row[1], row[2])
+
+    def put(self, key: str, entry: _Entry, now: float) -> int:
+        """Store the entry; returns how many others were evicted to make room."""
+        with self._lock:
+            replaced = self._db.execute("DELETE FROM results WHERE key = ?", (key,)).rowcount
+            self._db.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?)",
+                             (key, entry.function_id, entry.payload, entry.expires_at, now))
+            self._size += 1 - replaced
+            evicted = 0
+            if self._size > self.max_size:
+                # Expired entries go first, then the least recently used
+                evicted = self._db.execute("DELETE FROM results WHERE expires_at <= ?", (now,)).rowcount
+                excess = self._size - evicted - self.max_size
+                if excess > 0:
+                    evicted += self._db.execute(
+                        "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)",
+                        (excess,)).rowcount
+                self._size -= evicted
+            return evicted
+
+    def invalidate(self, function_id: int):
+        with self._lock:
+            self._size -= self._db.execute("DELETE FROM results WHERE function_id = ?", (function_id,)).rowcount
+
+    def size(self) -> int:
+        return self._size
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ResultCache:
+    """Memoized results of functions marked ``cacheable``, so repeated calls skip the sandbox.
+
+    Results are keyed on the function's code version and canonical input, so
+    an entry can only ever be served for the code that produced it; updating a
+    function also drops its entries straight away. Memory holds the most
+    recently used entries, bounded by count and total size, in front of an
+    optional SQLite tier (``RESULT_CACHE_PATH``) for a larger working set.
+    Only successful results are cached.
+    """
+
+    def __init__(self, max_size: int = RESULT_CACHE_SIZE, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = RESULT_CACHE_MAX_ENTRY_BYTES, path: str = RESULT_CACHE_PATH,
+                 disk_size: int = RESULT_CACHE_DISK_SIZE):
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._disk: Optional[_DiskTier] = None
+        if path:
+            try:
+                self._disk = _DiskTier(path, disk_size)
+                logger.info(f"Result cache disk tier at {path} holds {self._disk.size()} entries")
+            except sqlite3.Error as e:
+                logger.error(f"Could not open result cache at {path}, caching in memory only: {str(e)}")
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._invalidations = 0
+        self._too_large = 0
+
+    def get(self, key: str) -> Optional[Tuple[Any, Dict[str, Any]]]:
+        """The cached ``(result, metrics)`` for ``key``, or None."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                self._remove(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._decode(entry)
+
+        entry = self._disk.get(key, now) if self._disk is not None else None
+        with self._lock:
+            if entry is None:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._disk_hits += 1
+            self._insert(key, entry)
+        return self._decode(entry)
+
+    def put(self, key: str, function_id: int, result: Any, metrics: Dict[str, Any], ttl: Optional[float] = None):
+        payload = json.dumps({"result": result, "metrics": metrics})
+        if len(payload) > self.max_entry_bytes:
+            with self._lock:
+                self._too_large += 1
+            return
+        now = time.time()
+        entry = _Entry(function_id, payload, now + (ttl or RESULT_CACHE_TTL))
+        with self._lock:
+            self._insert(key, entry)
+            self._stores += 1
+        if self._disk is not None:
+            try:
+                evicted = self._disk.put(key, entry, now)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not write result cache entry to disk: {str(e)}")
+                return
+            with self._lock:
+                self._evictions += evicted
+
+    def invalidate(self, function_id: int):
+        """Drop every cached result of the function, e.g. when its code changes."""
+        with self._lock:
+            for key in [key for key, entry in self._entries.items() if entry.function_id == function_id]:
+                self._remove(key)
+            self._invalidations += 1
+        if self._disk is not None:
+            try:
+                self._disk.invalidate(function_id)
+            except sqlite3.Error as e:
+                logger.error(f"Could not invalidate cached results of function {function_id} on disk: {str(e)}")
+
+    def _insert(self, key: str, entry: _Entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._bytes += len(entry.payload)
+        while len(self._entries) > self.max_size or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.payload)
+            # Still on disk when there is a disk tier, so only count it as gone without one
+            if self._disk is None:
+                self._evictions += 1
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.payload)
+
+    @staticmethod
+    def _decode(entry: _Entry) -> Tuple[Any, Dict[str, Any]]:
+        cached = json.loads(entry.payload)
+        return cached["result"], cached["metrics"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "max_size": self.max_size,
+                "max_bytes": self.max_bytes,
+                "disk_size": self._disk.size() if self._disk is not None else None,
+                "hits": self._hits,
+                "disk_hits": self._disk_hits,
+                "misses": self._misses,
+                "hit_ratio": self._hits / lookups if lookups else 0.0,
+                "stores": self._stores,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "too_large": self._too_large,
+            }
+
+    def shutdown(self):
+        if self._disk is not None:
+            self._disk.close()
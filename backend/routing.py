@@ -0,0 +1,103 @@
+import base64
+import logging
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+import models
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_route(route: Optional[str]) -> str:
+    """Routes are matched without leading/trailing slashes: "/api/hello/" -> "api/hello"."""
+    return (route or "").strip().strip("/")
+
+
+class RouteTable:
+    """In-memory map from Function.route to function id for the gateway endpoint.
+
+    The table is loaded on first use and rebuilt whenever a function is
+    created, updated or deleted, so resolving a request never touches the
+    database. A request path is matched against the longest route that is a
+    prefix of it on segment boundaries, so a function on "/users" also serves
+    "/users/42".
+    """
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self._lock = threading.Lock()
+        self._routes: Optional[Dict[str, int]] = None
+
+    def rebuild(self):
+        with self.session_factory() as db:
+            rows = db.query(models.Function.id, models.Function.route).all()
+        routes = {normalize_route(route): function_id for function_id, route in rows if normalize_route(route)}
+        # Swap in a new dict so lookups never see a half-built table
+        self._routes = routes
+        logger.info(f"Route table rebuilt with {len(routes)} routes")
+
+    def resolve(self, path: str) -> Optional[Tuple[int, str]]:
+        """Return the function id and matched route for a request path, if any."""
+        routes = self._routes
+        if routes is None:
+            with self._lock:
+                if self._routes is None:
+                    self.rebuild()
+            routes = self._routes
+
+        segments = normalize_route(path).split("/")
+        for end in range(len(segments), 0, -1):
+            route = "/".join(segments[:end])
+            function_id = routes.get(route)
+            if function_id is not None:
+                return function_id, route
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        routes = self._routes or {}
+        return {"loaded": self._routes is not None, "routes": len(routes)}
+
+
+def build_http_event(method: str, path: str, route: str, headers: Dict[str, str],
+                     query: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    """The input a function receives when invoked through its route."""
+    try:
+        text, encoded = body.decode("utf-8"), False
+    except UnicodeDecodeError:
+        text, encoded = base64.b64encode(body).decode("ascii"), True
+    return {
+        "method": method,
+        "path": "/" + normalize_route(path),
+        "route": "/" + route,
+        "headers": headers,
+        "query": query,
+        "body": text,
+        "is_base64_encoded": encoded,
+    }
+
+
+def parse_http_result(result: Any) -> Tuple[int, Dict[str, str], Any, bool]:
+    """Interpret a function's return value as an HTTP response.
+
+    A dict with a ``status_code`` key is taken as a response of the form
+    ``{"status_code": 201, "headers": {...}, "body": ..., "is_base64_encoded": False}``.
+    Anything else is sent back as a 200 JSON body. Returns status, headers,
+    body and whether the body is raw (str/bytes) rather than JSON. Raises
+    ``ValueError`` for a response that cannot be sent, such as an invalid status.
+    """
+    if not isinstance(result, dict) or "status_code" not in result:
+        return 200, {}, result, False
+
+    try:
+        status_code = int(result["status_code"])
+    except (TypeError, ValueError):
+        status_code = None
+    if status_code is None or not 100 <= status_code <= 599:
+        raise ValueError(f"Function returned an invalid status code: {result['status_code']!r}")
+    headers = {str(key): str(value) for key, value in (result.get("headers") or {}).items()}
+    body = result.get("body")
+    if result.get("is_base64_encoded") and isinstance(body, str):
+        return status_code, headers, base64.b64decode(body), True
+    if isinstance(body, str) or body is None:
+        return status_code, headers, body or "", True
+    return status_code, headers, body, False
@@ -0,0 +1,262 @@
+// Runtime agent for JavaScript functions.
+//
+// Runs inside a pooled container for its whole lifetime. The platform talks to it
+// over stdin/stdout using length-prefixed frames: a 4-byte big-endian length
+// followed by a UTF-8 JSON object. Anything the user code prints goes to stderr,
+// so stdout only ever carries protocol frames. A function that returns an iterator
+// is streamed as one `chunk` frame per item when the request asks for it.
+// A request with `profile` runs the function under the V8 CPU profiler (what
+// `node --cpu-prof` uses, which only writes its profile on exit) and returns
+// its hottest frames with the result.
+const fs = require('fs');
+const inspector = require('inspector');
+const path = require('path');
+const url = require('url');
+const util = require('util');
+
+const CGROUP_DIR = process.env.AGENT_CGROUP_DIR || '/sys/fs/cgroup';
+// Frames returned for a profiled invocation, unless the request asks for a different number
+const PROFILE_TOP = 20;
+const PROFILE_SAMPLING_INTERVAL = 100; // microseconds
+// Pseudo-frames the profiler attributes time to when no JavaScript is running
+const PROFILE_IGNORED = new Set(['(root)', '(program)', '(idle)']);
+const AGENT_URL = url.pathToFileURL(__filename).href;
+
+// Keep the original stdout writer for protocol frames, send everything else to stderr
+const protoWrite = process.stdout.write.bind(process.stdout);
+const logWrite = process.stderr.write.bind(process.stderr);
+process.stdout.write = logWrite;
+for (const level of ['log', 'info', 'debug']) {
+    console[level] = (...args) => logWrite(util.format(...args) + '\n');
+}
+
+function writeFrame(message) {
+    const payload = Buffer.from(JSON.stringify(message), 'utf8');
+    const header = Buffer.alloc(4);
+    header.writeUInt32BE(payload.length, 0);
+    protoWrite(Buffer.concat([header, payload]));
+}
+
+// Per-invocation CPU time and peak memory. CPU time comes from process.cpuUsage();
+// memory from the container's cgroup v2 counters, or this process's RSS without them.
+class UsageMeter {
+    constructor() {
+        this.cgroup = fs.existsSync(path.join(CGROUP_DIR, 'cgroup.controllers'));
+    }
+
+    start() {
+        this.cpu = process.cpuUsage();
+        this.memory = this.memoryCurrent();
+        this.wall = process.hrtime.bigint();
+    }
+
+    stop() {
+        const cpu = process.cpuUsage(this.cpu);
+        const wallTime = Number(process.hrtime.bigint() - this.wall) / 1e9;
+        return {
+            cpu_time: (cpu.user + cpu.system) / 1e6,
+            wall_time: wallTime,
+            memory_peak: Math.max(this.memory, this.memoryCurrent()),
+        };
+    }
+
+    memoryCurrent() {
+        if (this.cgroup) {
+            try {
+                return parseInt(fs.readFileSync(path.join(CGROUP_DIR, 'memory.current'), 'utf8'), 10);
+            } catch (error) {
+                // fall through to RSS
+            }
+        }
+        return process.memoryUsage().rss;
+    }
+}
+
+// CPU profiling over the inspector protocol, in this process
+class Profiler {
+    constructor() {
+        this.session = null;
+    }
+
+    post(method, params) {
+        return new Promise((resolve, reject) => {
+            this.session.post(method, params || {}, (error, result) => (error ? reject(error) : resolve(result)));
+        });
+    }
+
+    async start() {
+        if (this.session === null) {
+            this.session = new inspector.Session();
+            this.session.connect();
+            await this.post('Profiler.enable');
+            await this.post('Profiler.setSamplingInterval', { interval: PROFILE_SAMPLING_INTERVAL });
+        }
+        await this.post('Profiler.start');
+    }
+
+    // The `limit` frames with the most time spent in their own code
+    async stop(limit) {
+        const { profile } = await this.post('Profiler.stop');
+        const parents = new Map();
+        for (const node of profile.nodes) {
+            for (const child of node.children || []) {
+                parents.set(child, node);
+            }
+        }
+        const nodes = new Map(profile.nodes.map((node) => [node.id, node]));
+
+        const frames = new Map();
+        profile.samples.forEach((id, index) => {
+            const stack = [];
+            for (let node = nodes.get(id); node; node = parents.get(node.id)) {
+                stack.push(node);
+            }
+            // Samples taken while talking to the profiler itself are not the function's
+            if (stack.some((node) => node.callFrame.url === AGENT_URL && node.callFrame.functionName === 'post')) {
+                return;
+            }
+            const seconds = (profile.timeDeltas[index] || 0) / 1e6;
+            const counted = new Set(); // recursive calls count once towards total time
+            stack.forEach((node, depth) => {
+                const { functionName, url: file, lineNumber } = node.callFrame;
+                if (PROFILE_IGNORED.has(functionName) || file === AGENT_URL) {
+                    return;
+                }
+                const key = `${functionName}|${file}|${lineNumber}`;
+                const frame = frames.get(key) || {
+                    function: functionName || '(anonymous)', file, line: lineNumber + 1,
+                    samples: 0, self_time: 0, total_time: 0,
+                };
+                if (depth === 0) {
+                    frame.samples += 1;
+                    frame.self_time += seconds;
+                }
+                if (!counted.has(key)) {
+                    counted.add(key);
+                    frame.total_time += seconds;
+                }
+                frames.set(key, frame);
+            });
+        });
+        return [...frames.values()].sort((a, b) => b.self_time - a.self_time).slice(0, limit);
+    }
+}
+
+function isIterator(value) {
+    return value !== null && typeof value === 'object' && typeof value.next === 'function'
+        && (typeof value[Symbol.iterator] === 'function' || typeof value[Symbol.asyncIterator] === 'function');
+}
+
+const usage = new UsageMeter();
+const profiler = new Profiler();
+let main = null;
+
+const handlers = {
+    load(message) {
+        const module = { exports: {} };
+        const factory = new Function(
+            'require', 'module', 'exports', 'console',
+            message.code + '\nreturn typeof main === "function" ? main : (module.exports.main || module.exports);'
+        );
+        const loaded = factory(require, module, module.exports, console);
+        if (typeof loaded !== 'function') {
+            throw new Error('Function code must define main(inputData)');
+        }
+        main = loaded;
+        return { type: 'loaded' };
+    },
+
+    async invoke(message) {
+        if (main === null) {
+            throw new Error('No function code loaded');
+        }
+        if (message.profile) {
+            await profiler.start();
+        }
+        usage.start();
+        let result;
+        let measured;
+        let profile;
+        try {
+            result = await main(message.input || {});
+            if (isIterator(result)) {
+                const items = [];
+                for await (const item of result) {
+                    const data = item === undefined ? null : item;
+                    if (message.stream) {
+                        writeFrame({ type: 'chunk', id: message.id, data });
+                    } else {
+                        items.push(data);
+                    }
+                }
+                result = message.stream ? null : items;
+            }
+        } finally {
+            measured = usage.stop();
+            if (message.profile) {
+                profile = await profiler.stop(message.profile_top || PROFILE_TOP);
+            }
+        }
+        // Serialize here so unsupported return types are reported as function errors
+        JSON.stringify(result);
+        const response = { type: 'result', result: result === undefined ? null : result, usage: measured };
+        if (profile) {
+            response.profile = profile;
+        }
+        return response;
+    },
+};
+
+async function handle(message) {
+    let response;
+    try {
+        const handler = handlers[message.type];
+        if (!handler) {
+            throw new Error(`Unknown message type: ${message.type}`);
+        }
+        response = await handler(message);
+    } catch (error) {
+        console.error(error);
+        response = { type: 'error', error: error && error.message ? error.message : String(error) };
+    }
+    response.id = message.id;
+    writeFrame(response);
+}
+
+// Requests are handled one at a time, in the order they arrive. Incoming chunks
+// are only joined once a whole header or payload is available, so large frames
+// are not copied again for every chunk.
+let chunks = [];
+let buffered = 0;
+let expected = -1; // payload size of the frame being read, once its header is in
+let queue = Promise.resolve();
+
+function take(size) {
+    const data = chunks.length === 1 ? chunks[0] : Buffer.concat(chunks, buffered);
+    const rest = data.subarray(size);
+    chunks = rest.length ? [rest] : [];
+    buffered = rest.length;
+    return data.subarray(0, size);
+}
+
+process.stdin.on('data', (chunk) => {
+    chunks.push(chunk);
+    buffered += chunk.length;
+    for (;;) {
+        if (expected < 0) {
+            if (buffered < 4) {
+                break;
+            }
+            expected = take(4).readUInt32BE(0);
+        }
+        if (buffered < expected) {
+            break;
+        }
+        const message = JSON.parse(take(expected).toString('utf8'));
+        expected = -1;
+        queue = queue.then(() => handle(message));
+    }
+});
+process.stdin.on('end', () => process.exit(0));
+
+writeFrame({ type: 'ready', pid: process.pid, runtime: process.version });
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""Runtime agent for Python functions.
+
+Runs inside a pooled container for its whole lifetime. The platform talks to it
+over stdin/stdout using length-prefixed frames: a 4-byte big-endian length
+followed by a UTF-8 JSON object. Anything the user code prints goes to stderr,
+so stdout only ever carries protocol frames. A function that returns a generator
+is streamed as one ``chunk`` frame per item when the request asks for it.
+A request with ``profile`` runs the function under cProfile and returns its
+hottest frames with the result.
+
+In fork-server mode the loaded function is kept as a template: every
+invocation runs in a forked child that shares the already imported modules
+copy-on-write, so calls cannot see each other's state and still skip imports.
+"""
+import cProfile
+import gc
+import inspect
+import json
+import os
+import pstats
+import resource
+import signal
+import struct
+import sys
+import time
+import traceback
+from contextlib import contextmanager
+
+HEADER = struct.Struct(">I")
+CGROUP_DIR = os.getenv("AGENT_CGROUP_DIR", "/sys/fs/cgroup")
+# Seconds a forked invocation may overrun its deadline before it is killed outright
+FORK_KILL_GRACE = 1.0
+# Frames returned for a profiled invocation, unless the request asks for a different number
+PROFILE_TOP = 20
+
+
+class FunctionTimeout(BaseException):
+    """Raised inside user code when its deadline passes.
+
+    Derives from BaseException so a broad ``except Exception`` in the function
+    does not swallow it.
+    """
+
+
+def _on_alarm(signum, frame):
+    raise FunctionTimeout("Function timed out")
+
+
+@contextmanager
+def deadline(timeout):
+    if timeout:
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def _open_channels():
+    # Keep private copies of the original stdin/stdout for the protocol and
+    # point fds 0/1 elsewhere so user code cannot interfere with the frames.
+    proto_in = os.fdopen(os.dup(0), "rb", buffering=0)
+    proto_out = os.fdopen(os.dup(1), "wb", buffering=0)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    os.dup2(2, 1)
+    return proto_in, proto_out
+
+
+class UsageMeter:
+    """Per-invocation CPU time and peak memory.
+
+    Reads the container's cgroup v2 counters, which also cover any processes the
+    function starts. Falls back to this process's rusage without cgroup v2.
+    """
+
+    def __init__(self):
+        self.cgroup = os.path.exists(os.path.join(CGROUP_DIR, "cgroup.controllers"))
+        self._peak = None
+        self._peak_resettable = False
+        if self.cgroup:
+            # Writing to memory.peak resets it for reads through the same file
+            # descriptor (Linux 6.12+); this fails on a read-only cgroup mount.
+            try:
+                self._peak = open(os.path.join(CGROUP_DIR, "memory.peak"), "r+b", buffering=0)
+                self._peak.write(b"reset")
+                self._peak_resettable = True
+            except OSError:
+                if self._peak is not None:
+                    self._peak.close()
+                self._peak = None
+
+    def start(self):
+        if self._peak_resettable:
+            self._peak.write(b"reset")
+        self._cpu = self._cpu_usec()
+        self._memory = self._memory_current()
+        self._wall = time.monotonic()
+
+    def stop(self):
+        wall_time = time.monotonic() - self._wall
+        cpu_time = (self._cpu_usec() - self._cpu) / 1e6
+        memory = None
+        if self._peak_resettable:
+            self._peak.seek(0)
+            memory = int(self._peak.read().strip() or 0)
+        if not memory:
+            memory = max(self._memory, self._memory_current())
+        return {"cpu_time": cpu_time, "wall_time": wall_time, "memory_peak": memory}
+
+    def _cpu_usec(self):
+        if self.cgroup:
+            try:
+                with open(os.path.join(CGROUP_DIR, "cpu.stat")) as f:
+                    for line in f:
+                        key, value = line.split()
+                        if key == "usage_usec":
+                            return int(value)
+            except (OSError, ValueError):
+                pass
+        total = 0.0
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+            usage = resource.getrusage(who)
+            total += usage.ru_utime + usage.ru_stime
+        return int(total * 1e6)
+
+    def _memory_current(self):
+        if self.cgroup:
+            try:
+                with open(os.path.join(CGROUP_DIR, "memory.current")) as f:
+                    return int(f.read().strip())
+            except (OSError, ValueError):
+                pass
+        # ru_maxrss is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def hot_frames(profiler, limit):
+    """The ``limit`` frames with the most time spent in their own code, leaving out the agent's."""
+    frames = [
+        {"function": name, "file": filename, "line": line, "calls": calls,
+         "self_time": self_time, "total_time": total_time}
+        for (filename, line, name), (_, calls, self_time, total_time, _) in pstats.Stats(profiler).stats.items()
+        if filename not in (__file__, inspect.__file__) and "_lsprof.Profiler" not in name
+    ]
+    frames.sort(key=lambda frame: frame["self_time"], reverse=True)
+    return frames[:limit]
+
+
+def _read_exactly(stream, size):
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = stream.readinto(view[received:])
+        if not count:
+            return None
+        received += count
+    return data
+
+
+def read_frame(stream):
+    header = _read_exactly(stream, HEADER.size)
+    if header is None:
+        return None
+    (size,) = HEADER.unpack(header)
+    payload = _read_exactly(stream, size)
+    if payload is None:
+        return None
+    return json.loads(payload.decode("utf-8"))
+
+
+def write_frame(stream, message):
+    payload = json.dumps(message).encode("utf-8")
+    stream.write(HEADER.pack(len(payload)) + payload)
+
+
+class Agent:
+    HANDLERS = ("load", "invoke")
+
+    def __init__(self, emit):
+        self.main = None
+        self.fork = False
+        self.memory_limit = None
+        self.usage = UsageMeter()
+        self.emit = emit
+
+    def load(self, message):
+        namespace = {"__name__": "function", "json": json, "sys": sys, "os": os}
+        with deadline(message.get("timeout")):
+            exec(compile(message["code"], "/tmp/function.py", "exec"), namespace)
+        main = namespace.get("main")
+        if not callable(main):
+            raise NameError("Function code must define main(input_data)")
+        self.main = main
+        self.fork = bool(message.get("fork")) and hasattr(os, "fork")
+        self.memory_limit = message.get("memory_limit")
+        if self.fork:
+            # Keep the collector from touching the loaded objects, so children share their pages
+            gc.freeze()
+        return {"type": "loaded", "fork": self.fork}
+
+    def invoke(self, message):
+        if self.main is None:
+            raise RuntimeError("No function code loaded")
+        if self.fork:
+            return self._invoke_forked(message)
+        return self._invoke(message)
+
+    def _invoke_forked(self, message):
+        """Run the invocation in a child that answers on its own; returns None once it has."""
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                self._limit_memory()
+                self.emit(respond(self._invoke, message))
+                status = 0
+            finally:
+                sys.stderr.flush()
+                os._exit(status)
+
+        timeout = message.get("timeout")
+        try:
+            # The child interrupts itself at the deadline; this catches one stuck outside Python code
+            with deadline(timeout + FORK_KILL_GRACE if timeout else None):
+                _, status = os.waitpid(pid, 0)
+        except FunctionTimeout:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            raise
+        if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+            return None
+        if os.WIFSIGNALED(status):
+            raise RuntimeError(f"Function process was killed by signal {os.WTERMSIG(status)}"
+                               f"{' (out of memory?)' if os.WTERMSIG(status) == signal.SIGKILL else ''}")
+        raise RuntimeError(f"Function process exited with status {os.WEXITSTATUS(status)}")
+
+    def _limit_memory(self):
+        if not self.memory_limit:
+            return
+        # The child starts out mapping everything the template had, so only growth is capped
+        with open("/proc/self/statm") as f:
+            mapped = int(f.read().split()[0]) * resource.getpagesize()
+        limit = mapped + int(self.memory_limit)
+        # The sandbox may already have set a hard limit, e.g. the process backend without a cgroup,
+        # and it cannot be raised from in here
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    def _invoke(self, message):
+        profiler = cProfile.Profile() if message.get("profile") else None
+        self.usage.start()
+        try:
+            with deadline(message.get("timeout")):
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    result = self.main(message.get("input", {}))
+                    if inspect.isgenerator(result):
+                        result = self._drain(result, message)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+        finally:
+            usage = self.usage.stop()
+        # Serialize here so unsupported return types are reported as function errors
+        json.dumps(result)
+        response = {"type": "result", "result": result, "usage": usage}
+        if profiler is not None:
+            response["profile"] = hot_frames(profiler, message.get("profile_top") or PROFILE_TOP)
+        return response
+
+    def _drain(self, generator, message):
+        if not message.get("stream"):
+            return list(generator)
+        for item in generator:
+            sys.stderr.flush()
+            self.emit({"type": "chunk", "id": message.get("id"), "data": item})
+        return None
+
+    def handle(self, message):
+        if message.get("type") not in self.HANDLERS:
+            raise ValueError(f"Unknown message type: {message.get('type')}")
+        return getattr(self, message["type"])(message)
+
+
+def respond(handler, message):
+    """Run ``handler`` on a request and build the response frame, turning exceptions into errors."""
+    try:
+        response = handler(message)
+    except (Exception, FunctionTimeout) as e:
+        traceback.print_exc()
+        response = {"type": "error", "error": str(e) or type(e).__name__}
+        if isinstance(e, FunctionTimeout):
+            response["timeout"] = True
+    if response is not None:
+        response["id"] = message.get("id")
+    sys.stderr.flush()
+    return response
+
+
+def serve():
+    proto_in, proto_out = _open_channels()
+    signal.signal(signal.SIGALRM, _on_alarm)
+    agent = Agent(lambda message: write_frame(proto_out, message))
+    write_frame(proto_out, {"type": "ready", "pid": os.getpid(), "runtime": sys.version.split()[0]})
+    while True:
+        message = read_frame(proto_in)
+        if message is None:
+            break
+        response = respond(agent.handle, message)
+        # A forked invocation has already answered from the child
+        if response is not None:
+            write_frame(proto_out, response)
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,488 @@
+import os
+import sys
+import abc
+import errno
+import ctypes
+import shutil
+import signal
+import logging
+import platform
+import functools
+import resource
+import subprocess
+import tempfile
+import threading
+from typing import Dict, Any, Optional, Tuple, Callable
+
+import docker
+
+from agent_client import (AGENT_COMMANDS, AGENT_INSTALL_DIR, RUNTIME_DIR, DockerExecTransport, PipeTransport,
+                          agent_archive)
+
+try:
+    import seccomp  # libseccomp's Python bindings, optional
+except ImportError:
+    seccomp = None
+
+# os.unshare only exists from Python 3.12; older interpreters call libc directly
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+try:
+    _libc = ctypes.CDLL(None, use_errno=True) if sys.platform.startswith("linux") else None
+except OSError:
+    _libc = None
+
+logger = logging.getLogger(__name__)
+
+# "docker" runs every function in its own container; "process" runs trusted functions as local
+# sandboxed processes, which starts in milliseconds and needs no Docker daemon; "hosts" spreads
+# containers over the worker hosts in RUNTIME_HOSTS (see scheduler)
+RUNTIME_BACKEND = os.getenv("RUNTIME_BACKEND", "docker")
+
+# Container limits; DOCKER_RUNTIME selects an OCI runtime such as gVisor's "runsc"
+CONTAINER_MEMORY_LIMIT = os.getenv("CONTAINER_MEMORY_LIMIT", "512m")
+CONTAINER_CPU_QUOTA = int(os.getenv("CONTAINER_CPU_QUOTA", "50000"))  # per 100ms period
+DOCKER_RUNTIME = os.getenv("DOCKER_RUNTIME")
+
+PROCESS_SANDBOX_ROOT = os.getenv("PROCESS_SANDBOX_ROOT", os.path.join(tempfile.gettempdir(), "serverless-sandboxes"))
+PROCESS_MEMORY_LIMIT = int(os.getenv("PROCESS_MEMORY_LIMIT", str(512 * 1024 * 1024)))  # bytes
+PROCESS_CPU_QUOTA = int(os.getenv("PROCESS_CPU_QUOTA", "50000"))  # per 100ms period, with a cgroup only
+PROCESS_MAX_FILE_SIZE = int(os.getenv("PROCESS_MAX_FILE_SIZE", str(64 * 1024 * 1024)))  # bytes
+PROCESS_MAX_OPEN_FILES = int(os.getenv("PROCESS_MAX_OPEN_FILES", "256"))
+# A delegated cgroup v2 directory to create one child cgroup per sandbox in, if any
+PROCESS_CGROUP_ROOT = os.getenv("PROCESS_CGROUP_ROOT")
+# Give each sandbox its own user and network namespace when the kernel allows it
+PROCESS_NAMESPACES = os.getenv("PROCESS_NAMESPACES", "true").lower() == "true"
+PROCESS_COMMANDS = {
+    "python": [os.getenv("PROCESS_PYTHON", sys.executable), "-u", os.path.join(RUNTIME_DIR, "agent.py")],
+    "javascript": [os.getenv("PROCESS_NODE", "node"), os.path.join(RUNTIME_DIR, "agent.js")],
+}
+# Syscalls a sandboxed process is refused when seccomp is available
+SECCOMP_DENIED = ["ptrace", "mount", "umount2", "reboot", "kexec_load", "init_module", "finit_module",
+                  "delete_module", "swapon", "swapoff", "pivot_root", "unshare", "setns", "bpf", "perf_event_open"]
+
+
+class SandboxError(RuntimeError):
+    """A sandbox could not be created or its agent started."""
+
+
+class ResourceLimits:
+    """Memory (bytes) and CPU (cores) one sandbox may use."""
+
+    def __init__(self, memory: int, cpu: float):
+        self.memory = int(memory)
+        self.cpu = float(cpu)
+
+    @property
+    def cpu_quota(self) -> int:
+        """CPU time per 100ms period, in microseconds, as Docker and cgroups take it."""
+        return max(1000, int(self.cpu * 100000))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, ResourceLimits) and (self.memory, self.cpu) == (other.memory, other.cpu)
+
+    def __hash__(self) -> int:
+        return hash((self.memory, self.cpu))
+
+    def __repr__(self) -> str:
+        return f"ResourceLimits(memory={self.memory}, cpu={self.cpu})"
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"memory": self.memory, "memory_mb": self.memory // (1024 * 1024), "cpu": self.cpu}
+
+
+# What a sandbox gets when its function has no limits of its own
+DOCKER_DEFAULT_LIMITS = ResourceLimits(docker.utils.parse_bytes(CONTAINER_MEMORY_LIMIT), CONTAINER_CPU_QUOTA / 100000)
+PROCESS_DEFAULT_LIMITS = ResourceLimits(PROCESS_MEMORY_LIMIT, PROCESS_CPU_QUOTA / 100000)
+
+
+class RuntimeBackend(abc.ABC):
+    """Where pooled sandboxes run: the container pool and engine only go through this interface.
+
+    ``create`` makes an empty sandbox, ``exec`` starts the runtime agent in it and
+    returns the transport the agent is driven over, ``destroy`` tears it down.
+    ``errors`` lists backend exceptions that leave a sandbox in an unknown state.
+    Sandboxes run with the ``limits`` they are created with, ``default_limits``
+    when none are given; ``resize`` changes them in place where the backend can,
+    and returns False where the sandbox has to be recreated instead.
+    A backend spread over several worker hosts also reports which host each
+    sandbox is on, so the pool can track them per host and steer clear of one.
+    """
+
+    name = "base"
+    supports_images = False  # whether functions can run in their own dependency images
+    errors: Tuple[type, ...] = ()
+    default_limits = DOCKER_DEFAULT_LIMITS
+
+    def start(self, on_host_lost: Callable[[str], None]):
+        """Begin any background work; ``on_host_lost`` is called with a host that went down or is drained."""
+
+    def shutdown(self):
+        pass
+
+    def ping(self):
+        """Raise if the backend cannot create sandboxes right now."""
+
+    @abc.abstractmethod
+    def create(self, language: str, image: str, name: str, labels: Dict[str, str],
+               avoid_host: Optional[str] = None, limits: Optional[ResourceLimits] = None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def exec(self, sandbox, language: str):
+        raise NotImplementedError
+
+    def resize(self, sandbox, limits: ResourceLimits) -> bool:
+        """Apply new limits to a running sandbox; False if that is not possible."""
+        return False
+
+    @abc.abstractmethod
+    def destroy(self, sandbox):
+        raise NotImplementedError
+
+    def remove_stale(self, label: str):
+        """Remove sandboxes left over from a previous run."""
+
+    def host_of(self, sandbox) -> Optional[str]:
+        """The worker host a sandbox runs on; None for a backend with a single host."""
+        return None
+
+    def check_host(self, host: str) -> bool:
+        """Check a worker host right away, e.g. after a sandbox on it failed; True if it is healthy."""
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+
+class DockerBackend(RuntimeBackend):
+    """One container per sandbox; the agent is started with ``docker exec``."""
+
+    name = "docker"
+    supports_images = True
+    errors = (docker.errors.DockerException,)
+
+    def __init__(self, docker_client=None):
+        try:
+            if docker_client is None:
+                if platform.system() == 'Windows':
+                    # Use Windows named pipe
+                    docker_client = docker.DockerClient(base_url='npipe:////./pipe/docker_engine')
+                else:
+                    docker_client = docker.from_env()
+            # Test connection
+            docker_client.ping()
+            logger.info("Docker is available and running")
+        except Exception as e:
+            logger.error(f"Docker initialization error: {str(e)}")
+            logger.error("The docker runtime backend needs a running Docker daemon; "
+                         "set RUNTIME_BACKEND=process to run without one.")
+            raise RuntimeError(f"Docker is required but not available: {str(e)}")
+        self.docker_client = docker_client
+
+    def ping(self):
+        self.docker_client.ping()
+
+    def create(self, language: str, image: str, name: str, labels: Dict[str, str],
+               avoid_host: Optional[str] = None, limits: Optional[ResourceLimits] = None):
+        limits = limits or self.default_limits
+        options = {}
+        if DOCKER_RUNTIME:
+            options["runtime"] = DOCKER_RUNTIME
+        try:
+            return self.docker_client.containers.run(
+                image,
+                detach=True,
+                name=name,
+                mem_limit=limits.memory,
+                cpu_period=100000,
+                cpu_quota=limits.cpu_quota,
+                tty=True,  # Keep container running
+                command="tail -f /dev/null",  # Keep container alive
+                labels=labels,
+                **options,
+            )
+        except docker.errors.APIError as e:
+            logger.error(f"Docker API error while creating container: {str(e)}")
+            raise SandboxError(f"Failed to create Docker container: {str(e)}")
+
+    def exec(self, container, language: str) -> DockerExecTransport:
+        api = self.docker_client.api
+        container.put_archive(os.path.dirname(AGENT_INSTALL_DIR), agent_archive())
+        exec_id = api.exec_create(
+            container.id,
+            AGENT_COMMANDS[language],
+            stdin=True,
+            stdout=True,
+            stderr=True,
+            tty=False,
+        )["Id"]
+        sock = api.exec_start(exec_id, socket=True, tty=False)
+        # docker-py wraps the raw socket in a SocketIO object on unix hosts
+        return DockerExecTransport(getattr(sock, "_sock", sock))
+
+    def resize(self, container, limits: ResourceLimits) -> bool:
+        try:
+            # Swap stays at Docker's default of as much again as the memory limit
+            container.update(mem_limit=limits.memory, memswap_limit=2 * limits.memory,
+                             cpu_period=100000, cpu_quota=limits.cpu_quota)
+        except docker.errors.APIError as e:
+            # E.g. below what the container already uses, or a runtime that cannot update limits
+            logger.warning(f"Could not resize container {container.id}: {str(e)}")
+            return False
+        return True
+
+    def destroy(self, container):
+        try:
+            container.remove(force=True)
+        except docker.errors.NotFound:
+            pass
+
+    def remove_stale(self, label: str):
+        try:
+            stale = self.docker_client.containers.list(all=True, filters={"label": label})
+        except Exception as e:
+            logger.warning(f"Could not list stale pool containers: {str(e)}")
+            return
+        for container in stale:
+            try:
+                container.remove(force=True)
+                logger.info(f"Removed stale pool container {container.id}")
+            except Exception as e:
+                logger.warning(f"Error removing stale container {container.id}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "runtime": DOCKER_RUNTIME or "default"}
+
+
+class ProcessSandbox:
+    """A working directory, and optionally a cgroup, that one agent process runs confined to."""
+
+    def __init__(self, sandbox_id: str, language: str, workdir: str, cgroup: Optional[str],
+                 limits: ResourceLimits = PROCESS_DEFAULT_LIMITS):
+        self.id = sandbox_id
+        self.language = language
+        self.workdir = workdir
+        self.cgroup = cgroup
+        self.limits = limits
+        self.process: Optional[subprocess.Popen] = None
+
+
+class ProcessBackend(RuntimeBackend):
+    """Runs each sandbox as a local agent process, for trusted or internal functions.
+
+    Much lighter than a container: a sandbox starts in the time it takes to spawn
+    the interpreter, and no Docker daemon is needed, which also suits tests and
+    CI. Isolation is best effort: the process gets its own session, working
+    directory and rlimits, plus a cgroup with memory and CPU limits when
+    ``PROCESS_CGROUP_ROOT`` is delegated to us, fresh user and network
+    namespaces when the kernel allows unprivileged ones, and a seccomp filter
+    when libseccomp's bindings are installed. Functions with dependencies are
+    not supported, as there is no image to install them into. Limits can only
+    be changed in place through the cgroup.
+    """
+
+    name = "process"
+    default_limits = PROCESS_DEFAULT_LIMITS
+
+    def __init__(self, root: str = PROCESS_SANDBOX_ROOT, cgroup_root: Optional[str] = PROCESS_CGROUP_ROOT):
+        self.root = root
+        self.cgroup_root = cgroup_root
+        os.makedirs(self.root, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sandboxes: Dict[str, ProcessSandbox] = {}
+
+    def ping(self):
+        if not os.path.isdir(self.root):
+            raise SandboxError(f"Sandbox root {self.root} is missing")
+
+    def create(self, language: str, image: str, name: str, labels: Dict[str, str],
+               avoid_host: Optional[str] = None, limits: Optional[ResourceLimits] = None) -> ProcessSandbox:
+        if language not in PROCESS_COMMANDS:
+            raise SandboxError(f"Unsupported language: {language}")
+        limits = limits or self.default_limits
+        workdir = os.path.join(self.root, name)
+        os.makedirs(workdir)
+        sandbox = ProcessSandbox(name, language, workdir, self._create_cgroup(name, limits), limits)
+        with self._lock:
+            self._sandboxes[sandbox.id] = sandbox
+        return sandbox
+
+    def exec(self, sandbox: ProcessSandbox, language: str) -> PipeTransport:
+        if sandbox.process is not None:
+            self._kill(sandbox)
+        env = {
+            "PATH": os.environ.get("PATH", "/usr/local/bin:/usr/bin:/bin"),
+            "HOME": sandbox.workdir,
+            "TMPDIR": sandbox.workdir,
+            "LANG": "C.UTF-8",
+            # The agent measures usage from this cgroup; a missing directory makes it fall back to rusage
+            "AGENT_CGROUP_DIR": sandbox.cgroup or os.path.join(sandbox.workdir, ".no-cgroup"),
+        }
+        try:
+            sandbox.process = subprocess.Popen(
+                PROCESS_COMMANDS[language],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=sandbox.workdir,
+                env=env,
+                close_fds=True,
+                start_new_session=True,
+                preexec_fn=functools.partial(_confine, sandbox.cgroup, language, sandbox.limits.memory),
+            )
+        except OSError as e:
+            raise SandboxError(f"Failed to start {language} agent process: {str(e)}")
+        with open(os.path.join(sandbox.workdir, ".pid"), "w") as f:
+            f.write(str(sandbox.process.pid))
+        return PipeTransport(sandbox.process)
+
+    def resize(self, sandbox: ProcessSandbox, limits: ResourceLimits) -> bool:
+        if not sandbox.cgroup:
+            return False  # rlimits are fixed once the agent runs
+        try:
+            _write_cgroup_limits(sandbox.cgroup, limits)
+        except OSError as e:
+            logger.warning(f"Could not resize sandbox {sandbox.id}: {str(e)}")
+            return False
+        sandbox.limits = limits
+        return True
+
+    def destroy(self, sandbox: ProcessSandbox):
+        with self._lock:
+            self._sandboxes.pop(sandbox.id, None)
+        self._kill(sandbox)
+        shutil.rmtree(sandbox.workdir, ignore_errors=True)
+        if sandbox.cgroup:
+            try:
+                os.rmdir(sandbox.cgroup)
+            except OSError as e:
+                logger.warning(f"Could not remove cgroup {sandbox.cgroup}: {str(e)}")
+
+    def remove_stale(self, label: str):
+        for name in os.listdir(self.root):
+            workdir = os.path.join(self.root, name)
+            try:
+                with open(os.path.join(workdir, ".pid")) as f:
+                    pid = int(f.read())
+                # The pid may have been reused since, e.g. after a reboot; only kill our own agent
+                if _is_agent(pid, workdir):
+                    os.killpg(pid, signal.SIGKILL)
+            except (OSError, ValueError):
+                pass
+            shutil.rmtree(workdir, ignore_errors=True)
+            logger.info(f"Removed stale sandbox {name}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            running = sum(1 for s in self._sandboxes.values() if s.process is not None and s.process.poll() is None)
+            return {
+                "backend": self.name,
+                "sandboxes": len(self._sandboxes),
+                "running": running,
+                "cgroup_root": self.cgroup_root,
+                "namespaces": PROCESS_NAMESPACES and (hasattr(os, "unshare") or _libc is not None),
+                "seccomp": seccomp is not None,
+            }
+
+    def _kill(self, sandbox: ProcessSandbox):
+        process = sandbox.process
+        if process is None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Agent process {process.pid} of sandbox {sandbox.id} did not exit")
+        for pipe in (process.stdin, process.stdout, process.stderr):
+            if pipe is not None:
+                pipe.close()
+        sandbox.process = None
+
+    def _create_cgroup(self, name: str, limits: ResourceLimits) -> Optional[str]:
+        if not self.cgroup_root:
+            return None
+        path = os.path.join(self.cgroup_root, name)
+        try:
+            os.mkdir(path)
+            _write_cgroup_limits(path, limits)
+        except OSError as e:
+            logger.warning(f"Could not set up cgroup {path}, running without one: {str(e)}")
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass
+            return None
+        return path
+
+
+def _is_agent(pid: int, workdir: str) -> bool:
+    """Whether ``pid`` is still a runtime agent started in ``workdir``, judged from /proc."""
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            command = f.read().decode(errors="replace").rstrip("\0").split("\0")
+    except OSError:
+        return False
+    if command not in PROCESS_COMMANDS.values():
+        return False
+    try:
+        return os.path.samefile(f"/proc/{pid}/cwd", workdir)
+    except PermissionError:
+        return True  # a namespaced agent's cwd may not be readable; its command line matched
+    except OSError:
+        return False
+
+
+def _write_cgroup_limits(path: str, limits: ResourceLimits):
+    with open(os.path.join(path, "memory.max"), "w") as f:
+        f.write(str(limits.memory))
+    with open(os.path.join(path, "cpu.max"), "w") as f:
+        f.write(f"{limits.cpu_quota} 100000")
+
+
+def _confine(cgroup: Optional[str], language: str, memory_limit: int):
+    """Runs in the forked child before the agent is exec'd. Only async-signal-safe-ish work here."""
+    if cgroup:
+        with open(os.path.join(cgroup, "cgroup.procs"), "w") as f:
+            f.write("0")
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (PROCESS_MAX_FILE_SIZE, PROCESS_MAX_FILE_SIZE))
+    resource.setrlimit(resource.RLIMIT_NOFILE, (PROCESS_MAX_OPEN_FILES, PROCESS_MAX_OPEN_FILES))
+    if language == "python" and not cgroup:
+        # V8 reserves far more address space than it uses, so this only works for Python
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if PROCESS_NAMESPACES:
+        try:
+            _unshare(CLONE_NEWUSER | CLONE_NEWNET)
+        except OSError:
+            pass  # unprivileged user namespaces are disabled on this host
+    if seccomp is not None:
+        syscall_filter = seccomp.SyscallFilter(defaction=seccomp.ALLOW)
+        for syscall in SECCOMP_DENIED:
+            try:
+                syscall_filter.add_rule(seccomp.ERRNO(errno.EPERM), syscall)
+            except (RuntimeError, ValueError):
+                pass  # not a syscall on this architecture
+        syscall_filter.load()
+
+
+def _unshare(flags: int):
+    if hasattr(os, "unshare"):
+        os.unshare(flags)
+    elif _libc is not None and _libc.unshare(flags) != 0:
+        error = ctypes.get_errno()
+        raise OSError(error, os.strerror(error))
+
+
+def create_backend(name: str = RUNTIME_BACKEND) -> RuntimeBackend:
+    if name == "docker":
+        return DockerBackend()
+    if name == "process":
+        return ProcessBackend()
+    if name == "hosts":
+        from scheduler import HostScheduler  # builds on the backends above
+        return HostScheduler.from_spec()
+    raise ValueError(f"Unknown runtime backend: {name}")
@@ -0,0 +1,411 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, Any, Optional, List, Callable, Tuple
+
+import docker
+
+from runtime_backends import (RuntimeBackend, DockerBackend, ProcessBackend, ResourceLimits, SandboxError,
+                              DOCKER_DEFAULT_LIMITS, PROCESS_DEFAULT_LIMITS, PROCESS_SANDBOX_ROOT)
+
+logger = logging.getLogger(__name__)
+
+# Worker hosts for RUNTIME_BACKEND=hosts, comma-separated. Each is a Docker endpoint
+# (unix://, tcp://, ssh://) or "process" for a local stand-in worker, optionally named: "a=tcp://10.0.0.2:2375"
+RUNTIME_HOSTS = os.getenv("RUNTIME_HOSTS", "")
+# Containers each host may run at most; 0 for no limit but its memory. Sandboxes are placed by their memory
+# limits, against the host's memory times HOST_MEMORY_OVERCOMMIT.
+HOST_CAPACITY = int(os.getenv("HOST_CAPACITY", "0"))
+HOST_MEMORY_OVERCOMMIT = float(os.getenv("HOST_MEMORY_OVERCOMMIT", "1.0"))
+# "spread" places a sandbox on the host with the most free memory, "pack" on the fullest one it still fits on
+HOST_PLACEMENT = os.getenv("HOST_PLACEMENT", "spread")
+HOST_HEALTH_INTERVAL = float(os.getenv("HOST_HEALTH_INTERVAL", "10"))  # seconds between health checks
+HOST_FAILURE_THRESHOLD = int(os.getenv("HOST_FAILURE_THRESHOLD", "2"))  # failed checks before a host is down
+# How much placement favours a host that already runs the image or the function, against free capacity (0-1)
+HOST_AFFINITY_WEIGHT = float(os.getenv("HOST_AFFINITY_WEIGHT", "0.25"))
+
+
+class Host:
+    """A worker machine the scheduler places sandboxes on, through its own runtime backend.
+
+    ``up`` hosts take new sandboxes; ``draining`` ones keep what runs on them
+    but get nothing new; ``down`` ones failed their health checks and are
+    reconnected to by the checks until they answer again.
+    """
+
+    def __init__(self, name: str, endpoint: str, connect: Callable[[], RuntimeBackend], capacity: int = HOST_CAPACITY,
+                 default_limits: ResourceLimits = DOCKER_DEFAULT_LIMITS):
+        self.name = name
+        self.endpoint = endpoint
+        self.connect = connect
+        self.backend: Optional[RuntimeBackend] = None
+        self.state = "down"
+        self.draining = False
+        self.capacity = capacity
+        self.memory = 0  # bytes sandboxes may be given in all, known once connected
+        self.default_limits = default_limits
+        # sandbox id -> (image, function id, limits)
+        self.sandboxes: Dict[str, Tuple[str, Optional[str], ResourceLimits]] = {}
+        self.reserved = 0  # sandboxes being created
+        self.reserved_memory = 0  # bytes of sandboxes being created or grown
+        self.orphans: List[Any] = []  # sandboxes whose destroy failed while the host was down
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.last_check: Optional[float] = None
+        self.placements = 0
+
+    @property
+    def schedulable(self) -> bool:
+        return self.state == "up" and not self.draining
+
+    @property
+    def allocated(self) -> int:
+        return sum(limits.memory for _, _, limits in self.sandboxes.values()) + self.reserved_memory
+
+    @property
+    def free_memory(self) -> int:
+        return self.memory - self.allocated
+
+    def fits(self, limits: ResourceLimits) -> bool:
+        if self.capacity and len(self.sandboxes) + self.reserved >= self.capacity:
+            return False
+        return limits.memory <= self.free_memory
+
+    def affinity(self, image: str, function_id: Optional[str]) -> float:
+        """1.0 when this host already runs the function, 0.5 when it has run its image, else 0."""
+        placed = self.sandboxes.values()
+        if function_id is not None and any(function == function_id for _, function, _ in placed):
+            return 1.0
+        if any(placed_image == image for placed_image, _, _ in placed):
+            return 0.5
+        return 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "endpoint": self.endpoint,
+            "state": "draining" if self.draining and self.state == "up" else self.state,
+            "capacity": self.capacity,
+            "memory": self.memory,
+            "memory_allocated": self.allocated,
+            "sandboxes": len(self.sandboxes),
+            "orphans": len(self.orphans),
+            "placements": self.placements,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "last_check": self.last_check,
+            "backend": self.backend.stats() if self.backend is not None else None,
+        }
+
+
+class HostScheduler(RuntimeBackend):
+    """Spreads sandboxes over several worker hosts, so capacity grows by adding machines.
+
+    Hosts are filled by the memory limits of their sandboxes. A new sandbox
+    goes to a schedulable host with room for it: the one with the most free
+    memory, or with ``placement="pack"`` the fullest, so small sandboxes fill
+    the gaps and whole hosts stay free; either way weighted towards hosts that
+    already run the same function or image, whose image and page caches are
+    warm. A sandbox grown past its host's free memory is left for the pool to
+    recreate elsewhere. A host whose create fails is skipped for
+    the next best one. Hosts are health-checked in the background; when one
+    goes down or is drained, ``on_host_lost`` lets the pool drop its
+    containers there. Dependency images are built and pulled on every Docker
+    host that is up at the time.
+    """
+
+    name = "hosts"
+
+    def __init__(self, hosts: List[Host], health_interval: float = HOST_HEALTH_INTERVAL,
+                 failure_threshold: int = HOST_FAILURE_THRESHOLD, affinity_weight: float = HOST_AFFINITY_WEIGHT,
+                 placement: str = HOST_PLACEMENT):
+        if not hosts:
+            raise ValueError("The hosts runtime backend needs at least one host in RUNTIME_HOSTS")
+        if placement not in ("spread", "pack"):
+            raise ValueError(f"Unknown host placement: {placement}")
+        self.hosts: Dict[str, Host] = {host.name: host for host in hosts}
+        self.health_interval = health_interval
+        self.failure_threshold = failure_threshold
+        self.affinity_weight = affinity_weight
+        self.placement = placement
+        self.supports_images = all(host.endpoint != "process" for host in hosts)
+        self.default_limits = DOCKER_DEFAULT_LIMITS if self.supports_images else PROCESS_DEFAULT_LIMITS
+        self.errors = (SandboxError, docker.errors.DockerException)
+        self.docker_client = _FleetDockerClient(self) if self.supports_images else None
+
+        self._lock = threading.Lock()
+        self._placements: Dict[str, Host] = {}  # sandbox id -> host
+        self._on_host_lost: Optional[Callable[[str], None]] = None
+        self._stop = threading.Event()
+        self._checker = None
+        for host in hosts:
+            self._check(host)
+        if not any(host.state == "up" for host in hosts):
+            logger.error("No worker host is reachable yet; invocations fail until one is")
+
+    @classmethod
+    def from_spec(cls, spec: str = RUNTIME_HOSTS) -> "HostScheduler":
+        return cls([_parse_host(entry.strip(), index) for index, entry in enumerate(spec.split(",")) if entry.strip()])
+
+    # ------------------------------------------------------------------ lifecycle
+
+    def start(self, on_host_lost: Callable[[str], None]):
+        self._on_host_lost = on_host_lost
+        self._checker = threading.Thread(target=self._check_loop, name="host-health", daemon=True)
+        self._checker.start()
+
+    def shutdown(self):
+        self._stop.set()
+        if self._checker is not None:
+            self._checker.join(timeout=self.health_interval + 5)
+
+    # ------------------------------------------------------------------ sandboxes
+
+    def create(self, language: str, image: str, name: str, labels: Dict[str, str],
+               avoid_host: Optional[str] = None, limits: Optional[ResourceLimits] = None):
+        function_id = next((value for key, value in labels.items() if key.endswith(".function")), None)
+        tried = {avoid_host}
+        errors = []
+        while True:
+            with self._lock:
+                host = self._best_host(image, function_id, limits, tried)
+                if host is None:
+                    break
+                wanted = limits or host.default_limits
+                host.reserved += 1
+                host.reserved_memory += wanted.memory
+            tried.add(host.name)
+            try:
+                sandbox = host.backend.create(language, image, name, labels, limits=wanted)
+            except Exception as e:
+                with self._lock:
+                    host.reserved -= 1
+                    host.reserved_memory -= wanted.memory
+                logger.warning(f"Creating {language} sandbox on host {host.name} failed: {str(e)}")
+                errors.append(f"{host.name}: {str(e)}")
+                continue
+            with self._lock:
+                host.reserved -= 1
+                host.reserved_memory -= wanted.memory
+                self._placements[sandbox.id] = host
+                host.sandboxes[sandbox.id] = (image, function_id, wanted)
+                host.placements += 1
+            logger.info(f"Placed sandbox {sandbox.id} on host {host.name}")
+            return sandbox
+        if errors:
+            raise SandboxError(f"No host could start a {language} sandbox: {'; '.join(errors)}")
+        raise SandboxError(f"No worker host has free capacity for a {language} sandbox")
+
+    def exec(self, sandbox, language: str):
+        return self._host(sandbox).backend.exec(sandbox, language)
+
+    def resize(self, sandbox, limits: ResourceLimits) -> bool:
+        host = self._host(sandbox)
+        with self._lock:
+            placed = host.sandboxes.get(sandbox.id)
+            if placed is None:
+                return False
+            image, function_id, current = placed
+            growth = max(0, limits.memory - current.memory)
+            if growth > host.free_memory:
+                return False
+            host.reserved_memory += growth
+        resized = False
+        try:
+            resized = host.backend.resize(sandbox, limits)
+        finally:
+            with self._lock:
+                host.reserved_memory -= growth
+                if resized and sandbox.id in host.sandboxes:
+                    host.sandboxes[sandbox.id] = (image, function_id, limits)
+        return resized
+
+    def destroy(self, sandbox):
+        with self._lock:
+            host = self._placements.pop(sandbox.id, None)
+            if host is not None:
+                host.sandboxes.pop(sandbox.id, None)
+        if host is None or host.backend is None:
+            return
+        try:
+            host.backend.destroy(sandbox)
+        except Exception:
+            with self._lock:
+                if host.state == "up":
+                    raise
+                # The host may only be unreachable, not gone; remove the sandbox once it answers again
+                host.orphans.append(sandbox)
+            logger.info(f"Will remove sandbox {sandbox.id} once host {host.name} is back")
+
+    def remove_stale(self, label: str):
+        for host in self.hosts.values():
+            if host.state == "up":
+                try:
+                    host.backend.remove_stale(label)
+                except Exception as e:
+                    logger.warning(f"Could not remove stale sandboxes on host {host.name}: {str(e)}")
+
+    def host_of(self, sandbox) -> Optional[str]:
+        with self._lock:
+            host = self._placements.get(sandbox.id)
+        return host.name if host is not None else None
+
+    def check_host(self, name: str) -> bool:
+        host = self.hosts.get(name)
+        if host is None:
+            return False
+        self._check(host, immediate=True)
+        return host.state == "up"
+
+    def _best_host(self, image: str, function_id: Optional[str], limits: Optional[ResourceLimits],
+                   skip) -> Optional[Host]:
+        # Called with the lock held
+        hosts = [host for host in self.hosts.values()
+                 if host.schedulable and host.name not in skip and host.fits(limits or host.default_limits)]
+
+        def score(host: Host) -> float:
+            free = (host.free_memory - (limits or host.default_limits).memory) / host.memory
+            fit = 1 - free if self.placement == "pack" else free
+            return (1 - self.affinity_weight) * fit + self.affinity_weight * host.affinity(image, function_id)
+
+        return max(hosts, key=score, default=None)
+
+    def _host(self, sandbox) -> Host:
+        with self._lock:
+            host = self._placements.get(sandbox.id)
+        if host is None or host.backend is None:
+            raise SandboxError(f"Sandbox {sandbox.id} is not placed on any host")
+        return host
+
+    # ------------------------------------------------------------------ hosts
+
+    def drain(self, name: str):
+        """Stop placing sandboxes on a host and let the pool retire the ones it has."""
+        host = self._get(name)
+        host.draining = True
+        logger.info(f"Draining host {name}")
+        self._host_lost(host)
+
+    def resume(self, name: str):
+        host = self._get(name)
+        host.draining = False
+        logger.info(f"Host {name} takes new sandboxes again")
+
+    def _get(self, name: str) -> Host:
+        host = self.hosts.get(name)
+        if host is None:
+            raise KeyError(name)
+        return host
+
+    def _check_loop(self):
+        while not self._stop.wait(self.health_interval):
+            for host in list(self.hosts.values()):
+                self._check(host)
+
+    def _check(self, host: Host, immediate: bool = False):
+        """Ping the host, connecting first if needed. ``immediate`` takes it down on the first failure."""
+        host.last_check = time.time()
+        try:
+            backend = host.backend
+            if backend is None:
+                backend = host.connect()
+                memory = _host_memory(backend)
+                with self._lock:
+                    host.backend, host.memory = backend, memory
+            backend.ping()
+        except Exception as e:
+            with self._lock:
+                host.failures += 1
+                host.last_error = str(e)
+                lost = host.state == "up" and (immediate or host.failures >= self.failure_threshold)
+                if lost:
+                    host.state = "down"
+            if lost:
+                logger.error(f"Host {host.name} is down: {str(e)}")
+                self._host_lost(host)
+            return
+        with self._lock:
+            recovered = host.state != "up"
+            host.state = "up"
+            host.failures = 0
+            orphans, host.orphans = host.orphans, []
+        if recovered:
+            logger.info(f"Host {host.name} is up with {host.memory // (1024 * 1024)} MB for sandboxes")
+        for sandbox in orphans:
+            try:
+                backend.destroy(sandbox)
+                logger.info(f"Removed sandbox {sandbox.id} left on host {host.name} while it was down")
+            except Exception as e:
+                logger.warning(f"Could not remove sandbox {sandbox.id} left on host {host.name}: {str(e)}")
+
+    def _host_lost(self, host: Host):
+        if self._on_host_lost is not None:
+            try:
+                self._on_host_lost(host.name)
+            except Exception as e:
+                logger.error(f"Could not retire sandboxes of host {host.name}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": self.name,
+                "placement": self.placement,
+                "hosts": {name: host.stats() for name, host in self.hosts.items()},
+            }
+
+
+class _FleetImages:
+    """``images`` of every Docker host that is up, for the image builder: an image counts as present
+    only when all of them have it, and builds and pulls run on each in turn."""
+
+    def __init__(self, scheduler: HostScheduler):
+        self.scheduler = scheduler
+
+    def _clients(self):
+        clients = [host.backend.docker_client for host in self.scheduler.hosts.values() if host.state == "up"]
+        if not clients:
+            raise docker.errors.APIError("No worker host is up")
+        return clients
+
+    def get(self, name: str):
+        image = None
+        for client in self._clients():
+            image = client.images.get(name)
+        return image
+
+    def pull(self, name: str, **kwargs):
+        image = None
+        for client in self._clients():
+            image = client.images.pull(name, **kwargs)
+        return image
+
+    def build(self, fileobj=None, **kwargs):
+        result = None
+        for client in self._clients():
+            if fileobj is not None:
+                fileobj.seek(0)
+            result = client.images.build(fileobj=fileobj, **kwargs)
+        return result
+
+
+class _FleetDockerClient:
+    def __init__(self, scheduler: HostScheduler):
+        self.images = _FleetImages(scheduler)
+
+
+def _parse_host(entry: str, index: int) -> Host:
+    name, _, endpoint = entry.rpartition("=")
+    name = name or (f"process-{index + 1}" if endpoint == "process" else endpoint.split("://")[-1])
+    if endpoint == "process":
+        root = os.path.join(PROCESS_SANDBOX_ROOT, name)
+        return Host(name, endpoint, lambda: ProcessBackend(root=root), default_limits=PROCESS_DEFAULT_LIMITS)
+    return Host(name, endpoint, lambda: DockerBackend(docker.DockerClient(base_url=endpoint)))
+
+
+def _host_memory(backend: RuntimeBackend) -> int:
+    """Memory the host's sandboxes may be given in all, with overcommit."""
+    if isinstance(backend, DockerBackend):
+        memory = backend.docker_client.info()["MemTotal"]
+    else:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    return int(memory * HOST_MEMORY_OVERCOMMIT)
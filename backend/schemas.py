@@ -1,5 +1,5 @@
-from pydantic import BaseModel, ConfigDict
-from typing import Optional, Dict, Any
+from pydantic import BaseModel, ConfigDict, Field
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 class FunctionBase(BaseModel):
@@ -9,6 +9,12 @@ class FunctionBase(BaseModel):
     code: str
     timeout: int
     environment_variables: Optional[Dict[str, str]] = {}
+    dependencies: Optional[str] = None  # requirements.txt (python) or package.json (javascript)
+    cacheable: bool = False  # only for deterministic functions: repeated inputs are answered from cache
+    cache_ttl: Optional[int] = Field(None, gt=0)  # seconds
+    # Container limits; sized from the function's metrics history when not set
+    memory_limit: Optional[int] = Field(None, ge=16)  # MB
+    cpu_limit: Optional[float] = Field(None, gt=0)    # cores
 
 class FunctionCreate(FunctionBase):
     pass
@@ -20,6 +26,11 @@ class FunctionUpdate(BaseModel):
     code: Optional[str] = None
     timeout: Optional[int] = None
     environment_variables: Optional[Dict[str, str]] = None
+    dependencies: Optional[str] = None
+    cacheable: Optional[bool] = None
+    cache_ttl: Optional[int] = Field(None, gt=0)
+    memory_limit: Optional[int] = Field(None, ge=16)
+    cpu_limit: Optional[float] = Field(None, gt=0)
 
 class Function(FunctionBase):
     id: int
@@ -37,9 +48,75 @@ class FunctionMetrics(BaseModel):
     status: str
     error_message: Optional[str] = None
     timestamp: datetime
+    trace_id: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True)
 
+class Trace(BaseModel):
+    trace_id: str
+    function_id: int
+    status: str
+    timestamp: datetime
+    duration: float
+    spans: List[Dict[str, Any]]
+
 class ExecutionResult(BaseModel):
     result: str
-    metrics: Dict[str, Any] 
\ No newline at end of file
+    metrics: Dict[str, Any]
+
+class MetricsStatistics(BaseModel):
+    avg: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+class MetricsBucket(BaseModel):
+    start: datetime
+    end: datetime
+    count: int
+    errors: int
+    error_rate: float
+    execution_time: MetricsStatistics
+    memory_usage: MetricsStatistics
+
+class MetricsSummary(BaseModel):
+    function_id: int
+    start: datetime
+    end: datetime
+    bucket_seconds: int
+    buckets: List[MetricsBucket]
+
+class InvocationAccepted(BaseModel):
+    invocation_id: str
+    status: str
+    status_url: str
+
+class Invocation(BaseModel):
+    id: str
+    function_id: Optional[int] = None  # unset once the function is deleted
+    status: str
+    result: Optional[Any] = None
+    metrics: Optional[Dict[str, Any]] = None
+    error_message: Optional[str] = None
+    attempts: int
+    max_attempts: int
+    callback_url: Optional[str] = None
+    callback_status: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+class DeadLetter(BaseModel):
+    id: int
+    invocation_id: str
+    function_id: int
+    input: Optional[Any] = None
+    error_message: Optional[str] = None
+    attempts: int
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
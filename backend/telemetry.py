@@ -0,0 +1,132 @@
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Optional
+
+from prometheus_client import Counter, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+logger = logging.getLogger(__name__)
+
+# From sub-millisecond warm paths up to long cold starts and function timeouts, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Stages of an invocation, see execution_engine. A cold start includes the agent start of its
+# new container; "total" is the whole invocation as seen by the engine.
+STAGE_SECONDS = Histogram(
+    "serverless_stage_duration_seconds",
+    "Time spent in each stage of an invocation: pool_acquire (warm), cold_start, agent_start, "
+    "code_load, invoke and total",
+    ["stage", "language"],
+    buckets=LATENCY_BUCKETS,
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "serverless_queue_wait_seconds",
+    "Time invocations wait for an execution slot before running",
+    ["mode"],
+    buckets=LATENCY_BUCKETS,
+)
+INVOCATIONS = Counter(
+    "serverless_invocations_total",
+    "Invocations by function, language and outcome (success, failure or timeout)",
+    ["function_id", "language", "status"],
+)
+INVOCATION_ERRORS = Counter(
+    "serverless_invocation_errors_total",
+    "Failed invocations by function, language and error type",
+    ["function_id", "language", "error"],
+)
+RESULT_CACHE_LOOKUPS = Counter(
+    "serverless_result_cache_lookups_total",
+    "Result cache lookups of cacheable functions, by function and outcome (hit or miss)",
+    ["function_id", "result"],
+)
+HOST_RETRIES = Counter(
+    "serverless_invocation_host_retries_total",
+    "Invocations retried on another worker host, by the host that failed",
+    ["host"],
+)
+REJECTIONS = Counter(
+    "serverless_rejected_invocations_total",
+    "Invocations refused by admission control, by HTTP status",
+    ["function_id", "status_code"],
+)
+
+
+def observe_stage(stage: str, language: str, seconds: float):
+    STAGE_SECONDS.labels(stage, language).observe(seconds)
+
+
+@contextmanager
+def timed(stage: str, language: str):
+    """Observe how long the block takes as ``stage``, whether or not it raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, language, time.perf_counter() - start)
+
+
+def record_invocation(function_id: str, language: str, status: str, error: Optional[Exception] = None):
+    INVOCATIONS.labels(function_id, language, status).inc()
+    if error is not None:
+        INVOCATION_ERRORS.labels(function_id, language, type(error).__name__).inc()
+
+
+class PlatformCollector:
+    """Gauges and counters read from the pool and limiter at scrape time, so the hot path does not update them."""
+
+    def __init__(self, pool_stats: Callable[[], Dict[str, Any]], limiter_stats: Callable[[], Dict[str, Any]]):
+        self.pool_stats = pool_stats
+        self.limiter_stats = limiter_stats
+
+    def describe(self):
+        # Nothing to check for clashes at registration; avoids taking stats before startup has finished
+        return []
+
+    def collect(self):
+        pool = self.pool_stats()
+        containers = GaugeMetricFamily("serverless_pool_containers", "Pooled containers by language and state",
+                                       labels=["language", "state"])
+        for language, stats in pool["languages"].items():
+            for state in ("total", "in_use", "idle", "warm", "starting"):
+                containers.add_metric([language, state], stats[state])
+        yield containers
+
+        replicas = GaugeMetricFamily("serverless_function_replicas", "Containers bound to each function",
+                                     labels=["function_id", "state"])
+        for function_id, stats in pool["functions"].items():
+            replicas.add_metric([function_id, "total"], stats["replicas"])
+            replicas.add_metric([function_id, "in_use"], stats["in_use"])
+        yield replicas
+
+        acquisitions = CounterMetricFamily("serverless_pool_acquisitions", "Container acquisitions by outcome",
+                                           labels=["result"])
+        acquisitions.add_metric(["warm"], pool["hits"])
+        acquisitions.add_metric(["cold"], pool["misses"])
+        acquisitions.add_metric(["prewarmed"], pool["prewarm_hits"])
+        yield acquisitions
+        yield CounterMetricFamily("serverless_pool_evictions", "Idle containers evicted", value=pool["evictions"])
+        yield CounterMetricFamily("serverless_pool_scale_outs", "Replicas added for concurrent calls",
+                                  value=pool["scale_outs"])
+        yield GaugeMetricFamily("serverless_pool_memory_bytes", "Memory limits of all pooled containers",
+                                value=pool["memory"])
+        resizes = CounterMetricFamily("serverless_pool_resizes", "Containers given new limits for their function",
+                                      labels=["method"])
+        resizes.add_metric(["in_place"], pool["resizes"])
+        resizes.add_metric(["recreated"], pool["recreates"])
+        yield resizes
+
+        limiter = self.limiter_stats()
+        yield GaugeMetricFamily("serverless_executions_running", "Invocations running on the execution pool",
+                                value=limiter["running"])
+        yield GaugeMetricFamily("serverless_executions_waiting", "Invocations waiting for an execution slot",
+                                value=limiter["waiting"])
+
+
+def register_platform(pool_stats: Callable[[], Dict[str, Any]], limiter_stats: Callable[[], Dict[str, Any]]):
+    REGISTRY.register(PlatformCollector(pool_stats, limiter_stats))
+
+
+def exposition() -> bytes:
+    return generate_latest(REGISTRY)
@@ -0,0 +1,68 @@
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+
+class Span:
+    """One timed step of an invocation. Times are seconds relative to the start of its trace."""
+
+    def __init__(self, name: str, start: float, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.attributes = dict(attributes or {})
+        self.children: List["Span"] = []
+
+    def as_dict(self, now: float) -> Dict[str, Any]:
+        end = self.end if self.end is not None else now
+        span = {"name": self.name, "start": self.start, "duration": end - self.start}
+        if self.attributes:
+            span["attributes"] = self.attributes
+        if self.children:
+            span["children"] = [child.as_dict(now) for child in self.children]
+        return span
+
+
+class Trace:
+    """Span tree of a single invocation, identified by ``trace_id``.
+
+    An invocation moves between threads but only ever runs one step at a
+    time, so spans nest by the order they are opened and closed.
+    """
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.started = time.perf_counter()  # time.perf_counter() reading span times are relative to
+        self.root = Span("invocation", 0.0)
+        self._stack = [self.root]
+
+    def _now(self) -> float:
+        return time.perf_counter() - self.started
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Time the block as a child of the innermost open span; yields the span to add attributes to."""
+        span = Span(name, self._now(), attributes)
+        self._stack[-1].children.append(span)
+        self._stack.append(span)
+        try:
+            yield span
+        finally:
+            span.end = self._now()
+            self._stack.remove(span)
+
+    def add_span(self, name: str, start: float, end: float, **attributes) -> Span:
+        """Record a step measured elsewhere, from two ``time.perf_counter()`` readings."""
+        span = Span(name, start - self.started, attributes)
+        span.end = end - self.started
+        self._stack[-1].children.append(span)
+        return span
+
+    def finish(self):
+        if self.root.end is None:
+            self.root.end = self._now()
+
+    def as_dict(self) -> Dict[str, Any]:
+        root = self.root.as_dict(self._now())
+        return {"trace_id": self.trace_id, "duration": root["duration"], "spans": root.get("children", [])}